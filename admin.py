@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
+from django.utils import timezone
+from django.db import transaction
 from .models import User, Client, Assignment, LocationLog, ImportLog
+from . import positions
+from .dispatch import dispatcher
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -14,6 +18,17 @@ class UserAdmin(BaseUserAdmin):
         ('Location', {'fields': ('current_latitude', 'current_longitude', 'last_location_update')}),
     )
     
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            positions.apply_to_users([obj])
+        return obj
+    
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        positions.apply_to_users(changelist.result_list)
+        return changelist
+    
     def location_link(self, obj):
         if obj.current_latitude and obj.current_longitude:
             return format_html(
@@ -46,6 +61,12 @@ class ClientAdmin(admin.ModelAdmin):
         }),
     ]
     
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change and obj.status == 'pending':
+            # The dispatcher thread only sees the client once it is committed
+            transaction.on_commit(lambda: dispatcher.clients_added([obj.id]))
+    
     def location_link(self, obj):
         if obj.latitude and obj.longitude:
             return format_html(
@@ -58,12 +79,14 @@ class ClientAdmin(admin.ModelAdmin):
     actions = ['mark_as_pending', 'mark_as_completed']
     
     def mark_as_pending(self, request, queryset):
-        queryset.update(status='pending')
+        client_ids = list(queryset.values_list('id', flat=True))
+        queryset.update(status='pending', updated_at=timezone.now())
+        transaction.on_commit(lambda: dispatcher.clients_added(client_ids))
         self.message_user(request, f"{queryset.count()} clients marked as pending.")
     mark_as_pending.short_description = "Mark selected clients as pending"
     
     def mark_as_completed(self, request, queryset):
-        queryset.update(status='completed')
+        queryset.update(status='completed', updated_at=timezone.now())
         self.message_user(request, f"{queryset.count()} clients marked as completed.")
     mark_as_completed.short_description = "Mark selected clients as completed"
 
@@ -99,10 +122,13 @@ class AssignmentAdmin(admin.ModelAdmin):
     actions = ['reassign_to_pending']
     
     def reassign_to_pending(self, request, queryset):
+        client_ids = []
         for assignment in queryset:
             assignment.client.status = 'pending'
             assignment.client.save()
+            client_ids.append(assignment.client_id)
         queryset.delete()
+        transaction.on_commit(lambda: dispatcher.clients_added(client_ids))
         self.message_user(request, f"{queryset.count()} assignments deleted and clients marked as pending.")
     reassign_to_pending.short_description = "Delete assignments and mark clients as pending"
 
@@ -112,21 +138,29 @@ class LocationLogAdmin(admin.ModelAdmin):
     list_filter = ['agent', 'timestamp']
     search_fields = ['agent__username']
     readonly_fields = ['timestamp']
+    list_select_related = ['agent']
+    # Drilling down by date lets Postgres prune to the matching partitions,
+    # and skipping the unfiltered COUNT(*) keeps the changelist fast
+    date_hierarchy = 'timestamp'
+    show_full_result_count = False
     
     def has_add_permission(self, request):
         return False  # Prevent manual addition of location logs
 
 @admin.register(ImportLog)
 class ImportLogAdmin(admin.ModelAdmin):
-    list_display = ['file_name', 'uploaded_by', 'upload_time', 'total_rows', 'successful_imports', 'failed_imports']
-    list_filter = ['upload_time', 'uploaded_by']
+    list_display = ['file_name', 'uploaded_by', 'upload_time', 'status', 'progress', 'total_rows', 'successful_imports', 'failed_imports']
+    list_filter = ['status', 'upload_time', 'uploaded_by']
     search_fields = ['file_name', 'uploaded_by__username']
-    readonly_fields = ['upload_time']
+    readonly_fields = ['upload_time', 'finished_at']
     
     fieldsets = [
         ('Import Details', {
             'fields': ['file_name', 'uploaded_by', 'upload_time']
         }),
+        ('Progress', {
+            'fields': ['status', 'progress', 'processed_rows', 'finished_at']
+        }),
         ('Results', {
             'fields': ['total_rows', 'successful_imports', 'failed_imports']
         }),
@@ -208,6 +208,50 @@ class FieldOperationsApp {
         });
     }
     
+    decodePolyline(encoded) {
+        // Google polyline format, 5 decimal places
+        const points = [];
+        let index = 0, lat = 0, lng = 0;
+        while (index < encoded.length) {
+            const deltas = [];
+            for (let i = 0; i < 2; i++) {
+                let result = 0, shift = 0, chunk;
+                do {
+                    chunk = encoded.charCodeAt(index++) - 63;
+                    result |= (chunk & 0x1f) << shift;
+                    shift += 5;
+                } while (chunk >= 0x20);
+                deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+            }
+            lat += deltas[0];
+            lng += deltas[1];
+            points.push([lat / 1e5, lng / 1e5]);
+        }
+        return points;
+    }
+
+    showAgentTrack(agentId, hours = 24) {
+        if (!this.managerMap) {
+            return;
+        }
+
+        fetch(`/agent-track/${agentId}/?hours=${hours}`, {credentials: 'same-origin'})
+            .then(response => response.json())
+            .then(track => {
+                if (this.agentTrack) {
+                    this.managerMap.removeLayer(this.agentTrack);
+                }
+                const points = this.decodePolyline(track.polyline || '');
+                if (points.length === 0) {
+                    this.showNotification('No movement recorded in this window', 'info');
+                    return;
+                }
+                this.agentTrack = L.polyline(points, {color: 'purple', weight: 3}).addTo(this.managerMap);
+                this.managerMap.fitBounds(this.agentTrack.getBounds());
+            })
+            .catch(() => this.showNotification('Could not load agent track', 'error'));
+    }
+    
     initAgentMap() {
         if (this.agentMap) {
             this.agentMap.remove();
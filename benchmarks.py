@@ -0,0 +1,700 @@
+"""
+Micro-benchmarks for the operations hot paths.
+
+Run with: python -m operations.benchmarks
+"""
+import math
+import os
+import time
+
+import numpy as np
+
+from .matching import distance_matrix, greedy_match, haversine_matrix, optimal_match
+from .spatial import SpatialIndex
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _random_points(rng, count, center=(12.9716, 77.5946), spread=0.3):
+    lat = center[0] + rng.uniform(-spread, spread, count)
+    lng = center[1] + rng.uniform(-spread, spread, count)
+    return lat, lng
+
+
+def _legacy_distance(client_lat, client_lng, latitude, longitude):
+    # Same formula as Client.distance_from
+    if not all([client_lat, client_lng, latitude, longitude]):
+        return float('inf')
+    lat1, lon1, lat2, lon2 = map(math.radians, [latitude, longitude, client_lat, client_lng])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    return 2 * math.asin(math.sqrt(a)) * 6371
+
+
+def _legacy_greedy(client_lat, client_lng, agent_lat, agent_lng):
+    """The original nested loop from auto_assign_clients, minus the DB calls"""
+    available = list(range(len(agent_lat)))
+    matches = []
+    for row in range(len(client_lat)):
+        if not available:
+            break
+        best_agent = None
+        min_distance = float('inf')
+        for col in available:
+            if agent_lat[col] and agent_lng[col]:
+                distance = _legacy_distance(client_lat[row], client_lng[row], agent_lat[col], agent_lng[col])
+                if distance < min_distance:
+                    min_distance = distance
+                    best_agent = col
+        if best_agent is not None:
+            matches.append((row, best_agent))
+            available.remove(best_agent)
+    return matches
+
+
+def bench_auto_assign(n_clients=5000, n_agents=300, unlocated_agents=0, seed=0):
+    """Compare the vectorized matching engine against the legacy nested loop.
+
+    The legacy timing excludes the two queries per client the view used to
+    issue, so it is a lower bound. Agents without a location keep the legacy
+    loop running over every pending client.
+    """
+    rng = np.random.default_rng(seed)
+    client_lat, client_lng = _random_points(rng, n_clients)
+    agent_lat, agent_lng = _random_points(rng, n_agents)
+    agent_lat[:unlocated_agents] = 0.0
+    agent_lng[:unlocated_agents] = 0.0
+
+    legacy, legacy_time = _timed(
+        _legacy_greedy, client_lat.tolist(), client_lng.tolist(), agent_lat.tolist(), agent_lng.tolist()
+    )
+
+    def engine():
+        return greedy_match(distance_matrix(client_lat, client_lng, agent_lat, agent_lng))
+
+    matches, engine_time = _timed(engine)
+
+    identical = legacy == [(row, col) for row, col, _ in matches]
+    return {
+        'clients': n_clients,
+        'agents': n_agents,
+        'legacy_seconds': legacy_time,
+        'engine_seconds': engine_time,
+        'speedup': legacy_time / engine_time if engine_time else float('inf'),
+        'identical': identical,
+    }
+
+
+def bench_optimal_assign(n_clients=20000, n_agents=1000, seed=0):
+    """Time the chunked optimal mode and compare its total distance with greedy"""
+    rng = np.random.default_rng(seed)
+    client_lat, client_lng = _random_points(rng, n_clients)
+    agent_lat, agent_lng = _random_points(rng, n_agents)
+    priorities = rng.integers(1, 5, n_clients)
+    order = np.argsort(-priorities, kind='stable')
+    client_lat, client_lng, priorities = client_lat[order], client_lng[order], priorities[order]
+
+    distances = distance_matrix(client_lat, client_lng, agent_lat, agent_lng)
+    greedy, greedy_time = _timed(greedy_match, distances)
+    optimal, optimal_time = _timed(
+        optimal_match, distances, priorities, client_lat, client_lng, agent_lat, agent_lng
+    )
+    return {
+        'clients': n_clients,
+        'agents': n_agents,
+        'greedy_seconds': greedy_time,
+        'optimal_seconds': optimal_time,
+        'greedy_distance_km': sum(distance for _, _, distance in greedy),
+        'optimal_distance_km': sum(distance for _, _, distance in optimal),
+    }
+
+
+def bench_spatial_index(n_points=50000, n_queries=1000, k=5, seed=0):
+    """k-nearest lookups through the grid index versus a vectorized full scan"""
+    rng = np.random.default_rng(seed)
+    lat, lng = _random_points(rng, n_points)
+    query_lat, query_lng = _random_points(rng, n_queries)
+
+    index = SpatialIndex()
+    _, build_time = _timed(index.bulk_load, zip(range(n_points), lat, lng))
+
+    def scan():
+        return [
+            np.argsort(haversine_matrix(query_lat[i:i + 1], query_lng[i:i + 1], lat, lng)[0], kind='stable')[:k].tolist()
+            for i in range(n_queries)
+        ]
+
+    def indexed():
+        return [[key for key, _ in index.nearest(query_lat[i], query_lng[i], k)] for i in range(n_queries)]
+
+    expected, scan_time = _timed(scan)
+    found, index_time = _timed(indexed)
+    return {
+        'points': n_points,
+        'queries': n_queries,
+        'build_seconds': build_time,
+        'scan_seconds': scan_time,
+        'index_seconds': index_time,
+        'identical': expected == found,
+    }
+
+
+def _client_sheet(rng, n_rows, invalid_fraction=0.05):
+    import pandas as pd
+
+    lat, lng = _random_points(rng, n_rows)
+    df = pd.DataFrame({
+        'name': [f'Client {i}' for i in range(n_rows)],
+        'phone': rng.integers(6_000_000_000, 9_999_999_999, n_rows),
+        'email': [f'client{i}@example.com' if i % 3 else None for i in range(n_rows)],
+        'address': [f'{i} MG Road, Bangalore' for i in range(n_rows)],
+        'latitude': lat,
+        'longitude': lng,
+        'priority': rng.integers(0, 6, n_rows),
+    })
+    bad = rng.random(n_rows) < invalid_fraction
+    df.loc[bad, 'latitude'] = 'n/a'
+    return df
+
+
+def _legacy_parse(df):
+    """The per-row coercion the old upload view did with iterrows, minus the inserts"""
+    import pandas as pd
+
+    parsed, errors = [], []
+    for index, row in df.iterrows():
+        try:
+            name = str(row['name']).strip()
+            phone = str(row['phone']).strip()
+            address = str(row['address']).strip()
+            latitude = float(row['latitude'])
+            longitude = float(row['longitude'])
+            email = str(row.get('email', '')).strip() if pd.notna(row.get('email')) else ''
+            priority = int(row.get('priority', 2)) if pd.notna(row.get('priority')) else 2
+            if priority not in [1, 2, 3, 4]:
+                priority = 2
+            parsed.append((name, phone, email, address, latitude, longitude, priority))
+        except Exception as e:
+            errors.append(f"Row {index + 2}: {str(e)}")
+    return parsed, errors
+
+
+def bench_client_import(sizes=(10_000, 100_000, 1_000_000), legacy_limit=100_000, insert_limit=100_000, seed=0):
+    """Vectorized sheet validation versus the legacy iterrows loop, and the insert.
+
+    The legacy loop is only timed up to `legacy_limit` rows, and the insert
+    (`write_clients`, COPY on Postgres) up to `insert_limit` rows. Inserted
+    rows are rolled back.
+    """
+    from django.db import transaction
+
+    from .importer import validate_frame, write_clients
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for n_rows in sizes:
+        df = _client_sheet(rng, n_rows)
+        (clean, errors), engine_time = _timed(validate_frame, df)
+        result = {
+            'rows': n_rows,
+            'valid': len(clean),
+            'invalid': len(errors),
+            'engine_seconds': engine_time,
+        }
+        if n_rows <= insert_limit:
+            try:
+                with transaction.atomic():
+                    (written, _), result['insert_seconds'] = _timed(write_clients, clean)
+                    result['inserted'] = written
+                    raise _Rollback
+            except _Rollback:
+                pass
+        if n_rows <= legacy_limit:
+            (_, legacy_errors), legacy_time = _timed(_legacy_parse, df)
+            result['legacy_seconds'] = legacy_time
+            result['same_failures'] = len(legacy_errors) == len(errors)
+        results.append(result)
+    return results
+
+
+def bench_plan_tours(n_clients=4000, n_agents=300, seed=0):
+    """Daily multi-stop planning with straight-line travel times"""
+    from .planning import plan_options, plan_tours
+    from .roads import fallback_travel_times
+
+    def travel_time_matrix(to_lat, to_lng, from_lat, from_lng):
+        return fallback_travel_times(distance_matrix(to_lat, to_lng, from_lat, from_lng))
+
+    rng = np.random.default_rng(seed)
+    client_lat, client_lng = _random_points(rng, n_clients)
+    agent_lat, agent_lng = _random_points(rng, n_agents)
+    priorities = np.sort(rng.integers(1, 5, n_clients))[::-1]
+    (tours, unplanned), seconds = _timed(
+        plan_tours, client_lat, client_lng, priorities, agent_lat, agent_lng, travel_time_matrix
+    )
+    shift = plan_options()['shift_seconds']
+    return {
+        'clients': n_clients,
+        'agents': n_agents,
+        'planned_stops': sum(len(tour) for tour in tours.values()),
+        'unplanned': len(unplanned),
+        'max_stops': max((len(tour) for tour in tours.values()), default=0),
+        'within_shift': all(tour[-1][1] < shift for tour in tours.values()),
+        'plan_seconds': seconds,
+    }
+
+
+class _Rollback(Exception):
+    pass
+
+
+def bench_wire_protocol(batch_sizes=(1, 50, 1000), repeat=200, seed=0):
+    """Bytes and encode time per location_batch frame, JSON text vs packed binary.
+
+    The `*_deflate_bytes` columns compress each frame on its own with zlib,
+    which is roughly what permessage-deflate with no context takeover sends.
+    """
+    import json
+    import zlib
+
+    from .wire import pack_location_batch
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in batch_sizes:
+        lat, lng = _random_points(rng, size)
+        agents = [
+            {
+                'agent_id': 10_000 + i, 'agent_name': f'agent_{i:05d}',
+                'latitude': float(lat[i]), 'longitude': float(lng[i]),
+                'timestamp': '2026-10-18T10:00:00.000Z',
+            }
+            for i in range(size)
+        ]
+        json_frame = json.dumps({'type': 'location_batch', 'data': {'agents': agents}}).encode()
+        binary_frame = b''.join(pack_location_batch(agents))
+        json_seconds = _timed(lambda: [json.dumps({'type': 'location_batch', 'data': {'agents': agents}})
+                                       for _ in range(repeat)])[1] / repeat
+        binary_seconds = _timed(lambda: [pack_location_batch(agents) for _ in range(repeat)])[1] / repeat
+        results.append({
+            'agents': size,
+            'json_bytes': len(json_frame),
+            'binary_bytes': len(binary_frame),
+            'json_deflate_bytes': len(zlib.compress(json_frame)),
+            'binary_deflate_bytes': len(zlib.compress(binary_frame)),
+            'json_encode_us': json_seconds * 1e6,
+            'binary_encode_us': binary_seconds * 1e6,
+        })
+    return results
+
+
+def bench_map_snapshot(n_clients=20_000, zooms=(8, 11, 14), seed=0):
+    """Manager map payload: one JSON object per row vs the columnar snapshot.
+
+    Times building the client index and each zoom level, a cached snapshot
+    request, and the 304 check, which only reads the index version. The
+    seed rows are rolled back afterwards.
+    """
+    import json
+
+    from django.db import transaction
+
+    from .models import Client
+    from . import clustering, snapshot
+
+    rng = np.random.default_rng(seed)
+    lat, lng = _random_points(rng, n_clients)
+    try:
+        with transaction.atomic():
+            Client.objects.bulk_create([
+                Client(name=f'Snapshot client {i}', phone='9000000000', address=f'{i} MG Road, Bangalore',
+                       latitude=lat[i], longitude=lng[i], priority=int(rng.integers(1, 5)))
+                for i in range(n_clients)
+            ], batch_size=5000)
+            legacy = json.dumps(list(Client.objects.values(
+                'id', 'name', 'phone', 'address', 'latitude', 'longitude', 'priority', 'status')), default=str)
+
+            clustering.invalidate()
+            index, index_seconds = _timed(clustering.client_clusters)
+            result = {
+                'clients': n_clients,
+                'build_index_s': index_seconds,
+                'legacy_bytes': len(legacy),
+            }
+            for zoom in (None,) + tuple(zooms):
+                label = 'raw' if zoom is None else f'z{zoom}'
+                result[f'{label}_build_ms'] = _timed(snapshot.client_layer, index, zoom)[1] * 1000
+                body, seconds = _timed(lambda: json.dumps(snapshot.snapshot(index, zoom)))
+                result[f'{label}_bytes'] = len(body)
+                result[f'{label}_ms'] = seconds * 1000
+            result['not_modified_check_ms'] = _timed(
+                lambda: snapshot.snapshot_etag(clustering.client_clusters().version, None)
+            )[1] * 1000
+            raise _Rollback
+    except _Rollback:
+        pass
+    finally:
+        # The index holds the rolled back clients
+        clustering.invalidate()
+    return result
+
+
+def bench_map_tiles(n_clients=20_000, zooms=(8, 11, 14), viewport=(1280, 800), changes=1000, seed=0):
+    """Clustered tiles for one manager viewport, and the cost of a client change.
+
+    The viewport is centred on the clients. `*_bytes` is the JSON of every
+    tile it touches; a change moves a client and flips its status, which
+    re-clusters it at every zoom level.
+    """
+    import json
+
+    from .clustering import TILE_PX, TileClusterIndex, pixel
+
+    rng = np.random.default_rng(seed)
+    lat, lng = _random_points(rng, n_clients)
+    status = rng.integers(0, 3, n_clients)
+    priority = rng.integers(1, 5, n_clients)
+    index = TileClusterIndex(zoom_levels=16, statuses=['pending', 'assigned', 'completed'], counted=('pending',))
+    _, build_seconds = _timed(index.bulk_load, (
+        (i, float(lat[i]), float(lng[i]), int(status[i]), int(priority[i])) for i in range(n_clients)
+    ))
+    result = {'clients': n_clients, 'build_s': build_seconds}
+
+    center_lat, center_lng = float(np.mean(lat)), float(np.mean(lng))
+    for zoom in zooms:
+        cx, cy = pixel(center_lat, center_lng, zoom)
+        tiles = [
+            (x, y)
+            for x in range(int((cx - viewport[0] / 2) // TILE_PX), int((cx + viewport[0] / 2) // TILE_PX) + 1)
+            for y in range(int((cy - viewport[1] / 2) // TILE_PX), int((cy + viewport[1] / 2) // TILE_PX) + 1)
+        ]
+        bodies, seconds = _timed(lambda: [index.tile(zoom, x, y) for x, y in tiles])
+        result[f'z{zoom}_tiles'] = len(tiles)
+        result[f'z{zoom}_bytes'] = sum(len(json.dumps(body)) for body in bodies)
+        result[f'z{zoom}_ms'] = seconds * 1000
+
+    moved = rng.integers(0, n_clients, changes)
+    _, change_seconds = _timed(lambda: [
+        index.move(int(i), float(lat[i]) + 0.001, float(lng[i]), (int(status[i]) + 1) % 3, int(priority[i]))
+        for i in moved
+    ])
+    result['change_us'] = change_seconds / changes * 1e6
+    return result
+
+
+# Mirrors REPORTER in base.html
+LOCATION_REPORTER = {
+    'min_displacement_m': 25,
+    'max_deviation_m': 20,
+    'target_spacing_m': 500,
+    'min_interval_s': 5,
+    'max_interval_s': 120,
+    'heartbeat_s': 600,
+    'moving_speed': 1.5,
+    'stopped_speed': 0.5,
+    'speed_change_factor': 2.0,
+    'max_accuracy_m': 100,
+    'window': 300,
+}
+
+
+def _agent_day(rng, hours=8, jitter_m=4.0):
+    """1 Hz GPS trace of a working day: parked at clients, walking, and driving on a street grid.
+
+    Returns (seconds, true_xy, measured_xy, accuracy, speed) in local metres
+    and m/s; `speed` is the true speed plus Doppler-like noise.
+    """
+    position = np.zeros(2)
+    heading = 0.0
+    true_points = []
+    while len(true_points) < hours * 3600:
+        kind = rng.choice(['parked', 'walk', 'drive'], p=[0.45, 0.15, 0.4])
+        if kind == 'parked':
+            steps, speed = int(rng.integers(15, 60) * 60), 0.0
+        elif kind == 'walk':
+            steps, speed = int(rng.integers(2, 10) * 60), 1.4
+        else:
+            steps, speed = int(rng.integers(5, 25) * 60), float(rng.uniform(6, 14))
+        leg_left = 0
+        for _ in range(steps):
+            if speed and leg_left <= 0:
+                # Mostly right-angle turns every few hundred metres
+                heading += float(rng.choice([-90, 0, 90]))
+                leg_left = int(rng.integers(20, 90))
+            leg_left -= 1
+            position = position + speed * np.array([np.cos(np.radians(heading)), np.sin(np.radians(heading))])
+            true_points.append(position)
+    true_xy = np.array(true_points[:hours * 3600])
+    measured_xy = true_xy + rng.normal(0, jitter_m, true_xy.shape)
+    accuracy = rng.uniform(5, 15, len(true_xy))
+    speed = np.r_[0.0, np.hypot(*np.diff(true_xy, axis=0).T)] + np.abs(rng.normal(0, 0.2, len(true_xy)))
+    return np.arange(len(true_xy), dtype=float), true_xy, measured_xy, accuracy, speed
+
+
+def _segment_deviation(points, start, end):
+    """Largest distance from `points` to the segment start-end"""
+    direction = end - start
+    length = float(direction @ direction)
+    t = np.clip((points - start) @ direction / length, 0, 1) if length else np.zeros(len(points))
+    return float(np.hypot(*(points - start - t[:, None] * direction).T).max())
+
+
+def _adaptive_reports(seconds, xy, accuracy, speed, options=LOCATION_REPORTER):
+    """Indices of the fixes the base.html reporter would send"""
+    reported = [0]
+    reported_speed = speed[0]
+    moving = False
+    window = []
+    for i in range(1, len(seconds)):
+        last = reported[-1]
+        elapsed = seconds[i] - seconds[last]
+        started = not moving and speed[i] >= options['moving_speed']
+        stopped = moving and speed[i] < options['stopped_speed']
+        moving = (moving or started) and not stopped
+        report = None
+        if elapsed >= options['heartbeat_s']:
+            report = i
+        elif accuracy[i] > options['max_accuracy_m']:
+            continue
+        elif (started or stopped) and elapsed >= options['min_interval_s']:
+            report = i
+        elif (
+            moving and elapsed >= options['min_interval_s']
+            and max(speed[i], reported_speed) >= options['speed_change_factor'] * max(min(speed[i], reported_speed), 0.1)
+        ):
+            report = i
+        elif window and _segment_deviation(xy[window], xy[last], xy[i]) > max(options['max_deviation_m'], accuracy[i]):
+            # The straight line no longer explains the fixes since the last report: send the corner
+            report = window[-1]
+        elif np.hypot(*(xy[i] - xy[last])) >= max(options['min_displacement_m'], accuracy[i]):
+            interval = (
+                min(max(options['target_spacing_m'] / speed[i], options['min_interval_s']), options['max_interval_s'])
+                if moving else options['max_interval_s']
+            )
+            if elapsed >= interval:
+                report = i
+
+        if report is None:
+            window = (window + [i])[-options['window']:]
+            continue
+        reported.append(report)
+        reported_speed = speed[report]
+        window = [i] if report != i else []
+    return np.array(reported)
+
+
+def _trail_error(seconds, true_xy, reported_xy, reported_seconds):
+    """Distance from the true position to the trail interpolated from reported fixes, every second.
+
+    Stops at the last report; what follows is still on its way to the server.
+    """
+    covered = seconds <= reported_seconds[-1]
+    x = np.interp(seconds[covered], reported_seconds, reported_xy[:, 0])
+    y = np.interp(seconds[covered], reported_seconds, reported_xy[:, 1])
+    return np.hypot(true_xy[covered, 0] - x, true_xy[covered, 1] - y)
+
+
+def bench_location_reporting(agents=20, hours=8, seed=0):
+    """Fixes ingested per agent-day and trail error, fixed 30 s timer vs the adaptive reporter.
+
+    The old page sent every 30 s fix twice, over the socket and as an AJAX
+    backup, so both copies are counted. Trail error is the distance between
+    the true position and the trail interpolated from the stored fixes.
+    """
+    rng = np.random.default_rng(seed)
+    fixed_fixes = adaptive_fixes = 0
+    fixed_errors, adaptive_errors = [], []
+    for _ in range(agents):
+        seconds, true_xy, measured_xy, accuracy, speed = _agent_day(rng, hours)
+        fixed = np.arange(0, len(seconds), 30)
+        adaptive = _adaptive_reports(seconds, measured_xy, accuracy, speed)
+        fixed_fixes += 2 * len(fixed)
+        adaptive_fixes += len(adaptive)
+        fixed_errors.append(_trail_error(seconds, true_xy, measured_xy[fixed], seconds[fixed]))
+        adaptive_errors.append(_trail_error(seconds, true_xy, measured_xy[adaptive], seconds[adaptive]))
+    fixed_errors = np.concatenate(fixed_errors)
+    adaptive_errors = np.concatenate(adaptive_errors)
+    return {
+        'fixed_fixes_per_agent_day': fixed_fixes / agents,
+        'adaptive_fixes_per_agent_day': adaptive_fixes / agents,
+        'reduction': fixed_fixes / adaptive_fixes,
+        'fixed_error_p50_m': float(np.percentile(fixed_errors, 50)),
+        'adaptive_error_p50_m': float(np.percentile(adaptive_errors, 50)),
+        'fixed_error_p95_m': float(np.percentile(fixed_errors, 95)),
+        'adaptive_error_p95_m': float(np.percentile(adaptive_errors, 95)),
+        'fixed_error_max_m': float(fixed_errors.max()),
+        'adaptive_error_max_m': float(adaptive_errors.max()),
+    }
+
+
+class _NullLayer:
+    """Channel layer that drops every message, so socket benchmarks measure the consumer"""
+
+    extensions = ['groups']
+
+    def __init__(self, **kwargs):
+        self._channels = 0
+
+    async def new_channel(self, prefix='specific.'):
+        self._channels += 1
+        return f'{prefix}null!{self._channels}'
+
+    async def receive(self, channel):
+        import asyncio
+
+        # Nothing is ever delivered; the consumer cancels this on disconnect
+        await asyncio.get_running_loop().create_future()
+
+    async def send(self, channel, message):
+        pass
+
+    async def group_add(self, group, channel):
+        pass
+
+    async def group_discard(self, group, channel):
+        pass
+
+    async def group_send(self, group, message):
+        pass
+
+
+def _legacy_consumer():
+    """The consumer as it was: one database_sync_to_async hop per status message"""
+    from channels.db import database_sync_to_async
+
+    from .consumers import AgentConsumer
+    from .ingestion import apply_status_updates
+
+    class LegacyConsumer(AgentConsumer):
+        @database_sync_to_async
+        def update_assignment_status(self, assignment_id, status):
+            return apply_status_updates([(self.user.id, int(assignment_id), status)])[0]
+
+    return LegacyConsumer
+
+
+async def _drive_sockets(consumer, agents, assignment_ids, messages):
+    """Connect one socket per agent, send `messages` status updates each, and wait for all of them"""
+    import asyncio
+    import json
+
+    from asgiref.testing import ApplicationCommunicator
+
+    application = consumer.as_asgi()
+
+    async def receive_json(socket):
+        return json.loads((await socket.receive_output(timeout=120))['text'])
+
+    async def send_json(socket, data):
+        await socket.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    sockets = []
+    for agent in agents:
+        socket = ApplicationCommunicator(application, {
+            'type': 'websocket', 'path': '/ws/', 'headers': [], 'subprotocols': [], 'user': agent,
+        })
+        await socket.send_input({'type': 'websocket.connect'})
+        await socket.receive_output(timeout=10)
+        await receive_json(socket)
+        sockets.append(socket)
+
+    async def run(socket, assignment_id):
+        for i in range(messages):
+            status = ('accepted', 'in_progress')[i % 2]
+            await send_json(socket, {'type': 'status_update', 'assignment_id': assignment_id, 'status': status})
+        # Messages are handled in order, so the pong means every update was written
+        await send_json(socket, {'type': 'ping'})
+        while (await receive_json(socket))['type'] != 'pong':
+            pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(socket, assignment_id) for socket, assignment_id in zip(sockets, assignment_ids)))
+    seconds = time.perf_counter() - start
+    for socket in sockets:
+        await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await socket.wait(timeout=10)
+    return seconds
+
+
+def bench_consumer_throughput(socket_counts=(1000, 5000), messages=4, seed=0):
+    """Status updates handled per second by one process, per-message hops vs the batched writer.
+
+    Opens one in-process WebSocket per agent, each with an open assignment,
+    and has every socket send `messages` status updates at once. Group
+    messages go to a layer that drops them. The seed rows are deleted
+    afterwards.
+    """
+    import asyncio
+
+    from django.test import override_settings
+
+    from .consumers import AgentConsumer
+    from .models import Assignment, Client, User
+
+    results = []
+    for sockets in socket_counts:
+        agents = User.objects.bulk_create([
+            User(username=f'socket_agent_{seed}_{i}', user_type='agent', is_active_agent=True)
+            for i in range(sockets)
+        ], batch_size=5000)
+        clients = Client.objects.bulk_create([
+            Client(name=f'Socket client {i}', phone='9000000000', address='MG Road', latitude=12.97, longitude=77.59)
+            for i in range(sockets)
+        ], batch_size=5000)
+        try:
+            row = {'sockets': sockets, 'messages': sockets * messages}
+            null_layer = {'default': {'BACKEND': f'{__name__}._NullLayer'}}
+            with override_settings(DISPATCH_ENABLED=False, CHANNEL_LAYERS=null_layer):
+                for name, consumer in (('legacy', _legacy_consumer()), ('batched', AgentConsumer)):
+                    Assignment.objects.filter(agent__in=agents).delete()
+                    assignments = Assignment.objects.bulk_create([
+                        Assignment(agent=agent, client=client) for agent, client in zip(agents, clients)
+                    ], batch_size=5000)
+                    seconds = asyncio.run(_drive_sockets(consumer, agents, [a.id for a in assignments], messages))
+                    row[f'{name}_msgs_per_s'] = row['messages'] / seconds
+            row['speedup'] = row['batched_msgs_per_s'] / row['legacy_msgs_per_s']
+            results.append(row)
+        finally:
+            Assignment.objects.filter(agent__in=agents).delete()
+            Client.objects.filter(id__in=[client.id for client in clients]).delete()
+            User.objects.filter(id__in=[agent.id for agent in agents]).delete()
+    return results
+
+
+def _report(name, result):
+    details = ', '.join(
+        f'{key}={value:.4f}' if isinstance(value, float) else f'{key}={value}'
+        for key, value in result.items()
+    )
+    print(f'{name}: {details}')
+
+
+def main():
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'field_ops_system.settings')
+    django.setup()
+
+    _report('auto_assign', bench_auto_assign())
+    _report('auto_assign (unlocated agents)', bench_auto_assign(unlocated_agents=30))
+    _report('optimal_assign', bench_optimal_assign())
+    _report('spatial_index', bench_spatial_index())
+    for result in bench_client_import():
+        _report('client_import', result)
+    _report('plan_tours', bench_plan_tours())
+    _report('map_snapshot', bench_map_snapshot())
+    _report('map_tiles', bench_map_tiles())
+    _report('location_reporting', bench_location_reporting())
+    for result in bench_wire_protocol():
+        _report('wire_protocol', result)
+    for result in bench_consumer_throughput():
+        _report('consumer_throughput', result)
+
+
+if __name__ == '__main__':
+    main()
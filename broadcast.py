@@ -0,0 +1,172 @@
+import asyncio
+import logging
+
+import numpy as np
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+from .matching import haversine_pairs
+from .spatial import geohash_encode, geohash_tiles
+from .wire import pack_location_batch
+
+logger = logging.getLogger(__name__)
+
+
+# Managers without a viewport receive every agent through this group
+ALL_LOCATIONS_GROUP = 'manager_locations'
+
+SUBSCRIBERS_PREFIX = 'location_subscribers'
+
+
+def tile_precisions():
+    return tuple(settings.LOCATION_TILE_PRECISIONS)
+
+
+def tile_group(geohash):
+    return f'locations_{geohash}'
+
+
+def viewport_groups(south, west, north, east):
+    """Channel groups a manager looking at this bounding box should join.
+
+    Uses the finest tile precision that covers the box with at most
+    MAX_VIEWPORT_TILES tiles, or the all-locations group if none does.
+    """
+    limit = settings.MAX_VIEWPORT_TILES
+    for precision in sorted(tile_precisions(), reverse=True):
+        tiles = geohash_tiles(south, west, north, east, precision, limit=limit)
+        if tiles is not None:
+            return {tile_group(tile) for tile in tiles}
+    return {ALL_LOCATIONS_GROUP}
+
+
+def _subscribers_key(group):
+    return f'{SUBSCRIBERS_PREFIX}:{group}'
+
+
+async def subscribe(groups):
+    """Count one more socket in each location group, across all processes"""
+    for group in groups:
+        key = _subscribers_key(group)
+        await cache.aadd(key, 0, timeout=None)
+        await cache.aincr(key)
+
+
+async def unsubscribe(groups):
+    for group in groups:
+        try:
+            await cache.adecr(_subscribers_key(group))
+        except ValueError:
+            # Counter evicted; it reads as no subscribers anyway
+            pass
+
+
+async def subscribed(groups):
+    """The groups that at least one socket, in any process, has joined"""
+    counts = await cache.aget_many([_subscribers_key(group) for group in groups])
+    return [group for group in groups if counts.get(_subscribers_key(group), 0) > 0]
+
+
+class LocationAggregator:
+    """Coalesces agent location updates into one frame per tick and map tile.
+
+    Consumers call `add()` for every fix. Every `tick` seconds the latest fix
+    of each agent that moved at least `min_distance_m` since it was last
+    broadcast is sent as a `location_batch` event: once to the all-locations
+    group, and once per geohash tile group (at each configured precision)
+    holding only the agents inside that tile. Groups no socket has joined
+    are skipped, so neither a frame nor a publish is spent on them. One
+    aggregator runs per ASGI process.
+    """
+
+    def __init__(self, group=ALL_LOCATIONS_GROUP, tick=None, min_distance_m=None):
+        self.group = group
+        self.tick = tick or settings.LOCATION_BROADCAST_TICK
+        self.min_distance_m = (
+            min_distance_m if min_distance_m is not None
+            else settings.LOCATION_BROADCAST_MIN_DISTANCE_M
+        )
+        self._pending = {}
+        self._last_sent = {}
+        self._task = None
+
+    def add(self, agent_id, agent_name, latitude, longitude, timestamp=None):
+        """Record the latest fix for an agent; must be called from the event loop"""
+        self._pending[agent_id] = {
+            'agent_id': agent_id,
+            'agent_name': agent_name,
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': timestamp,
+        }
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def collect(self):
+        """Take the pending fixes that moved far enough to be worth sending"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return []
+
+        updates = list(pending.values())
+        previous = [self._last_sent.get(update['agent_id']) for update in updates]
+        known = [i for i, prev in enumerate(previous) if prev is not None]
+        moved = np.ones(len(updates), dtype=bool)
+        if known:
+            distances = haversine_pairs(
+                np.array([float(updates[i]['latitude']) for i in known]),
+                np.array([float(updates[i]['longitude']) for i in known]),
+                np.array([previous[i][0] for i in known]),
+                np.array([previous[i][1] for i in known]),
+            )
+            moved[known] = distances * 1000 >= self.min_distance_m
+
+        batch = [update for update, keep in zip(updates, moved) if keep]
+        for update in batch:
+            self._last_sent[update['agent_id']] = (float(update['latitude']), float(update['longitude']))
+        return batch
+
+    async def _run(self):
+        channel_layer = get_channel_layer()
+        while True:
+            await asyncio.sleep(self.tick)
+            batch = self.collect()
+            if not batch:
+                if not self._pending:
+                    # Idle; the next add() starts a new loop
+                    return
+                continue
+            groups = self.partition(batch)
+            try:
+                live = await subscribed(list(groups))
+            except Exception:
+                logger.exception("Failed to read location subscribers")
+                live = list(groups)
+            for group in live:
+                agents = groups[group]
+                try:
+                    await channel_layer.group_send(group, {
+                        'type': 'location_batch',
+                        'message': {'agents': agents},
+                        # Packed once here rather than once per binary socket
+                        'packed': pack_location_batch(agents),
+                    })
+                except Exception:
+                    logger.exception("Failed to broadcast %d agent locations to %s", len(agents), group)
+
+    def partition(self, batch):
+        """Split a batch into {group: agents} for the all-locations and tile groups"""
+        groups = {self.group: batch}
+        precisions = tile_precisions()
+        if not precisions:
+            return groups
+        finest = max(precisions)
+        for update in batch:
+            geohash = geohash_encode(float(update['latitude']), float(update['longitude']), finest)
+            for precision in precisions:
+                groups.setdefault(tile_group(geohash[:precision]), []).append(update)
+        return groups
+
+
+location_aggregator = LocationAggregator()
@@ -0,0 +1,128 @@
+"""
+Change feed for the manager dashboard.
+
+A version is a server timestamp in integer microseconds. Given the version
+of its last sync, a dashboard gets back only the clients and assignments
+whose `updated_at` is newer, plus the agents that moved or whose current
+assignment changed. It also gets a new version to send next time. Rows
+are re-read from CHANGE_FEED_OVERLAP seconds before `since`. Writes that
+committed after the previous sync, with an earlier timestamp, are not
+missed. Re-applying a row the dashboard already has is harmless.
+
+When the gap is older than CHANGE_FEED_MAX_AGE, or more than
+CHANGE_FEED_LIMIT rows of one kind changed (a bulk import), the feed
+answers `reset` and the dashboard reloads instead. Deleted rows are not
+reported.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import F, Prefetch
+from django.utils import timezone
+
+from . import positions
+from .models import Assignment, Client, User
+from .stats import ACTIVE_ASSIGNMENT_STATUSES, dashboard_stats
+
+
+def to_version(moment):
+    return int(moment.timestamp() * 1_000_000)
+
+
+def from_version(version):
+    return datetime.fromtimestamp(version / 1_000_000, dt_timezone.utc)
+
+
+def current_version():
+    return to_version(timezone.now())
+
+
+def _assignment_row(assignment):
+    return {
+        'id': assignment.id,
+        'agent_id': assignment.agent_id,
+        'agent_name': assignment.agent.username,
+        'client_id': assignment.client_id,
+        'client_name': assignment.client.name,
+        'client_phone': assignment.client.phone,
+        'priority': assignment.client.priority,
+        'priority_display': assignment.client.get_priority_display(),
+        'status': assignment.status,
+        'status_display': assignment.get_status_display(),
+        'assigned_at': assignment.assigned_at.isoformat(),
+        'updated_at': assignment.updated_at.isoformat(),
+    }
+
+
+def _agent_rows(agent_ids):
+    agents = positions.apply_to_users(
+        User.objects.filter(id__in=agent_ids, user_type='agent').prefetch_related(
+            Prefetch(
+                'assignments',
+                queryset=Assignment.objects.filter(
+                    status__in=ACTIVE_ASSIGNMENT_STATUSES
+                ).select_related('client').order_by(F('sequence').asc(nulls_first=True), '-assigned_at'),
+                to_attr='active_assignments'
+            )
+        )
+    )
+    rows = []
+    for agent in agents:
+        current = agent.active_assignments[0] if agent.active_assignments else None
+        rows.append({
+            'id': agent.id,
+            'username': agent.username,
+            'is_active_agent': agent.is_active_agent,
+            'latitude': agent.current_latitude,
+            'longitude': agent.current_longitude,
+            'last_update': agent.last_location_update.isoformat() if agent.last_location_update else None,
+            'current_assignment': {
+                'id': current.id,
+                'client_name': current.client.name,
+                'status': current.status,
+                'status_display': current.get_status_display(),
+            } if current else None,
+        })
+    return rows
+
+
+def changes_since(since):
+    """Everything that changed after version `since`, or a reset"""
+    version = current_version()
+    limit = settings.CHANGE_FEED_LIMIT
+    # A version from the future or before the epoch was never handed out
+    if since is None or not 0 < since <= version or version - since > settings.CHANGE_FEED_MAX_AGE * 1_000_000:
+        return {'version': version, 'reset': True}
+    cutoff = from_version(since) - timedelta(seconds=settings.CHANGE_FEED_OVERLAP)
+
+    clients = list(
+        Client.objects.filter(updated_at__gte=cutoff).order_by('updated_at')
+        .values('id', 'name', 'status', 'priority', 'latitude', 'longitude', 'updated_at')[:limit + 1]
+    )
+    assignments = list(
+        Assignment.objects.filter(updated_at__gte=cutoff).select_related('agent', 'client')
+        .order_by('updated_at')[:limit + 1]
+    )
+    if len(clients) > limit or len(assignments) > limit:
+        return {'version': version, 'reset': True}
+
+    # Agents whose current assignment or position changed
+    agent_ids = {assignment.agent_id for assignment in assignments}
+    active = list(User.objects.filter(user_type='agent', is_active_agent=True).values_list('id', 'last_location_update'))
+    live = positions.get_positions(agent_id for agent_id, _ in active)
+    for agent_id, last_update in active:
+        fix = live.get(agent_id)
+        moved_at = fix['timestamp'] if fix is not None else last_update
+        if moved_at is not None and moved_at >= cutoff:
+            agent_ids.add(agent_id)
+
+    for client in clients:
+        client['updated_at'] = client['updated_at'].isoformat()
+    return {
+        'version': version,
+        'reset': False,
+        'clients': clients,
+        'assignments': [_assignment_row(assignment) for assignment in assignments],
+        'agents': _agent_rows(agent_ids) if agent_ids else [],
+        'stats': dashboard_stats(),
+    }
@@ -0,0 +1,364 @@
+"""
+Server-side marker clustering served per (z, x, y) map tile.
+
+Every zoom level from 0 to MAP_SNAPSHOT_MAX_ZOOM is a Web Mercator grid
+of CELL_PX pixel cells, 4 x 4 to a 256px tile. Each cell keeps running
+totals for its members (count, coordinate sums, per-status and
+per-priority counts). A point can then be added, moved or removed in
+O(zoom levels), and a tile request reads at most 16 cells, whatever the
+number of points below them. Past the deepest level a tile lists its
+points individually. A tile's version is its member count and the XOR of
+a digest of each member (key, position, status, priority). It is updated
+with every change in O(1) and depends only on the data, so every process
+serving the same clients agrees on it and ETags match across workers.
+The index as a whole is versioned the same way.
+
+Each process keeps one index of open clients and one of agents. The client
+index is synced at most every MAP_CLUSTER_SYNC_INTERVAL seconds from
+the rows whose `updated_at` moved past its watermark, so only changed
+clients are re-clustered; clients that were closed drop out. Deletions
+are picked up by the full rebuild every MAP_CLUSTER_REBUILD_SECONDS,
+which loads a fresh index and swaps it in. Agents are few and move
+constantly; their index is refreshed from the live positions.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+TILE_PX = 256
+CELL_PX = 64
+CELLS_PER_TILE_SHIFT = 2  # log2(TILE_PX // CELL_PX)
+MAX_LATITUDE = 85.05112878
+
+# Finished clients are left off the map
+CLOSED_STATUSES = ('completed', 'cancelled')
+
+# Rows committed slightly out of updated_at order are caught by re-reading
+# this much before the watermark; re-applying an unchanged row is a no-op
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def max_zoom():
+    return settings.MAP_SNAPSHOT_MAX_ZOOM
+
+
+def point_digest(key, lat, lng, status, priority):
+    """Stable 64-bit digest of a point; the same in every process"""
+    data = repr((key, lat, lng, status, priority)).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def pixel(lat, lng, zoom):
+    """Web Mercator pixel coordinates of a point at `zoom`"""
+    size = TILE_PX * 2 ** zoom
+    sin = math.sin(math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))))
+    x = (lng + 180.0) / 360.0 * size
+    y = (0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * size
+    return x, y
+
+
+class _Cell:
+    __slots__ = ('count', 'sum_lat', 'sum_lng', 'status_counts', 'priority_counts', 'members')
+
+    def __init__(self, n_statuses):
+        self.count = 0
+        self.sum_lat = 0.0
+        self.sum_lng = 0.0
+        self.status_counts = [0] * n_statuses
+        self.priority_counts = {}
+        self.members = set()
+
+
+class TileClusterIndex:
+    """Grid clusters of points at every zoom level, updated incrementally.
+
+    Points carry a status code (an index into `statuses`) and a priority.
+    Clusters report how many members have each status in `counted` and
+    the highest member priority.
+    """
+
+    def __init__(self, zoom_levels=None, statuses=(), counted=()):
+        self.max_zoom = max_zoom() if zoom_levels is None else zoom_levels
+        self.statuses = list(statuses)
+        self.counted = [(name, self.statuses.index(name)) for name in counted]
+        self._lock = threading.RLock()
+        self.clear()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def keys(self):
+        with self._lock:
+            return list(self._points)
+
+    def clear(self):
+        with self._lock:
+            self._points = {}
+            self._tiles = [{} for _ in range(self.max_zoom + 1)]
+            self._versions = [{} for _ in range(self.max_zoom + 1)]
+            self._digest = 0
+
+    def _cells_for(self, lat, lng):
+        x, y = pixel(lat, lng, self.max_zoom)
+        cx, cy = int(x // CELL_PX), int(y // CELL_PX)
+        # A cell at zoom z - 1 covers 2 x 2 cells at zoom z
+        return tuple((cx >> (self.max_zoom - zoom), cy >> (self.max_zoom - zoom)) for zoom in range(self.max_zoom + 1))
+
+    def insert(self, key, lat, lng, status=0, priority=0):
+        """Add a point, or update it if the key is already indexed"""
+        with self._lock:
+            current = self._points.get(key)
+            if current is not None:
+                if current[:4] == (lat, lng, status, priority):
+                    return False
+                self._discard(key, current)
+            digest = point_digest(key, lat, lng, status, priority)
+            point = (lat, lng, status, priority, self._cells_for(lat, lng), digest)
+            self._points[key] = point
+            self._digest ^= digest
+            for zoom, cell in enumerate(point[4]):
+                tile = (cell[0] >> CELLS_PER_TILE_SHIFT, cell[1] >> CELLS_PER_TILE_SHIFT)
+                cells = self._tiles[zoom].setdefault(tile, {})
+                aggregate = cells.get(cell)
+                if aggregate is None:
+                    aggregate = cells[cell] = _Cell(len(self.statuses))
+                aggregate.count += 1
+                aggregate.sum_lat += lat
+                aggregate.sum_lng += lng
+                if 0 <= status < len(self.statuses):
+                    aggregate.status_counts[status] += 1
+                aggregate.priority_counts[priority] = aggregate.priority_counts.get(priority, 0) + 1
+                aggregate.members.add(key)
+                self._bump(zoom, tile, digest, 1)
+            return True
+
+    move = insert
+
+    def remove(self, key):
+        with self._lock:
+            current = self._points.pop(key, None)
+            if current is not None:
+                self._discard(key, current)
+
+    def bulk_load(self, rows):
+        """Insert (key, latitude, longitude, status, priority) rows, skipping missing coordinates"""
+        with self._lock:
+            for key, lat, lng, status, priority in rows:
+                if lat is not None and lng is not None:
+                    self.insert(key, lat, lng, status, priority)
+                else:
+                    self.remove(key)
+
+    def _discard(self, key, point):
+        lat, lng, status, priority, cells, digest = point
+        self._digest ^= digest
+        for zoom, cell in enumerate(cells):
+            tile = (cell[0] >> CELLS_PER_TILE_SHIFT, cell[1] >> CELLS_PER_TILE_SHIFT)
+            tile_cells = self._tiles[zoom][tile]
+            aggregate = tile_cells[cell]
+            aggregate.count -= 1
+            aggregate.sum_lat -= lat
+            aggregate.sum_lng -= lng
+            if 0 <= status < len(self.statuses):
+                aggregate.status_counts[status] -= 1
+            aggregate.priority_counts[priority] -= 1
+            if not aggregate.priority_counts[priority]:
+                del aggregate.priority_counts[priority]
+            aggregate.members.discard(key)
+            if not aggregate.count:
+                del tile_cells[cell]
+                if not tile_cells:
+                    del self._tiles[zoom][tile]
+            self._bump(zoom, tile, digest, -1)
+
+    def _bump(self, zoom, tile, digest, change):
+        versions = self._versions[zoom]
+        count, combined = versions.get(tile, (0, 0))
+        if count + change:
+            versions[tile] = (count + change, combined ^ digest)
+        else:
+            del versions[tile]
+
+    def _source_tile(self, z, x, y):
+        """The indexed (zoom, tile) holding everything in tile z/x/y"""
+        if z <= self.max_zoom:
+            return z, (x, y)
+        shift = z - self.max_zoom
+        return self.max_zoom, (x >> shift, y >> shift)
+
+    @property
+    def version(self):
+        """Version of the whole index, derived from its points"""
+        with self._lock:
+            return f'{len(self._points)}-{self._digest:016x}'
+
+    def tile_version(self, z, x, y):
+        zoom, tile = self._source_tile(z, x, y)
+        count, combined = self._versions[zoom].get(tile, (0, 0))
+        return f'{count}-{combined:016x}'
+
+    def tile(self, z, x, y):
+        """Columns of the lone points and of the clusters in tile z/x/y"""
+        with self._lock:
+            zoom, tile = self._source_tile(z, x, y)
+            if z <= self.max_zoom:
+                return self._columns(self._tiles[zoom].get(tile, {}).values())
+            return self._columns(
+                self._tiles[zoom].get(tile, {}).values(),
+                # Past the deepest level, the points of the parent cells inside this tile
+                keep=lambda lat, lng: tuple(int(v // TILE_PX) for v in pixel(lat, lng, z)) == (x, y),
+            )
+
+    def layer(self, zoom):
+        """Columns of the lone points and of the clusters at `zoom` worldwide"""
+        with self._lock:
+            return self._columns(aggregate for cells in self._tiles[zoom].values() for aggregate in cells.values())
+
+    def points(self):
+        """Columns of every point, ordered by key"""
+        with self._lock:
+            columns = {'id': [], 'lat': [], 'lng': [], 'status': [], 'priority': []}
+            for key in sorted(self._points):
+                self._append_point(columns, key)
+            return columns
+
+    def _append_point(self, columns, key):
+        lat, lng, status, priority = self._points[key][:4]
+        columns['id'].append(key)
+        columns['lat'].append(round(lat, 5))
+        columns['lng'].append(round(lng, 5))
+        columns['status'].append(status)
+        columns['priority'].append(priority)
+
+    def _columns(self, aggregates, keep=None):
+        points = {'id': [], 'lat': [], 'lng': [], 'status': [], 'priority': []}
+        clusters = {'lat': [], 'lng': [], 'count': [], 'priority': []}
+        clusters.update((name, []) for name, _ in self.counted)
+        for aggregate in aggregates:
+            if aggregate.count == 1 or keep is not None:
+                for key in aggregate.members:
+                    if keep is None or keep(*self._points[key][:2]):
+                        self._append_point(points, key)
+                continue
+            clusters['lat'].append(round(aggregate.sum_lat / aggregate.count, 5))
+            clusters['lng'].append(round(aggregate.sum_lng / aggregate.count, 5))
+            clusters['count'].append(aggregate.count)
+            clusters['priority'].append(max(aggregate.priority_counts))
+            for name, code in self.counted:
+                clusters[name].append(aggregate.status_counts[code])
+        return {'points': points, 'clusters': clusters}
+
+
+class _ClientClusters:
+    """Process-wide index of open clients kept in step with `Client.updated_at`"""
+
+    def __init__(self):
+        from .snapshot import STATUSES
+
+        self.statuses = STATUSES
+        self.index = self._new_index()
+        self.codes = {name: code for code, name in enumerate(STATUSES)}
+        self.watermark = None
+        self.synced = None
+        self.rebuilt = None
+        self.lock = threading.Lock()
+
+    def _new_index(self):
+        return TileClusterIndex(statuses=self.statuses, counted=('pending',))
+
+    def _rows(self, queryset):
+        rows = list(queryset.values_list('id', 'latitude', 'longitude', 'status', 'priority', 'updated_at'))
+        latest = max((row[5] for row in rows), default=None)
+        # Closed clients go without coordinates, which takes them out of the index
+        return [
+            (row[0], None, None, 0, 0) if row[3] in CLOSED_STATUSES
+            else (row[0], row[1], row[2], self.codes.get(row[3], -1), row[4])
+            for row in rows
+        ], latest
+
+    def sync(self):
+        from .models import Client
+
+        with self.lock:
+            now = time.monotonic()
+            if self.rebuilt is None or now - self.rebuilt > settings.MAP_CLUSTER_REBUILD_SECONDS:
+                rows, self.watermark = self._rows(Client.objects.exclude(status__in=CLOSED_STATUSES))
+                # Requests keep reading the old index until the new one is loaded
+                index = self._new_index()
+                index.bulk_load(rows)
+                self.index = index
+                self.rebuilt = self.synced = now
+            elif now - self.synced >= settings.MAP_CLUSTER_SYNC_INTERVAL:
+                queryset = Client.objects.all()
+                if self.watermark is not None:
+                    queryset = queryset.filter(updated_at__gte=self.watermark - SYNC_OVERLAP)
+                rows, latest = self._rows(queryset)
+                self.index.bulk_load(rows)
+                if latest is not None and (self.watermark is None or latest > self.watermark):
+                    self.watermark = latest
+                self.synced = now
+        return self.index
+
+
+class _AgentClusters:
+    """Process-wide index of active agents at their live positions"""
+
+    def __init__(self):
+        self.index = TileClusterIndex()
+        self.synced = None
+        self.lock = threading.Lock()
+
+    def sync(self):
+        from .models import User
+        from .positions import apply_to_rows
+
+        with self.lock:
+            now = time.monotonic()
+            if self.synced is None or now - self.synced >= settings.MAP_CLUSTER_AGENT_INTERVAL:
+                rows = list(apply_to_rows(
+                    User.objects.filter(user_type='agent', is_active_agent=True)
+                    .values_list('id', 'current_latitude', 'current_longitude')
+                ))
+                active = {row[0] for row in rows}
+                for key in set(self.index.keys()) - active:
+                    self.index.remove(key)
+                self.index.bulk_load((agent_id, lat, lng, 0, 0) for agent_id, lat, lng in rows)
+                self.synced = now
+        return self.index
+
+
+_clients = None
+_agents = None
+_init_lock = threading.Lock()
+
+
+def client_clusters():
+    """The client tile index, synced with the database"""
+    global _clients
+    with _init_lock:
+        if _clients is None:
+            _clients = _ClientClusters()
+    return _clients.sync()
+
+
+def agent_clusters():
+    """The agent tile index, synced with the live positions"""
+    global _agents
+    with _init_lock:
+        if _agents is None:
+            _agents = _AgentClusters()
+    return _agents.sync()
+
+
+def invalidate():
+    """Drop both indexes; the next request rebuilds them"""
+    global _clients, _agents
+    with _init_lock:
+        _clients = _agents = None
@@ -1,7 +1,10 @@
 import json
+import math
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from .broadcast import ALL_LOCATIONS_GROUP, location_aggregator, subscribe, unsubscribe, viewport_groups
+from . import spatial, wire
 
 User = get_user_model()
 
@@ -23,7 +26,15 @@ class AgentConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        await self.accept()
+        # Managers see every agent until they send a map viewport
+        self.location_groups = set()
+        if self.user.user_type != 'agent':
+            await self.set_location_groups({ALL_LOCATIONS_GROUP})
+        
+        # Compact binary frames if the client offers them, JSON otherwise
+        self.binary = wire.SUBPROTOCOL in self.scope.get('subprotocols', [])
+        self.named_agents = set()
+        await self.accept(subprotocol=wire.SUBPROTOCOL if self.binary else None)
         
         # Send initial connection message
         await self.send(text_data=json.dumps({
@@ -37,16 +48,45 @@ class AgentConsumer(AsyncWebsocketConsumer):
             self.group_name,
             self.channel_name
         )
+        await self.set_location_groups(set())
+
+    async def set_location_groups(self, groups):
+        """Move this socket to a new set of location feed groups"""
+        current = getattr(self, 'location_groups', set())
+        for group in current - groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        for group in groups - current:
+            await self.channel_layer.group_add(group, self.channel_name)
+        # The aggregator only publishes to groups someone has joined
+        await unsubscribe(current - groups)
+        await subscribe(groups - current)
+        self.location_groups = groups
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            try:
+                message = wire.unpack_client_frame(bytes_data)
+            except ValueError as e:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': str(e)
+                }))
+                return
+            await self.handle_location_update(message)
+            return
+        
         try:
             text_data_json = json.loads(text_data)
             message_type = text_data_json.get('type')
             
             if message_type == 'location_update':
                 await self.handle_location_update(text_data_json)
+            elif message_type == 'location_fixes':
+                await self.handle_location_fixes(text_data_json)
             elif message_type == 'status_update':
                 await self.handle_status_update(text_data_json)
+            elif message_type == 'viewport':
+                await self.handle_viewport(text_data_json)
             elif message_type == 'ping':
                 await self.send(text_data=json.dumps({
                     'type': 'pong',
@@ -61,30 +101,57 @@ class AgentConsumer(AsyncWebsocketConsumer):
 
     async def handle_location_update(self, data):
         """Handle location update from agent"""
+        await self.accept_fixes([data])
+
+    async def handle_location_fixes(self, data):
+        """Handle fixes an agent queued while disconnected, oldest first"""
+        await self.accept_fixes(data.get('fixes'))
+
+    async def accept_fixes(self, items):
+        """Validate fixes like the HTTP endpoint does, then queue them"""
+        from .ingestion import parse_fixes
+        
         if self.user.user_type != 'agent':
             return
         
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
+        try:
+            fixes = parse_fixes(items)
+        except ValueError as e:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'message': str(e)
+            }))
+            return
         
-        if latitude and longitude:
-            # Update user location in database
-            await self.update_user_location(latitude, longitude)
-            
-            # Broadcast location update to managers
-            await self.channel_layer.group_send(
-                'managers',
-                {
-                    'type': 'location_broadcast',
-                    'message': {
-                        'agent_id': self.user.id,
-                        'agent_name': self.user.username,
-                        'latitude': latitude,
-                        'longitude': longitude,
-                        'timestamp': data.get('timestamp')
-                    }
-                }
-            )
+        await self.update_user_location(fixes)
+        
+        # Managers only need where the agent is now
+        latitude, longitude, _, timestamp = fixes[-1]
+        location_aggregator.add(
+            self.user.id,
+            self.user.username,
+            latitude,
+            longitude,
+            timestamp.isoformat()
+        )
+
+    async def handle_viewport(self, data):
+        """Subscribe a manager to the map tiles covering their viewport"""
+        if self.user.user_type == 'agent':
+            return
+        
+        try:
+            bounds = [float(data[key]) for key in ('south', 'west', 'north', 'east')]
+        except (KeyError, TypeError, ValueError):
+            bounds = None
+        
+        # A box that is not finite or is upside down would subscribe to no tiles at all
+        if (bounds is None or not all(math.isfinite(value) for value in bounds)
+                or bounds[0] > bounds[2] or bounds[1] > bounds[3]):
+            await self.set_location_groups({ALL_LOCATIONS_GROUP})
+            return
+        
+        await self.set_location_groups(viewport_groups(*bounds))
 
     async def handle_status_update(self, data):
         """Handle status update from agent"""
@@ -95,7 +162,14 @@ class AgentConsumer(AsyncWebsocketConsumer):
         status = data.get('status')
         
         if assignment_id and status:
-            success = await self.update_assignment_status(assignment_id, status)
+            try:
+                success = await self.update_assignment_status(assignment_id, status)
+            except DatabaseError:
+                await self.send(text_data=json.dumps({
+                    'type': 'error',
+                    'message': 'Status update failed'
+                }))
+                return
             
             if success:
                 # Broadcast status update to managers
@@ -134,6 +208,40 @@ class AgentConsumer(AsyncWebsocketConsumer):
             'data': event['message']
         }))
 
+    async def location_batch(self, event):
+        """Handle batched location broadcasts (for managers)"""
+        if not self.binary or 'packed' not in event:
+            await self.send(text_data=json.dumps({
+                'type': 'location_batch',
+                'data': event['message']
+            }))
+            return
+        
+        # Binary batches carry ids only; send each agent's name once
+        new_names = [
+            {'agent_id': update['agent_id'], 'agent_name': update['agent_name']}
+            for update in event['message']['agents']
+            if update['agent_id'] not in self.named_agents
+        ]
+        if new_names:
+            self.named_agents.update(update['agent_id'] for update in new_names)
+            await self.send(text_data=json.dumps({
+                'type': 'agent_names',
+                'data': {'agents': new_names}
+            }))
+        for frame in event['packed']:
+            await self.send(bytes_data=frame)
+
+    async def import_progress(self, event):
+        """Handle background import progress (for managers)"""
+        if event['message']['status'] == 'completed':
+            # Imported clients may be pending; reload this process's index
+            spatial.invalidate('clients')
+        await self.send(text_data=json.dumps({
+            'type': 'import_progress',
+            'data': event['message']
+        }))
+
     async def status_broadcast(self, event):
         """Handle status broadcasts (for managers)"""
         await self.send(text_data=json.dumps({
@@ -142,42 +250,18 @@ class AgentConsumer(AsyncWebsocketConsumer):
         }))
 
     # Database operations
-    @database_sync_to_async
-    def update_user_location(self, latitude, longitude):
-        """Update user location in database"""
-        from django.utils import timezone
-        from .models import LocationLog
-        
-        self.user.current_latitude = latitude
-        self.user.current_longitude = longitude
-        self.user.last_location_update = timezone.now()
-        self.user.save()
-        
-        # Log location
-        LocationLog.objects.create(
-            agent=self.user,
-            latitude=latitude,
-            longitude=longitude
-        )
+    async def update_user_location(self, fixes):
+        """Queue the fixes for the next batched database write"""
+        from .ingestion import location_buffer
+        from . import spatial
+        
+        location_buffer.add_many(self.user.id, fixes)
+        if self.user.is_active_agent:
+            latitude, longitude, _, _ = fixes[-1]
+            spatial.move_agent(self.user.id, latitude, longitude)
 
-    @database_sync_to_async
-    def update_assignment_status(self, assignment_id, status):
-        """Update assignment status in database"""
-        from .models import Assignment
+    async def update_assignment_status(self, assignment_id, status):
+        """Queue the change for the next batched database write"""
+        from .ingestion import status_writer
         
-        try:
-            assignment = Assignment.objects.get(
-                id=assignment_id,
-                agent=self.user
-            )
-            
-            if status == 'accepted':
-                assignment.mark_accepted()
-            elif status == 'in_progress':
-                assignment.mark_started()
-            elif status == 'completed':
-                assignment.mark_completed()
-            
-            return True
-        except Assignment.DoesNotExist:
-            return False
\ No newline at end of file
+        return await status_writer.submit(self.user.id, assignment_id, status)
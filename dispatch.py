@@ -0,0 +1,192 @@
+"""
+Event-driven dispatch of pending clients to idle agents.
+
+Instead of re-running auto-assign over every agent and client, callers
+report what changed: an agent finished a job, an agent moved, or clients
+were added. A background thread coalesces the events for DISPATCH_INTERVAL
+seconds. It then matches only the neighbourhood around them: the idle
+agents involved, plus the pending clients within DISPATCH_RADIUS_KM of
+them (or their DISPATCH_NEIGHBOURS nearest idle agents, for new clients).
+The local problem goes through the same greedy matcher as auto-assign.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import spatial
+from .matching import distance_matrix, greedy_match
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """Per-process queue of dispatch events, drained by a background thread"""
+
+    def __init__(self, interval=None, radius_km=None, neighbours=None, move_interval=None):
+        self.interval = interval or settings.DISPATCH_INTERVAL
+        self.radius_km = radius_km or settings.DISPATCH_RADIUS_KM
+        self.neighbours = neighbours or settings.DISPATCH_NEIGHBOURS
+        self.move_interval = move_interval or settings.DISPATCH_MOVE_INTERVAL
+        self._agents = set()
+        self._clients = set()
+        self._all_clients = False
+        self._last_move = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stats = {'runs': 0, 'assigned': 0, 'last_run_seconds': 0.0}
+
+    def enabled(self):
+        return settings.DISPATCH_ENABLED
+
+    def agent_freed(self, agent_id):
+        """An agent completed or dropped its assignment"""
+        self._add(agents=[agent_id])
+
+    def agents_moved(self, agent_ids):
+        """Agents reported new positions; each agent counts once per move_interval"""
+        now = time.monotonic()
+        with self._lock:
+            moved = [
+                agent_id for agent_id in agent_ids
+                if now - self._last_move.get(agent_id, -self.move_interval) >= self.move_interval
+            ]
+            self._last_move.update((agent_id, now) for agent_id in moved)
+        if moved:
+            self._add(agents=moved)
+
+    def clients_added(self, client_ids=None):
+        """New pending clients; None means an unknown batch (e.g. a bulk import)"""
+        spatial.invalidate('clients')
+        if client_ids is None:
+            with self._lock:
+                self._all_clients = True
+            self._add()
+        else:
+            self._add(clients=client_ids)
+
+    def _add(self, agents=(), clients=()):
+        if not self.enabled():
+            return
+        with self._lock:
+            self._agents.update(agents)
+            self._clients.update(clients)
+        self._ensure_worker()
+        self._wake.set()
+
+    def _drain(self):
+        with self._lock:
+            agents, self._agents = self._agents, set()
+            clients, self._clients = self._clients, set()
+            all_clients, self._all_clients = self._all_clients, False
+        return agents, clients, all_clients
+
+    def run_once(self):
+        """Match the neighbourhood of every queued event; returns the assignments made"""
+        from .models import Client, User
+        from .stats import ACTIVE_ASSIGNMENT_STATUSES
+        from .views import create_assignments
+
+        agents, clients, all_clients = self._drain()
+        if not agents and not clients and not all_clients:
+            return []
+        start = time.perf_counter()
+        close_old_connections()
+
+        idle_ids = set(
+            User.objects.filter(user_type='agent', is_active_agent=True).exclude(
+                assignments__status__in=ACTIVE_ASSIGNMENT_STATUSES
+            ).values_list('id', flat=True)
+        )
+        if not all_clients:
+            new_clients = dict(
+                (client_id, (lat, lng)) for client_id, lat, lng in
+                Client.objects.filter(id__in=clients, status='pending').values_list('id', 'latitude', 'longitude')
+            )
+            agent_index = spatial.agent_index()
+            nearby = set(agents)
+            for lat, lng in new_clients.values():
+                nearby.update(self._nearest_idle(agent_index, idle_ids, lat, lng))
+            idle_ids &= nearby
+            clients = set(new_clients)
+
+        # Pending clients around the idle agents that are involved
+        agent_index = spatial.agent_index()
+        client_index = spatial.client_index()
+        agent_rows = []
+        for agent_id in idle_ids:
+            position = agent_index.position(agent_id)
+            if position is None:
+                continue
+            agent_rows.append((agent_id, position[0], position[1]))
+            clients.update(client_id for client_id, _ in client_index.within(position[0], position[1], self.radius_km))
+        if not agent_rows or not clients:
+            return []
+
+        client_rows = list(
+            Client.objects.filter(id__in=clients, status='pending').order_by('-priority')
+            .values_list('id', 'latitude', 'longitude')
+        )
+        if not client_rows:
+            return []
+        agent_ids = np.array([row[0] for row in agent_rows])
+        client_ids = np.array([row[0] for row in client_rows])
+        distances = distance_matrix(
+            np.array([row[1] for row in client_rows], dtype=float),
+            np.array([row[2] for row in client_rows], dtype=float),
+            np.array([row[1] for row in agent_rows], dtype=float),
+            np.array([row[2] for row in agent_rows], dtype=float),
+        )
+        distances[distances > self.radius_km] = np.inf
+
+        pairs = [(int(agent_ids[col]), int(client_ids[row])) for row, col, _ in greedy_match(distances)]
+        # Rows another process took in the meantime are skipped under lock
+        assignments = create_assignments(pairs)
+
+        self._stats['runs'] += 1
+        self._stats['assigned'] += len(assignments)
+        self._stats['last_run_seconds'] = time.perf_counter() - start
+        return assignments
+
+    def _nearest_idle(self, agent_index, idle_ids, lat, lng):
+        """Up to `neighbours` idle agents closest to a point.
+
+        The index holds busy agents too, so the search widens until enough
+        idle ones turn up or the whole index has been searched.
+        """
+        k = self.neighbours
+        while True:
+            found = agent_index.nearest(lat, lng, k=k)
+            nearest = [agent_id for agent_id, _ in found if agent_id in idle_ids]
+            if len(nearest) >= self.neighbours or len(found) < k:
+                return nearest[:self.neighbours]
+            k *= 2
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._stats, queued_agents=len(self._agents), queued_clients=len(self._clients))
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='dispatcher', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Let a burst of events arrive before matching once for all of them
+            time.sleep(self.interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Dispatch run failed")
+
+
+dispatcher = Dispatcher()
@@ -5,10 +5,10 @@ from .models import User, Client, Assignment
 class ClientUploadForm(forms.Form):
     file = forms.FileField(
         label='Excel File',
-        help_text='Upload Excel file with columns: name, phone, address, latitude, longitude, priority (optional), email (optional)',
+        help_text='Upload Excel or CSV file with columns: name, phone, address, latitude, longitude, priority (optional), email (optional)',
         widget=forms.FileInput(attrs={
             'class': 'form-control',
-            'accept': '.xlsx,.xls'
+            'accept': '.xlsx,.xls,.csv'
         })
     )
 
@@ -0,0 +1,58 @@
+"""
+Idempotency keys for POST requests that create assignments.
+
+A retry (a double click, a timed-out fetch, a second tab) sends the same
+`Idempotency-Key` header, or `idempotency_key` form field, as the first
+attempt. The first request to claim the key in the shared cache runs the
+view. Its JSON response is stored for IDEMPOTENCY_TTL seconds and replayed
+to every retry. A retry that arrives while the first attempt is still
+running gets a 409 and never runs the view a second time. The claim itself
+only lasts IDEMPOTENCY_LEASE seconds, so a worker killed mid-request does
+not lock the key out for a whole day.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+IN_PROGRESS = 'in_progress'
+
+
+def _cache_key(request, key):
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return f'idempotency:{request.user.pk}:{request.path}:{digest}'
+
+
+def idempotent(view):
+    """Run `view` at most once per user, path and idempotency key"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key')
+        if not key or request.method != 'POST':
+            return view(request, *args, **kwargs)
+
+        cache_key = _cache_key(request, key)
+        if not cache.add(cache_key, IN_PROGRESS, settings.IDEMPOTENCY_LEASE):
+            stored = cache.get(cache_key)
+            if stored is None or stored == IN_PROGRESS:
+                return JsonResponse({'error': 'A request with this idempotency key is still in progress'}, status=409)
+            status, content = stored
+            response = HttpResponse(content, status=status, content_type='application/json')
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500:
+            # Let the client retry after a server error
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, (response.status_code, response.content), settings.IDEMPOTENCY_TTL)
+        return response
+
+    return wrapper
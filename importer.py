@@ -0,0 +1,359 @@
+import io
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import EmailValidator
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Client, ImportLog
+from .stats import invalidate_dashboard_stats
+
+logger = logging.getLogger(__name__)
+
+# Expected columns: name, phone, email, address, latitude, longitude, priority
+REQUIRED_COLUMNS = ['name', 'phone', 'address', 'latitude', 'longitude']
+
+# Only this many error lines are kept in ImportLog.error_details
+MAX_ERROR_LINES = 1000
+
+
+class ImportColumnsError(ValueError):
+    """The uploaded sheet is missing required columns"""
+
+
+def _text(series):
+    """Column as stripped strings, with missing values as ''"""
+    return series.where(series.notna(), '').astype(str).str.strip()
+
+
+def _max_length(field_name):
+    return Client._meta.get_field(field_name).max_length
+
+
+def _invalid_emails(email):
+    """Mask of the non-empty addresses EmailField would reject.
+
+    Django's own user and domain patterns are matched a column at a time;
+    only the addresses they reject (IP literals, IDN domains) go through
+    the full validator.
+    """
+    validator = EmailValidator()
+    invalid = pd.Series(False, index=email.index)
+    present = email[email != '']
+    if present.empty:
+        return invalid
+    parts = present.str.rpartition('@')
+    matched = (
+        (parts[1] == '@')
+        & parts[0].str.match(validator.user_regex.pattern, flags=re.IGNORECASE)
+        & parts[2].str.match(validator.domain_regex.pattern, flags=re.IGNORECASE)
+    )
+    for row, address in present[~matched].items():
+        try:
+            validator(address)
+        except ValidationError:
+            invalid[row] = True
+    return invalid
+
+
+def check_columns(columns):
+    missing = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing:
+        raise ImportColumnsError(f"Excel file must contain columns: {', '.join(REQUIRED_COLUMNS)}")
+
+
+def validate_frame(df, first_row=2):
+    """Validate and coerce a sheet of clients in one vectorized pass.
+
+    `first_row` is the spreadsheet row number of the frame's first row (the
+    header is row 1). Returns a DataFrame of valid rows with the Client
+    column names, and a list of "Row N: reason" strings for the rest.
+    """
+    check_columns(df.columns)
+    df = df.reset_index(drop=True)
+
+    name = _text(df['name'])
+    phone = _text(df['phone'])
+    address = _text(df['address'])
+    latitude = pd.to_numeric(df['latitude'], errors='coerce')
+    longitude = pd.to_numeric(df['longitude'], errors='coerce')
+
+    if 'email' in df.columns:
+        email = _text(df['email'])
+    else:
+        email = pd.Series('', index=df.index)
+
+    if 'priority' in df.columns:
+        priority = pd.to_numeric(df['priority'], errors='coerce')
+    else:
+        priority = pd.Series(np.nan, index=df.index)
+    priority = np.floor(priority.fillna(2).clip(1, 4)).astype(int)
+
+    # The first failing check wins, as it did with per-row exceptions
+    checks = [
+        (name == '', "name is required"),
+        (phone == '', "phone is required"),
+        (address == '', "address is required"),
+        (name.str.len() > _max_length('name'), f"name is longer than {_max_length('name')} characters"),
+        (phone.str.len() > _max_length('phone'), f"phone is longer than {_max_length('phone')} characters"),
+        (email.str.len() > _max_length('email'), f"email is longer than {_max_length('email')} characters"),
+        (_invalid_emails(email), "email is not a valid address"),
+        (latitude.isna(), "latitude is not a number"),
+        (longitude.isna(), "longitude is not a number"),
+        (~latitude.between(-90, 90) & latitude.notna(), "latitude must be between -90 and 90"),
+        (~longitude.between(-180, 180) & longitude.notna(), "longitude must be between -180 and 180"),
+    ]
+    reason = pd.Series('', index=df.index)
+    for failed, message in checks:
+        reason = reason.mask(failed & (reason == ''), message)
+
+    invalid = reason != ''
+    errors = [
+        f"Row {row + first_row}: {message}"
+        for row, message in zip(np.flatnonzero(invalid.to_numpy()), reason[invalid])
+    ]
+
+    valid = ~invalid
+    clean = pd.DataFrame({
+        'name': name[valid],
+        'phone': phone[valid],
+        'email': email[valid].where(email[valid] != '', None),
+        'address': address[valid],
+        'latitude': latitude[valid].astype(float),
+        'longitude': longitude[valid].astype(float),
+        'priority': priority[valid],
+    })
+    clean.index = clean.index + first_row
+    return clean, errors
+
+
+def _use_copy():
+    return connection.vendor == 'postgresql' and settings.CLIENT_IMPORT_USE_COPY
+
+
+def _copy_clients(clean, now):
+    """Stream rows into the client table with Postgres COPY"""
+    frame = clean.assign(status='pending', created_at=now, updated_at=now)
+    columns = [Client._meta.get_field(name).column for name in frame.columns]
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        quote(Client._meta.db_table), ', '.join(quote(column) for column in columns)
+    )
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, buffer)
+
+
+def _bulk_create_clients(clean):
+    Client.objects.bulk_create([
+        Client(
+            name=row.name,
+            phone=row.phone,
+            email=row.email,
+            address=row.address,
+            latitude=row.latitude,
+            longitude=row.longitude,
+            priority=int(row.priority),
+        )
+        for row in clean.itertuples(index=False)
+    ])
+
+
+def _create_singly(batch):
+    """Insert a failed batch one row at a time; returns (written, errors)"""
+    written = 0
+    errors = []
+    for row in batch.index:
+        try:
+            with transaction.atomic():
+                _bulk_create_clients(batch.loc[[row]])
+        except Exception as e:
+            errors.append(f"Row {row}: {str(e)}")
+        else:
+            written += 1
+    return written, errors
+
+
+def write_clients(clean, on_batch=None):
+    """Insert validated rows in batches; returns (written, errors).
+
+    A batch the database rejects is retried row by row, so one bad row
+    only costs itself. `on_batch(rows)` is called after every batch.
+    """
+    batch_size = settings.CLIENT_IMPORT_BATCH_SIZE
+    written = 0
+    errors = []
+
+    for start in range(0, len(clean), batch_size):
+        batch = clean.iloc[start:start + batch_size]
+        try:
+            with transaction.atomic():
+                if _use_copy():
+                    _copy_clients(batch, timezone.now())
+                else:
+                    _bulk_create_clients(batch)
+        except Exception:
+            logger.exception("Client import batch failed; retrying rows %d-%d one by one",
+                             batch.index[0], batch.index[-1])
+            batch_written, batch_errors = _create_singly(batch)
+            written += batch_written
+            errors.extend(batch_errors)
+        else:
+            written += len(batch)
+        if on_batch:
+            on_batch(len(batch))
+
+    return written, errors
+
+
+def _file_size(file):
+    size = getattr(file, 'size', None)
+    if size is None:
+        position = file.tell()
+        file.seek(0, io.SEEK_END)
+        size = file.tell()
+        file.seek(position)
+    return size
+
+
+def _read_csv_chunks(file, chunk_rows):
+    size = _file_size(file)
+    rows = 0
+    for chunk in pd.read_csv(file, chunksize=chunk_rows):
+        rows += len(chunk)
+        # Estimate the total from how far through the file we are
+        position = file.tell() if hasattr(file, 'tell') else 0
+        expected = int(rows * size / position) if position else rows
+        yield chunk, max(expected, rows)
+
+
+def _read_xlsx_chunks(file, chunk_rows):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col).strip() if col is not None else '' for col in header]
+        expected = (sheet.max_row or 0) - 1
+
+        width = len(columns)
+        chunk = []
+        blank_rows = 0
+        for row in rows:
+            # Blank rows keep their row numbers, but trailing ones are dropped
+            if all(value is None for value in row):
+                blank_rows += 1
+                continue
+            chunk.extend([(None,) * width] * blank_rows)
+            blank_rows = 0
+            chunk.append(tuple(row[:width]) + (None,) * (width - len(row)))
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns), expected
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns), expected
+    finally:
+        workbook.close()
+
+
+def read_frames(file):
+    """Yield (DataFrame, expected_total_rows) chunks of the uploaded sheet.
+
+    Files above CLIENT_IMPORT_STREAM_THRESHOLD bytes are streamed in chunks
+    of CLIENT_IMPORT_CHUNK_ROWS rows, so memory is bounded by the chunk size:
+    CSV through chunked `read_csv`, .xlsx through openpyxl's read-only mode.
+    Smaller files, and legacy .xls sheets, are read in one go.
+    """
+    name = file.name.lower()
+    chunk_rows = settings.CLIENT_IMPORT_CHUNK_ROWS
+    stream = _file_size(file) > settings.CLIENT_IMPORT_STREAM_THRESHOLD
+
+    if name.endswith('.csv'):
+        if stream:
+            yield from _read_csv_chunks(file, chunk_rows)
+            return
+        df = pd.read_csv(file)
+    elif name.endswith('.xlsx') and stream:
+        yield from _read_xlsx_chunks(file, chunk_rows)
+        return
+    else:
+        df = pd.read_excel(file)
+    yield df, len(df)
+
+
+def _error_details(errors, extra_errors=0):
+    if not errors:
+        return None
+    lines = errors[:MAX_ERROR_LINES]
+    extra_errors += len(errors) - len(lines)
+    if extra_errors:
+        lines.append(f"... and {extra_errors} more errors")
+    return '\n'.join(lines)
+
+
+def import_clients(file, uploaded_by, import_log=None, progress=None):
+    """Validate and insert every client in an uploaded sheet.
+
+    Raises ImportColumnsError if required columns are missing. Results are
+    saved to `import_log` if given, otherwise to a new ImportLog, which is
+    returned. `progress(processed_rows, total_rows)` is called as batches
+    are written.
+    """
+    total_rows = 0
+    expected_rows = 0
+    processed_rows = 0
+    successful_imports = 0
+    failed_imports = 0
+    error_details = []
+    extra_errors = 0
+
+    def on_batch(rows):
+        nonlocal processed_rows
+        processed_rows += rows
+        if progress:
+            progress(processed_rows, max(expected_rows, total_rows))
+
+    def add_errors(errors):
+        # Only keep what ends up in error_details, so memory stays bounded
+        nonlocal extra_errors
+        room = MAX_ERROR_LINES - len(error_details)
+        error_details.extend(errors[:room])
+        extra_errors += max(len(errors) - room, 0)
+
+    for df, expected_rows in read_frames(file):
+        clean, errors = validate_frame(df, first_row=total_rows + 2)
+        total_rows += len(df)
+        failed_imports += len(errors)
+        add_errors(errors)
+        on_batch(len(errors))
+
+        written, write_errors = write_clients(clean, on_batch=on_batch)
+        successful_imports += written
+        failed_imports += len(clean) - written
+        add_errors(write_errors)
+
+    if import_log is None:
+        import_log = ImportLog(uploaded_by=uploaded_by, file_name=file.name)
+    import_log.status = 'completed'
+    import_log.progress = 100
+    import_log.processed_rows = total_rows
+    import_log.finished_at = timezone.now()
+    import_log.total_rows = total_rows
+    import_log.successful_imports = successful_imports
+    import_log.failed_imports = failed_imports
+    import_log.error_details = _error_details(error_details, extra_errors)
+    import_log.save()
+    invalidate_dashboard_stats()
+    return import_log
@@ -0,0 +1,367 @@
+import asyncio
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import partitions, positions
+from .dispatch import dispatcher
+from .stats import invalidate_dashboard_stats
+
+logger = logging.getLogger(__name__)
+
+
+def _in_event_loop():
+    # Async callers (the WebSocket consumer) cannot run ORM queries inline
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def parse_fixes(items):
+    """(latitude, longitude, accuracy, timestamp) tuples from client fix dicts, oldest first.
+
+    Timestamps may be ISO strings or epoch milliseconds; missing, invalid
+    or future ones become now. Raises ValueError on bad coordinates or more
+    than LOCATION_BATCH_MAX_FIXES fixes.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError('Expected a list of fixes')
+    if len(items) > settings.LOCATION_BATCH_MAX_FIXES:
+        raise ValueError('Too many fixes in one batch')
+    now = timezone.now()
+    fixes = []
+    for item in items:
+        try:
+            latitude, longitude = float(item['latitude']), float(item['longitude'])
+            accuracy = item.get('accuracy')
+            accuracy = float(accuracy) if accuracy is not None else None
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise ValueError('Invalid fix')
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError('Coordinates out of range')
+        if accuracy is not None and not math.isfinite(accuracy):
+            accuracy = None
+
+        timestamp = item.get('timestamp')
+        if isinstance(timestamp, (int, float)):
+            try:
+                timestamp = datetime.fromtimestamp(timestamp / 1000, dt_timezone.utc)
+            except (OverflowError, OSError, ValueError):
+                timestamp = None
+        elif isinstance(timestamp, str):
+            try:
+                timestamp = parse_datetime(timestamp)
+            except ValueError:
+                timestamp = None
+        if timestamp is not None and timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+        if timestamp is None or timestamp > now:
+            timestamp = now
+        fixes.append((latitude, longitude, accuracy, timestamp))
+    fixes.sort(key=lambda fix: fix[3])
+    return fixes
+
+
+class LocationBuffer:
+    """In-memory queue of GPS fixes flushed to the database in batches.
+
+    Fixes are written with one `bulk_create` of `LocationLog` rows, and each
+    agent's current position is coalesced to its latest fix and stored in the
+    live position cache. The `User` location columns are only written every
+    `persist_interval` seconds, with a single `bulk_update`. A background thread
+    flushes every `flush_interval` seconds, or as soon as `flush_size` fixes
+    are queued. When `max_size` fixes are waiting a synchronous caller
+    flushes inline, which pushes back on producers instead of letting the
+    queue grow without bound.
+    """
+
+    def __init__(self, flush_interval=None, flush_size=None, max_size=None, persist_interval=None):
+        self.flush_interval = flush_interval or settings.LOCATION_FLUSH_INTERVAL
+        self.flush_size = flush_size or settings.LOCATION_FLUSH_SIZE
+        self.max_size = max_size or settings.LOCATION_BUFFER_MAX
+        self.persist_interval = persist_interval or settings.LIVE_POSITION_PERSIST_INTERVAL
+        self._queue = deque()
+        self._unpersisted = {}
+        self._last_persist = time.monotonic()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'agents_updated': 0,
+            'agents_persisted': 0,
+            'flushes': 0,
+            'inline_flushes': 0,
+            'failed_flushes': 0,
+            'dropped': 0,
+            'rejected': 0,
+            'max_depth': 0,
+            'last_flush_size': 0,
+            'last_flush_seconds': 0.0,
+        }
+
+    def add(self, agent_id, latitude, longitude, accuracy=None, timestamp=None):
+        """Queue one fix for `agent_id`"""
+        self.add_many(agent_id, [(latitude, longitude, accuracy, timestamp or timezone.now())])
+
+    def add_many(self, agent_id, fixes):
+        """Queue (latitude, longitude, accuracy, timestamp) fixes for `agent_id`"""
+        with self._lock:
+            self._queue.extend((agent_id, lat, lng, accuracy, ts) for lat, lng, accuracy, ts in fixes)
+            depth = len(self._queue)
+            self._stats['enqueued'] += len(fixes)
+            self._stats['max_depth'] = max(self._stats['max_depth'], depth)
+
+        if depth >= self.max_size and not _in_event_loop():
+            self._stats['inline_flushes'] += 1
+            self.flush()
+        elif depth >= self.flush_size:
+            self._wake.set()
+        self._ensure_worker()
+
+    def _drain(self):
+        with self._lock:
+            fixes = list(self._queue)
+            self._queue.clear()
+        return fixes
+
+    def flush(self, persist=False):
+        """Write everything queued so far; returns the number of fixes written.
+
+        Current positions go to the User table only when `persist_interval`
+        has elapsed or `persist` is true.
+        """
+        from .models import User, LocationLog
+
+        with self._flush_lock:
+            fixes = self._drain()
+            start = time.perf_counter()
+            if fixes:
+                close_old_connections()
+                try:
+                    LocationLog.objects.bulk_create([
+                        LocationLog(agent_id=agent_id, latitude=lat, longitude=lng, accuracy=accuracy, timestamp=ts)
+                        for agent_id, lat, lng, accuracy, ts in fixes
+                    ], batch_size=self.flush_size)
+                except Exception:
+                    self._stats['failed_flushes'] += 1
+                    logger.exception("Failed to flush %d location fixes; retrying them one by one", len(fixes))
+                    fixes = self._write_singly(LocationLog, fixes)
+
+            latest = {}
+            for agent_id, lat, lng, accuracy, ts in fixes:
+                # Batches replayed after a reconnect can arrive behind live fixes
+                if agent_id not in latest or ts >= latest[agent_id][3]:
+                    latest[agent_id] = (lat, lng, accuracy, ts)
+            if latest:
+                # An older replayed fix must not replace a newer position from an earlier flush
+                cutoff = timezone.now() - timedelta(seconds=2 * self.flush_interval)
+                replayed = any(fix[3] < cutoff for fix in latest.values())
+                try:
+                    latest = positions.set_positions(latest, keep_newer=replayed)
+                except Exception:
+                    logger.exception("Failed to cache %d agent positions", len(latest))
+                dispatcher.agents_moved(latest)
+
+            self._unpersisted.update(latest)
+            if self._unpersisted and (persist or time.monotonic() - self._last_persist >= self.persist_interval):
+                self._persist(User)
+
+            if fixes:
+                self._stats['written'] += len(fixes)
+                self._stats['agents_updated'] += len(latest)
+                self._stats['flushes'] += 1
+                self._stats['last_flush_size'] = len(fixes)
+                self._stats['last_flush_seconds'] = time.perf_counter() - start
+            return len(fixes)
+
+    def _write_singly(self, LocationLog, fixes):
+        """Insert fixes one at a time after a failed batch; returns the ones written.
+
+        Rows the database rejects are dropped, so one bad fix cannot block
+        every later flush. If the database itself is unreachable, the fixes
+        not yet written go back on the queue for the next flush, unless that
+        would overflow the buffer.
+        """
+        written = []
+        for position, (agent_id, lat, lng, accuracy, ts) in enumerate(fixes):
+            try:
+                with transaction.atomic():
+                    LocationLog.objects.create(agent_id=agent_id, latitude=lat, longitude=lng, accuracy=accuracy, timestamp=ts)
+            except (InterfaceError, OperationalError):
+                retry = fixes[position:]
+                with self._lock:
+                    if len(self._queue) + len(retry) <= self.max_size:
+                        self._queue.extendleft(reversed(retry))
+                    else:
+                        self._stats['dropped'] += len(retry)
+                break
+            except Exception:
+                self._stats['rejected'] += 1
+                logger.warning("Dropped invalid location fix for agent %s: %r", agent_id, (lat, lng, accuracy, ts))
+            else:
+                written.append((agent_id, lat, lng, accuracy, ts))
+        return written
+
+    def _persist(self, User):
+        """Copy the latest cached positions onto the User rows"""
+        try:
+            User.objects.bulk_update([
+                User(id=agent_id, current_latitude=lat, current_longitude=lng, last_location_update=ts)
+                for agent_id, (lat, lng, _, ts) in self._unpersisted.items()
+            ], ['current_latitude', 'current_longitude', 'last_location_update'], batch_size=self.flush_size)
+        except Exception:
+            logger.exception("Failed to persist %d agent positions", len(self._unpersisted))
+            return
+        self._stats['agents_persisted'] += len(self._unpersisted)
+        self._unpersisted = {}
+        self._last_persist = time.monotonic()
+
+    def metrics(self):
+        """Counters for monitoring backpressure"""
+        with self._lock:
+            return dict(self._stats, depth=len(self._queue), unpersisted=len(self._unpersisted),
+                        flush_interval=self.flush_interval, flush_size=self.flush_size,
+                        max_size=self.max_size, persist_interval=self.persist_interval)
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='location-flush', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        last_partition_check = None
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            check_interval = settings.LOCATION_PARTITION_CHECK_INTERVAL
+            if last_partition_check is None or time.monotonic() - last_partition_check >= check_interval:
+                last_partition_check = time.monotonic()
+                self._ensure_partitions()
+
+    def _ensure_partitions(self):
+        # Fixes for a period without a partition land in the default one,
+        # so a failure here only slows queries down
+        try:
+            partitions.ensure_partitions()
+        except Exception:
+            logger.exception("Failed to create location log partitions")
+
+
+location_buffer = LocationBuffer()
+atexit.register(location_buffer.flush, persist=True)
+
+
+def apply_status_updates(updates):
+    """Apply (agent_id, assignment_id, status) updates in order.
+
+    Returns, for each update, whether it changed the assignment. Updates for
+    another agent's assignment, unknown statuses and invalid transitions
+    return False. Each update runs in its own savepoint; one the database
+    rejects (say, a unique_together collision) is rolled back alone and its
+    exception is returned in its place.
+    """
+    from .models import Assignment
+
+    results = []
+    # One commit for the whole batch
+    with transaction.atomic():
+        assignments = Assignment.objects.in_bulk({assignment_id for _, assignment_id, _ in updates})
+        for agent_id, assignment_id, status in updates:
+            assignment = assignments.get(assignment_id)
+            if assignment is None or assignment.agent_id != agent_id:
+                results.append(False)
+                continue
+            try:
+                with transaction.atomic():
+                    if status == 'accepted':
+                        results.append(assignment.mark_accepted())
+                    elif status == 'in_progress':
+                        results.append(assignment.mark_started())
+                    elif status == 'completed':
+                        results.append(assignment.mark_completed())
+                    else:
+                        results.append(False)
+            except DatabaseError as exc:
+                logger.warning("Status update %s -> %s failed: %s", assignment_id, status, exc)
+                results.append(exc)
+    if any(result is True for result in results):
+        invalidate_dashboard_stats()
+    return results
+
+
+class StatusWriter:
+    """Applies assignment status updates from WebSocket consumers in batches.
+
+    `database_sync_to_async` runs every call on one shared thread, so a
+    thread hop per message makes sockets queue behind each other. Here
+    each update waits on a future instead. A single task per event loop
+    sends everything queued while the previous batch was being written to
+    the database thread in one hop, at most `max_batch` updates at a time.
+    """
+
+    def __init__(self, max_batch=None):
+        self.max_batch = max_batch or settings.STATUS_WRITE_BATCH
+        self._queue = []
+        self._task = None
+        self._stats = {'updates': 0, 'batches': 0, 'max_batch_size': 0}
+
+    async def submit(self, agent_id, assignment_id, status):
+        """Queue one update and wait until it is written; returns whether it applied"""
+        try:
+            assignment_id = int(assignment_id)
+        except (TypeError, ValueError):
+            return False
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((agent_id, assignment_id, status, future))
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        while self._queue:
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            try:
+                results = await database_sync_to_async(apply_status_updates)(
+                    [update[:3] for update in batch]
+                )
+            except Exception as exc:
+                logger.exception("Failed to apply %d status updates", len(batch))
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (*_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            self._stats['updates'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+
+    def metrics(self):
+        return dict(self._stats, queued=len(self._queue))
+
+
+status_writer = StatusWriter()
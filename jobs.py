@@ -0,0 +1,151 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .dispatch import dispatcher
+from .models import ImportLog
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_started_at = timezone.now()
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def recover_interrupted_imports():
+    """Fail imports left queued or running by a crash or restart.
+
+    Only rows uploaded before this process started are touched. An import
+    another live process is still running saves its final status when it
+    finishes. Returns the number of imports marked failed.
+    """
+    return ImportLog.objects.filter(
+        status__in=['queued', 'running'], upload_time__lt=_started_at
+    ).update(
+        status='failed',
+        finished_at=timezone.now(),
+        error_details="Import interrupted by a server restart; please upload the file again",
+    )
+
+
+def executor():
+    """Process pool that runs background imports, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            recovered = recover_interrupted_imports()
+            if recovered:
+                logger.warning("Marked %d interrupted imports as failed", recovered)
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMPORT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+def enqueue_import(uploaded_file, uploaded_by):
+    """Save an uploaded sheet and queue it for a background import.
+
+    Returns the queued ImportLog straight away.
+    """
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    path = default_storage.save(f'imports/{uuid.uuid4().hex}{extension}', uploaded_file)
+    import_log = ImportLog.objects.create(
+        uploaded_by=uploaded_by,
+        file_name=uploaded_file.name,
+        status='queued',
+    )
+    transaction.on_commit(lambda: _submit(import_log.id, path))
+    return import_log
+
+
+def _submit(import_log_id, path):
+    future = executor().submit(run_import, import_log_id, path)
+    future.add_done_callback(_import_done)
+
+
+def _import_done(future):
+    """Runs in the web process once a worker finishes an import.
+
+    The worker's own client index and dispatcher are not the ones serving
+    requests, so new clients are reported from here.
+    """
+    if not future.cancelled() and future.exception() is None and future.result() == 'completed':
+        dispatcher.clients_added()
+
+
+def send_import_progress(import_log):
+    """Push an import's status and progress to managers over the WebSocket"""
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        'managers',
+        {
+            'type': 'import_progress',
+            'message': {
+                'import_id': import_log.id,
+                'file_name': import_log.file_name,
+                'uploaded_by': import_log.uploaded_by_id,
+                'status': import_log.status,
+                'progress': import_log.progress,
+                'processed_rows': import_log.processed_rows,
+                'total_rows': import_log.total_rows,
+                'successful_imports': import_log.successful_imports,
+                'failed_imports': import_log.failed_imports,
+            }
+        }
+    )
+
+
+def run_import(import_log_id, path):
+    """Worker entry point: import a saved sheet and report progress"""
+    from .importer import import_clients
+
+    import_log = ImportLog.objects.select_related('uploaded_by').get(id=import_log_id)
+    import_log.status = 'running'
+    import_log.save(update_fields=['status'])
+    send_import_progress(import_log)
+
+    interval = settings.IMPORT_PROGRESS_INTERVAL
+    last_sent = time.monotonic()
+
+    def progress(processed_rows, total_rows):
+        nonlocal last_sent
+        import_log.processed_rows = processed_rows
+        import_log.total_rows = total_rows
+        import_log.progress = int(100 * processed_rows / total_rows) if total_rows else 0
+        if time.monotonic() - last_sent >= interval:
+            import_log.save(update_fields=['processed_rows', 'total_rows', 'progress'])
+            send_import_progress(import_log)
+            last_sent = time.monotonic()
+
+    try:
+        with default_storage.open(path) as file:
+            import_clients(file, import_log.uploaded_by, import_log=import_log, progress=progress)
+    except Exception as e:
+        logger.exception("Background import %s failed", import_log_id)
+        import_log.status = 'failed'
+        import_log.finished_at = timezone.now()
+        import_log.error_details = f"Error processing file: {str(e)}"
+        import_log.save()
+    finally:
+        default_storage.delete(path)
+
+    send_import_progress(import_log)
+    return import_log.status
@@ -0,0 +1,176 @@
+import numpy as np
+
+# Radius of earth in kilometers
+EARTH_RADIUS_KM = 6371
+
+
+def unit_vectors(lat, lng):
+    """Project latitude/longitude degrees onto the unit sphere as (N, 3) xyz"""
+    lat, lng = np.radians(lat), np.radians(lng)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+
+def haversine_matrix(lat1, lng1, lat2, lng2):
+    """Pairwise Haversine distances (km) between two sets of points.
+
+    Returns an array of shape (len(lat1), len(lat2)). The haversine term is
+    taken from the chord between unit vectors, so only the final arcsin runs
+    over the full matrix instead of four trig calls per pair.
+    """
+    p1, p2 = unit_vectors(lat1, lng1), unit_vectors(lat2, lng2)
+    chord_sq = np.zeros((len(p1), len(p2)))
+    for axis in range(3):
+        chord_sq += np.subtract.outer(p1[:, axis], p2[:, axis]) ** 2
+
+    # chord^2 / 4 is the haversine of the central angle
+    a = np.clip(chord_sq / 4, 0, 1)
+    c = 2 * np.arcsin(np.sqrt(a))
+    return c * EARTH_RADIUS_KM
+
+
+def haversine_pairs(lat1, lng1, lat2, lng2):
+    """Element-wise Haversine distances (km) between matching pairs of points"""
+    chord = unit_vectors(lat1, lng1) - unit_vectors(lat2, lng2)
+    a = np.clip((chord ** 2).sum(axis=1) / 4, 0, 1)
+    return 2 * np.arcsin(np.sqrt(a)) * EARTH_RADIUS_KM
+
+
+def coords_array(rows):
+    """Turn (id, latitude, longitude) rows into an id array and two float arrays.
+
+    Missing coordinates become 0.0, which `distance_matrix` treats as unknown
+    just like `Client.distance_from` does.
+    """
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    lat = np.array([row[1] or 0.0 for row in rows], dtype=np.float64)
+    lng = np.array([row[2] or 0.0 for row in rows], dtype=np.float64)
+    return ids, lat, lng
+
+
+def distance_matrix(client_lat, client_lng, agent_lat, agent_lng):
+    """Client x agent distance matrix in km.
+
+    Pairs where either side has no usable coordinates are set to infinity,
+    matching the behaviour of `Client.distance_from`.
+    """
+    distances = haversine_matrix(client_lat, client_lng, agent_lat, agent_lng)
+    client_ok = (client_lat != 0) & (client_lng != 0)
+    agent_ok = (agent_lat != 0) & (agent_lng != 0)
+    distances[~client_ok, :] = np.inf
+    distances[:, ~agent_ok] = np.inf
+    return distances
+
+
+def greedy_match(cost):
+    """Assign each client (row) in order to its cheapest free agent (column).
+
+    Rows must already be sorted by priority. Ties go to the first agent, as
+    in the original nested loop. Returns a list of
+    (client_index, agent_index, cost) tuples.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    taken = ~np.isfinite(cost).any(axis=0)
+    matches = []
+
+    for row in range(cost.shape[0]):
+        if taken.all():
+            break
+        row_cost = np.where(taken, np.inf, cost[row])
+        col = int(np.argmin(row_cost))
+        value = row_cost[col]
+        if not np.isfinite(value):
+            continue
+        matches.append((row, col, float(value)))
+        taken[col] = True
+
+    return matches
+
+
+# Extra cost (km) per priority level below Urgent, so the optimal mode
+# prefers serving urgent clients over slightly closer low-priority ones
+PRIORITY_WEIGHT_KM = 10.0
+
+# Largest number of agents solved together in one optimal sub-problem
+MAX_REGION_AGENTS = 150
+
+
+def priority_weighted_cost(distances, priorities, weight=PRIORITY_WEIGHT_KM):
+    """Add the priority penalty to a client x agent cost matrix.
+
+    `weight` is the cost of one priority level, in the matrix's units.
+    """
+    penalty = (4 - np.asarray(priorities, dtype=np.float64)) * weight
+    return distances + penalty[:, None]
+
+
+def geographic_chunks(client_lat, client_lng, agent_lat, agent_lng, max_agents=MAX_REGION_AGENTS):
+    """Split clients and agents into regions of at most `max_agents` agents.
+
+    Regions come from recursive median cuts of the agents along the wider
+    side of their bounding box; clients follow the same cut lines. Yields
+    (client_indices, agent_indices) pairs.
+    """
+    stack = [(np.arange(len(client_lat)), np.arange(len(agent_lat)))]
+    while stack:
+        clients, agents = stack.pop()
+        if len(agents) <= max_agents or not len(clients):
+            yield clients, agents
+            continue
+
+        lat_span = np.ptp(agent_lat[agents])
+        lng_span = np.ptp(agent_lng[agents]) * np.cos(np.radians(agent_lat[agents].mean()))
+        if lat_span >= lng_span:
+            agent_axis, client_axis = agent_lat, client_lat
+        else:
+            agent_axis, client_axis = agent_lng, client_lng
+
+        order = np.argsort(agent_axis[agents], kind='stable')
+        half = len(agents) // 2
+        left, right = agents[order[:half]], agents[order[half:]]
+        cut = (agent_axis[left].max() + agent_axis[right].min()) / 2
+        goes_left = client_axis[clients] < cut
+
+        stack.append((clients[~goes_left], right))
+        stack.append((clients[goes_left], left))
+
+
+def optimal_match(distances, priorities, client_lat, client_lng, agent_lat, agent_lng,
+                  max_region_agents=MAX_REGION_AGENTS, priority_weight=PRIORITY_WEIGHT_KM):
+    """Priority-weighted min-cost assignment of clients to agents.
+
+    Each geographic region is solved exactly with the Hungarian method
+    (`scipy.optimize.linear_sum_assignment`). Returns the same
+    (client_index, agent_index, distance) tuples as `greedy_match`, ordered
+    by client index. `distances` may be any cost (e.g. travel seconds) as long
+    as `priority_weight` is in the same units.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    distances = np.asarray(distances, dtype=np.float64)
+    cost = priority_weighted_cost(distances, priorities, priority_weight)
+    finite = np.isfinite(distances)
+    clients = np.flatnonzero(finite.any(axis=1))
+    agents = np.flatnonzero(finite.any(axis=0))
+    matches = []
+
+    chunks = geographic_chunks(
+        client_lat[clients], client_lng[clients], agent_lat[agents], agent_lng[agents],
+        max_agents=max_region_agents
+    )
+    for client_part, agent_part in chunks:
+        if not len(client_part) or not len(agent_part):
+            continue
+        rows, cols = clients[client_part], agents[agent_part]
+        sub_cost = cost[np.ix_(rows, cols)]
+        if not np.isfinite(sub_cost).any():
+            continue
+        # The solver needs finite costs; anything unreachable is dropped below
+        big = np.nanmax(np.where(np.isfinite(sub_cost), sub_cost, np.nan)) * 2 + 1
+        sub_rows, sub_cols = linear_sum_assignment(np.where(np.isfinite(sub_cost), sub_cost, big))
+        for row, col in zip(rows[sub_rows], cols[sub_cols]):
+            if finite[row, col]:
+                matches.append((int(row), int(col), float(distances[row, col])))
+
+    matches.sort()
+    return matches
@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['agent', 'status'], name='assignment_agent_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['-assigned_at'], name='assignment_assigned_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(condition=models.Q(('status__in', ['assigned', 'accepted', 'in_progress'])), fields=['agent'], name='assignment_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['status', '-priority', 'created_at'], name='client_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-priority', 'created_at'], name='client_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='locationlog',
+            index=models.Index(fields=['agent', '-timestamp'], name='locationlog_agent_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='locationlog',
+            index=models.Index(fields=['-timestamp'], name='locationlog_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['user_type', 'is_active_agent'], name='user_type_active_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0004_importlog_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='planned_arrival',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='sequence',
+            field=models.PositiveIntegerField(blank=True, help_text="Position in the agent's planned tour", null=True),
+        ),
+    ]
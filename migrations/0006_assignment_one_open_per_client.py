@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0005_assignment_tour_fields'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='assignment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['assigned', 'accepted', 'in_progress'])), fields=('client',), name='assignment_one_open_per_client'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 import math
@@ -17,6 +17,11 @@ class User(AbstractUser):
     current_longitude = models.FloatField(null=True, blank=True)
     last_location_update = models.DateTimeField(null=True, blank=True)
     
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['user_type', 'is_active_agent'], name='user_type_active_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.username} ({self.get_user_type_display()})"
 
@@ -51,6 +56,17 @@ class Client(models.Model):
     
     class Meta:
         ordering = ['-priority', 'created_at']
+        indexes = [
+            models.Index(fields=['status', '-priority', 'created_at'], name='client_status_idx'),
+            # Only pending clients are matched; they are a small slice of the table
+            models.Index(
+                fields=['-priority', 'created_at'],
+                name='client_pending_idx',
+                condition=models.Q(status='pending'),
+            ),
+            # Map clusters re-read only the clients changed since their last sync
+            models.Index(fields=['updated_at'], name='client_updated_at_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.get_priority_display()}"
@@ -83,6 +99,14 @@ class Assignment(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
+    # Statuses each status may be reached from
+    TRANSITIONS = {
+        'accepted': ['assigned'],
+        'in_progress': ['assigned', 'accepted'],
+        'completed': ['assigned', 'accepted', 'in_progress'],
+        'cancelled': ['assigned', 'accepted', 'in_progress'],
+    }
+    
     agent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='assignments')
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='assignments')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='assigned')
@@ -92,50 +116,110 @@ class Assignment(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     notes = models.TextField(blank=True, null=True)
     estimated_duration = models.IntegerField(null=True, blank=True, help_text="Estimated duration in minutes")
+    sequence = models.PositiveIntegerField(null=True, blank=True, help_text="Position in the agent's planned tour")
+    planned_arrival = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-assigned_at']
         unique_together = ['agent', 'client', 'status']
+        indexes = [
+            models.Index(fields=['agent', 'status'], name='assignment_agent_status_idx'),
+            models.Index(fields=['-assigned_at'], name='assignment_assigned_at_idx'),
+            models.Index(fields=['updated_at'], name='assignment_updated_at_idx'),
+            # Availability checks only ever look at open assignments
+            models.Index(
+                fields=['agent'],
+                name='assignment_active_idx',
+                condition=models.Q(status__in=['assigned', 'accepted', 'in_progress']),
+            ),
+        ]
+        constraints = [
+            # Last line of defence against double-booking a client
+            models.UniqueConstraint(
+                fields=['client'],
+                name='assignment_one_open_per_client',
+                condition=models.Q(status__in=['assigned', 'accepted', 'in_progress']),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.agent.username} -> {self.client.name} ({self.status})"
     
+    def transition(self, status, **fields):
+        """Move to `status` only if the row is still in an allowed status.
+        
+        The check and the write are one conditional UPDATE, so two requests
+        racing on the same assignment cannot both succeed. Returns True if
+        this call made the change.
+        """
+        # update() skips auto_now, and the change feed reads updated_at
+        fields.setdefault('updated_at', timezone.now())
+        updated = Assignment.objects.filter(
+            pk=self.pk, status__in=self.TRANSITIONS[status]
+        ).update(status=status, **fields)
+        if updated:
+            self.status = status
+            for name, value in fields.items():
+                setattr(self, name, value)
+        return bool(updated)
+    
     def mark_accepted(self):
-        self.status = 'accepted'
-        self.accepted_at = timezone.now()
-        self.save()
+        return self.transition('accepted', accepted_at=timezone.now())
     
     def mark_started(self):
-        self.status = 'in_progress'
-        self.started_at = timezone.now()
-        self.save()
-    
-    def mark_completed(self):
-        self.status = 'completed'
-        self.completed_at = timezone.now()
-        self.client.status = 'completed'
-        self.client.save()
-        self.save()
+        return self.transition('in_progress', started_at=timezone.now())
+    
+    def mark_completed(self, notes=None):
+        from .dispatch import dispatcher
+        
+        fields = {'completed_at': timezone.now()}
+        if notes is not None:
+            fields['notes'] = notes
+        with transaction.atomic():
+            if not self.transition('completed', **fields):
+                return False
+            Client.objects.filter(pk=self.client_id).update(status='completed', updated_at=timezone.now())
+            if Assignment.client.is_cached(self):
+                self.client.status = 'completed'
+            # The agent is free again; hand it the nearest pending client
+            transaction.on_commit(lambda: dispatcher.agent_freed(self.agent_id))
+        return True
 
 # Location Log Model (for tracking agent movements)
 class LocationLog(models.Model):
     agent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='location_logs')
     latitude = models.FloatField()
     longitude = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     accuracy = models.FloatField(null=True, blank=True, help_text="GPS accuracy in meters")
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['agent', '-timestamp'], name='locationlog_agent_time_idx'),
+            models.Index(fields=['-timestamp'], name='locationlog_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.agent.username} at {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
 
 # Excel Import Log Model
 class ImportLog(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE)
     file_name = models.CharField(max_length=200)
     upload_time = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    progress = models.IntegerField(default=0, help_text="Percent of rows processed")
+    processed_rows = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
     total_rows = models.IntegerField(default=0)
     successful_imports = models.IntegerField(default=0)
     failed_imports = models.IntegerField(default=0)
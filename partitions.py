@@ -0,0 +1,342 @@
+"""
+Time-partitioned LocationLog storage.
+
+On Postgres the location log table is converted once, with
+`python -m operations.partitions partition`, into a table partitioned by
+range on `timestamp`. Each partition covers LOCATION_PARTITION_DAYS days.
+The pre-existing rows become a legacy partition, and a default partition
+catches any fix that arrives before its own partition exists.
+`ensure_partitions()` keeps LOCATION_PARTITIONS_AHEAD periods created in
+advance and is called by the ingestion flush thread. Schedule
+`python -m operations.partitions maintain` (e.g. hourly from cron) to drop
+partitions past LOCATION_RETENTION_DAYS and to downsample trails older than
+LOCATION_DOWNSAMPLE_AFTER_DAYS to one fix per agent per
+LOCATION_DOWNSAMPLE_SECONDS. The end of the last period downsampled is
+kept in the cache, so each run only thins the periods that aged since.
+
+Other databases keep a plain table; retention and downsampling then run as
+ordinary deletes.
+"""
+import logging
+import re
+import sys
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Serializes partition DDL across processes
+ADVISORY_LOCK_ID = 0x4C4F47
+
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+# End of the periods already downsampled, per bucket size
+WATERMARK_KEY = 'location_downsample_watermark'
+
+
+def _model():
+    # Imported lazily so `python -m operations.partitions` can set Django up first
+    from .models import LocationLog
+    return LocationLog
+
+
+def _table():
+    return _model()._meta.db_table
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def period_span():
+    return timedelta(days=settings.LOCATION_PARTITION_DAYS)
+
+
+def period_start(moment):
+    """Start of the partition period containing `moment`, aligned to the epoch"""
+    span = period_span()
+    return EPOCH + ((moment - EPOCH) // span) * span
+
+
+def partition_name(start):
+    return f'{_table()}_p{start:%Y%m%d}'
+
+
+def _postgres():
+    return connection.vendor == 'postgresql'
+
+
+def _lock(cursor):
+    cursor.execute('SELECT pg_advisory_xact_lock(%s)', [ADVISORY_LOCK_ID])
+
+
+def is_partitioned():
+    if not _postgres():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [_table()])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def partitions():
+    """[(name, upper_bound)] of the range partitions; upper_bound is None for the default one"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+            """,
+            [_table()]
+        )
+        rows = cursor.fetchall()
+    result = []
+    for name, bound in rows:
+        match = UPPER_BOUND.search(bound)
+        result.append((name, datetime.fromisoformat(match.group(1)) if match else None))
+    return result
+
+
+def partition_table():
+    """Convert the plain location log table into a partitioned one.
+
+    The existing rows are kept in place as a legacy partition covering
+    everything up to the end of the current period. Runs in one transaction.
+    """
+    if not _postgres():
+        raise RuntimeError("Location log partitioning needs PostgreSQL")
+    if is_partitioned():
+        return False
+
+    table = _table()
+    legacy = f'{table}_legacy'
+    now = timezone.now()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        _lock(cursor)
+        cursor.execute(f'SELECT max(id), max("timestamp") FROM {_quote(table)}')
+        max_id, max_timestamp = cursor.fetchone()
+        legacy_end = period_start(max(now, max_timestamp or now)) + period_span()
+
+        cursor.execute(f'ALTER TABLE {_quote(table)} RENAME TO {_quote(legacy)}')
+        # Free the index names for the partitioned parent
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", [legacy])
+        for (index,) in cursor.fetchall():
+            cursor.execute(f'ALTER INDEX {_quote(index)} RENAME TO {_quote((index + "_legacy")[-63:])}')
+
+        cursor.execute(
+            f'CREATE TABLE {_quote(table)} (LIKE {_quote(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f'ALTER TABLE {_quote(table)} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(
+            f'ALTER TABLE {_quote(table)} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY '
+            f'(START WITH {(max_id or 0) + 1})'
+        )
+        # The partition key has to be part of the primary key
+        cursor.execute(f'ALTER TABLE {_quote(table)} ADD PRIMARY KEY (id, "timestamp")')
+        LocationLog = _model()
+        agent = LocationLog._meta.get_field('agent')
+        cursor.execute(
+            f'ALTER TABLE {_quote(table)} ADD CONSTRAINT {_quote(table + "_agent_fk")} '
+            f'FOREIGN KEY ({_quote(agent.column)}) '
+            f'REFERENCES {_quote(agent.related_model._meta.db_table)} (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for index in LocationLog._meta.indexes:
+                schema_editor.add_index(LocationLog, index)
+
+        cursor.execute(f'ALTER TABLE {_quote(legacy)} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute(f'ALTER TABLE {_quote(legacy)} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(
+            f'ALTER TABLE {_quote(table)} ATTACH PARTITION {_quote(legacy)} '
+            f'FOR VALUES FROM (MINVALUE) TO (%s)',
+            [legacy_end]
+        )
+        cursor.execute(f'CREATE TABLE {_quote(table + "_default")} PARTITION OF {_quote(table)} DEFAULT')
+
+    ensure_partitions()
+    return True
+
+
+def ensure_partitions(ahead=None):
+    """Create the partitions for the current period and the next `ahead` ones.
+
+    Rows that already landed in the default partition for a new period are
+    moved into it. Returns the names of the partitions created.
+    """
+    if not is_partitioned():
+        return []
+    ahead = settings.LOCATION_PARTITIONS_AHEAD if ahead is None else ahead
+    span = period_span()
+    table = _table()
+    default = f'{table}_default'
+    created = []
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        _lock(cursor)
+        bounds = [upper for _, upper in partitions() if upper is not None]
+        start = period_start(timezone.now())
+        if bounds:
+            start = max(start, max(bounds))
+        last = period_start(timezone.now()) + span * (ahead + 1)
+
+        while start < last:
+            end = start + span
+            name = partition_name(start)
+            cursor.execute(
+                f'CREATE TABLE {_quote(name)} (LIKE {_quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+            )
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {_quote(default)} WHERE "timestamp" >= %s AND "timestamp" < %s '
+                f'RETURNING *) INSERT INTO {_quote(name)} SELECT * FROM moved',
+                [start, end]
+            )
+            cursor.execute(
+                f'ALTER TABLE {_quote(table)} ATTACH PARTITION {_quote(name)} FOR VALUES FROM (%s) TO (%s)',
+                [start, end]
+            )
+            created.append(name)
+            start = end
+
+    if created:
+        logger.info("Created location log partitions: %s", ', '.join(created))
+    return created
+
+
+def drop_expired(retention_days=None):
+    """Drop location history older than the retention period.
+
+    Whole partitions are dropped; stray older rows in the default partition,
+    or an unpartitioned table, are deleted. Returns the partitions dropped.
+    """
+    retention_days = retention_days or settings.LOCATION_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    dropped = []
+
+    if is_partitioned():
+        with transaction.atomic(), connection.cursor() as cursor:
+            _lock(cursor)
+            for name, upper in partitions():
+                if upper is not None and upper <= cutoff:
+                    cursor.execute(f'DROP TABLE {_quote(name)}')
+                    dropped.append(name)
+
+    _model().objects.filter(timestamp__lt=cutoff).delete()
+    if dropped:
+        logger.info("Dropped expired location log partitions: %s", ', '.join(dropped))
+    return dropped
+
+
+def _downsample_sql(start, end, bucket_seconds):
+    table = _quote(_table())
+    bucket = f'floor(extract(epoch FROM "timestamp") / {int(bucket_seconds)})'
+    # A join against the ranked rows stays a hash join however large the day
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {table} USING (
+                SELECT id, row_number() OVER (
+                    PARTITION BY agent_id, {bucket} ORDER BY "timestamp" DESC, id DESC
+                ) AS rn
+                FROM {table}
+                WHERE "timestamp" >= %s AND "timestamp" < %s
+            ) ranked
+            WHERE {table}.id = ranked.id AND ranked.rn > 1
+            AND {table}."timestamp" >= %s AND {table}."timestamp" < %s
+            """,
+            [start, end, start, end]
+        )
+        return cursor.rowcount
+
+
+def _downsample_orm(start, end, bucket_seconds):
+    LocationLog = _model()
+    rows = list(
+        LocationLog.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        .order_by('agent_id', '-timestamp')
+        .values_list('id', 'agent_id', 'timestamp')
+    )
+    if not rows:
+        return 0
+    ids = np.array([row[0] for row in rows])
+    agents = np.array([row[1] for row in rows])
+    buckets = np.array([(row[2] - EPOCH) // timedelta(seconds=bucket_seconds) for row in rows])
+    # Rows are newest first within each agent, so only a bucket's first row is kept
+    repeat = np.zeros(len(rows), dtype=bool)
+    repeat[1:] = (agents[1:] == agents[:-1]) & (buckets[1:] == buckets[:-1])
+    doomed = ids[repeat].tolist()
+    for offset in range(0, len(doomed), 10000):
+        LocationLog.objects.filter(id__in=doomed[offset:offset + 10000]).delete()
+    return len(doomed)
+
+
+def downsample(after_days=None, bucket_seconds=None, retention_days=None):
+    """Thin trails older than `after_days` to one fix per agent per bucket.
+
+    The newest fix in each `bucket_seconds` window is kept. Works one period
+    at a time, so each delete stays within a single partition, and starts
+    after the last period a previous run finished. Returns the number of
+    rows removed.
+    """
+    after_days = after_days or settings.LOCATION_DOWNSAMPLE_AFTER_DAYS
+    bucket_seconds = bucket_seconds or settings.LOCATION_DOWNSAMPLE_SECONDS
+    retention_days = retention_days or settings.LOCATION_RETENTION_DAYS
+
+    span = period_span()
+    now = timezone.now()
+    end = period_start(now - timedelta(days=after_days))
+    start = period_start(now - timedelta(days=retention_days))
+    watermark_key = f'{WATERMARK_KEY}:{int(bucket_seconds)}'
+    watermark = cache.get(watermark_key)
+    if watermark is not None:
+        start = max(start, watermark)
+    removed = 0
+    while start < end:
+        with transaction.atomic():
+            if _postgres():
+                removed += _downsample_sql(start, start + span, bucket_seconds)
+            else:
+                removed += _downsample_orm(start, start + span, bucket_seconds)
+        start += span
+        cache.set(watermark_key, start, timeout=None)
+    return removed
+
+
+def maintain():
+    """Create upcoming partitions, apply retention, then downsample"""
+    return {
+        'created': ensure_partitions(),
+        'dropped': drop_expired(),
+        'downsampled': downsample(),
+    }
+
+
+def main():
+    import os
+
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'field_ops_system.settings')
+    django.setup()
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'maintain'
+    if command == 'partition':
+        print('partitioned' if partition_table() else 'already partitioned')
+    elif command == 'maintain':
+        print(maintain())
+    else:
+        sys.exit(f'Unknown command {command!r}; use "partition" or "maintain"')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Daily multi-stop route planning.
+
+Pending clients are split into geographic regions with the same median
+cuts as optimal matching. A region only keeps as many clients as its
+agents have stops, most urgent and nearest first. Within a region every
+client, most urgent first, goes to the nearest agent that still has room. Each agent's stops are then
+ordered with Clarke-Wright savings and improved with 2-opt and or-opt.
+Stops that no longer fit in the shift are dropped, lowest priority first.
+Regions are solved in a process pool.
+
+Tours are open paths: they start at the agent's current position and end
+at the last stop. All times are in seconds.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+from .matching import distance_matrix, geographic_chunks
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def plan_options():
+    return {
+        'max_stops': settings.PLAN_MAX_STOPS,
+        'shift_seconds': settings.PLAN_SHIFT_MINUTES * 60,
+        'service_seconds': settings.PLAN_SERVICE_MINUTES * 60,
+        'priority_delay_weight': settings.PLAN_PRIORITY_DELAY_WEIGHT,
+    }
+
+
+def _arrivals(tour, start_times, travel, service_seconds):
+    """Arrival time at each stop of an open tour"""
+    arrivals = []
+    clock = 0.0
+    previous = None
+    for stop in tour:
+        clock += start_times[stop] if previous is None else service_seconds + travel[previous][stop]
+        arrivals.append(clock)
+        previous = stop
+    return arrivals
+
+
+def tour_cost(tour, start_times, travel, priorities, options):
+    """Time the last visit ends, plus a penalty for keeping urgent clients waiting.
+
+    Plain Python on purpose: tours are short, and this is called for every
+    candidate move.
+    """
+    if not tour:
+        return 0.0
+    service_seconds = options['service_seconds']
+    clock = start_times[tour[0]]
+    delay = (priorities[tour[0]] - 1) * clock
+    for previous, stop in zip(tour, tour[1:]):
+        clock += service_seconds + travel[previous][stop]
+        delay += (priorities[stop] - 1) * clock
+    return clock + service_seconds + options['priority_delay_weight'] * delay
+
+
+def savings_tour(stops, start_times, travel):
+    """Clarke-Wright savings for one open tour starting at the agent.
+
+    Every stop starts as its own route; routes are chained end-to-start
+    in order of the time saved by not driving from the agent to the second
+    route's first stop.
+    """
+    if len(stops) < 2:
+        return list(stops)
+    savings = sorted(
+        (start_times[b] - travel[a][b], a, b)
+        for a in stops for b in stops if a != b
+    )
+
+    next_stop, prev_stop = {}, {}
+    head_of = {stop: stop for stop in stops}
+    for saving, a, b in reversed(savings):
+        if saving <= 0:
+            break
+        # Only join the end of one route to the start of another
+        if a in next_stop or b in prev_stop or head_of[a] == b:
+            continue
+        next_stop[a], prev_stop[b] = b, a
+        head = head_of[a]
+        node = b
+        while node is not None:
+            head_of[node] = head
+            node = next_stop.get(node)
+
+    tours = []
+    for head in stops:
+        if head in prev_stop:
+            continue
+        tour, node = [], head
+        while node is not None:
+            tour.append(node)
+            node = next_stop.get(node)
+        tours.append(tour)
+    # Chain the routes, the one starting nearest the agent first
+    tours.sort(key=lambda tour: start_times[tour[0]])
+    return [stop for tour in tours for stop in tour]
+
+
+def improve_tour(tour, start_times, travel, priorities, options, max_rounds=50):
+    """2-opt and or-opt (segments of 1-3 stops) until no move helps"""
+    tour = list(tour)
+    best = tour_cost(tour, start_times, travel, priorities, options)
+    for _ in range(max_rounds):
+        improved = False
+        n = len(tour)
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                candidate = tour[:i] + tour[i:j + 1][::-1] + tour[j + 1:]
+                cost = tour_cost(candidate, start_times, travel, priorities, options)
+                if cost < best - 1e-9:
+                    tour, best, improved = candidate, cost, True
+        for length in (1, 2, 3):
+            for i in range(n - length + 1):
+                segment = tour[i:i + length]
+                rest = tour[:i] + tour[i + length:]
+                for j in range(len(rest) + 1):
+                    if j == i:
+                        continue
+                    candidate = rest[:j] + segment + rest[j:]
+                    cost = tour_cost(candidate, start_times, travel, priorities, options)
+                    if cost < best - 1e-9:
+                        tour, best, improved = candidate, cost, True
+                        break
+        if not improved:
+            break
+    return tour
+
+
+def _fit_shift(tour, start_times, travel, priorities, options):
+    """Drop stops, lowest priority and last first, until the tour fits the shift"""
+    dropped = []
+    while tour:
+        arrivals = _arrivals(tour, start_times, travel, options['service_seconds'])
+        if arrivals[-1] + options['service_seconds'] <= options['shift_seconds']:
+            break
+        position = min(range(len(tour)), key=lambda k: (priorities[tour[k]], -k))
+        dropped.append(tour.pop(position))
+    return tour, dropped
+
+
+def _plan_agent(stops, start_times, travel, priorities, options):
+    """Order one agent's stops and trim them to the shift.
+
+    Works on local copies as plain lists; returns ([(stop, arrival)], dropped).
+    """
+    local = list(range(len(stops)))
+    starts = start_times[stops].tolist()
+    legs = travel[np.ix_(stops, stops)].tolist()
+    ranks = priorities[stops].tolist()
+
+    tour = savings_tour(local, starts, legs)
+    tour = improve_tour(tour, starts, legs, ranks, options)
+    tour, dropped = _fit_shift(tour, starts, legs, ranks, options)
+    arrivals = _arrivals(tour, starts, legs, options['service_seconds'])
+    return [(stops[stop], arrival) for stop, arrival in zip(tour, arrivals)], [stops[stop] for stop in dropped]
+
+
+def solve_region(agent_travel, travel, priorities, options):
+    """Plan tours for one region.
+
+    `agent_travel[i, a]` is the time from agent `a` to client `i`, and
+    `travel[i, j]` the time from client `i` to client `j`. Clients must be
+    sorted most urgent first. Returns ({agent: [(client, arrival_seconds)]},
+    [unplanned clients]).
+    """
+    n_clients, n_agents = agent_travel.shape
+    load = np.zeros(n_agents, dtype=int)
+    members = [[] for _ in range(n_agents)]
+    unplanned = []
+
+    # Nearest agent with room, most urgent clients first
+    for client in range(n_clients):
+        times = np.where(load < options['max_stops'], agent_travel[client], np.inf)
+        times = np.where(times + options['service_seconds'] <= options['shift_seconds'], times, np.inf)
+        agent = int(np.argmin(times))
+        if not np.isfinite(times[agent]):
+            unplanned.append(client)
+            continue
+        members[agent].append(client)
+        load[agent] += 1
+
+    tours = {}
+    for agent, stops in enumerate(members):
+        if not stops:
+            continue
+        tour, dropped = _plan_agent(stops, agent_travel[:, agent], travel, priorities, options)
+        unplanned.extend(dropped)
+        if tour:
+            tours[agent] = tour
+    return tours, sorted(unplanned)
+
+
+def executor():
+    """Process pool that solves planning regions, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PLAN_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+
+def plan_tours(client_lat, client_lng, priorities, agent_lat, agent_lng, travel_time_matrix):
+    """Multi-stop tours for every agent.
+
+    Clients must be sorted most urgent first and have coordinates.
+    `travel_time_matrix(to_lat, to_lng, from_lat, from_lng)` returns seconds
+    with rows for destinations, as `roads.travel_time_matrix` does.
+    Returns ({agent: [(client, arrival_seconds)]}, [unplanned clients]) with
+    indices into the input arrays.
+    """
+    options = plan_options()
+    priorities = np.asarray(priorities, dtype=np.float64)
+    regions = []
+    skipped = []
+    for clients, agents in geographic_chunks(
+        client_lat, client_lng, agent_lat, agent_lng, max_agents=settings.PLAN_REGION_AGENTS
+    ):
+        if not len(clients):
+            continue
+        if not len(agents):
+            regions.append((clients, agents, None))
+            continue
+        clients = np.sort(clients)
+        capacity = len(agents) * options['max_stops']
+        if len(clients) > capacity:
+            # Only agents x max_stops clients can be planned; keep the most
+            # urgent, nearest first, before building the client x client matrix
+            nearest_km = distance_matrix(client_lat[clients], client_lng[clients],
+                                         agent_lat[agents], agent_lng[agents]).min(axis=1)
+            keep = np.sort(np.lexsort((nearest_km, -priorities[clients]))[:capacity])
+            skipped.extend(np.delete(clients, keep).tolist())
+            clients = clients[keep]
+        agent_travel = travel_time_matrix(client_lat[clients], client_lng[clients],
+                                          agent_lat[agents], agent_lng[agents])
+        travel = travel_time_matrix(client_lat[clients], client_lng[clients],
+                                    client_lat[clients], client_lng[clients]).T
+        regions.append((clients, agents, (agent_travel, travel, priorities[clients], options)))
+
+    stops = sum(len(clients) for clients, _, _ in regions)
+    if stops >= settings.PLAN_POOL_MIN_STOPS and len(regions) > 1:
+        pool = executor()
+        futures = [pool.submit(solve_region, *args) if args else None for _, _, args in regions]
+        results = [future.result() if future else None for future in futures]
+    else:
+        results = [solve_region(*args) if args else None for _, _, args in regions]
+
+    tours, unplanned = {}, skipped
+    for (clients, agents, _), result in zip(regions, results):
+        if result is None:
+            unplanned.extend(clients.tolist())
+            continue
+        region_tours, region_unplanned = result
+        for agent, tour in region_tours.items():
+            tours[int(agents[agent])] = [(int(clients[client]), arrival) for client, arrival in tour]
+        unplanned.extend(int(clients[client]) for client in region_unplanned)
+    return tours, sorted(unplanned)
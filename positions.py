@@ -0,0 +1,86 @@
+"""
+Live agent positions kept in the Redis cache.
+
+The `User.current_latitude/longitude` columns are only persisted
+periodically by the ingestion buffer; everything that needs an agent's
+current position should read it from here first.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = 'live_position:'
+
+
+def _key(agent_id):
+    return f'{KEY_PREFIX}{agent_id}'
+
+
+def set_positions(fixes, keep_newer=False):
+    """Store the latest fix per agent; returns the fixes that were stored.
+
+    `fixes` maps agent id to a (latitude, longitude, accuracy, timestamp) tuple.
+    With `keep_newer`, agents whose cached fix is more recent keep it; this
+    costs one extra cache read.
+    """
+    if not fixes:
+        return {}
+    if keep_newer:
+        current = get_positions(fixes)
+        fixes = {
+            agent_id: fix for agent_id, fix in fixes.items()
+            if agent_id not in current or current[agent_id]['timestamp'] <= fix[3]
+        }
+    cache.set_many(
+        {
+            _key(agent_id): {
+                'latitude': latitude,
+                'longitude': longitude,
+                'accuracy': accuracy,
+                'timestamp': timestamp,
+            }
+            for agent_id, (latitude, longitude, accuracy, timestamp) in fixes.items()
+        },
+        timeout=settings.LIVE_POSITION_TTL
+    )
+    return fixes
+
+
+def get_position(agent_id):
+    """Latest cached fix for one agent, or None"""
+    return cache.get(_key(agent_id))
+
+
+def get_positions(agent_ids):
+    """Latest cached fixes as {agent_id: fix} for the agents that have one"""
+    agent_ids = list(agent_ids)
+    if not agent_ids:
+        return {}
+    found = cache.get_many([_key(agent_id) for agent_id in agent_ids])
+    return {
+        agent_id: found[_key(agent_id)]
+        for agent_id in agent_ids
+        if _key(agent_id) in found
+    }
+
+
+def apply_to_users(users):
+    """Overwrite the location fields of User instances with cached positions"""
+    users = list(users)
+    positions = get_positions(user.id for user in users)
+    for user in users:
+        position = positions.get(user.id)
+        if position:
+            user.current_latitude = position['latitude']
+            user.current_longitude = position['longitude']
+            user.last_location_update = position['timestamp']
+    return users
+
+
+def apply_to_rows(rows):
+    """Overwrite (id, latitude, longitude) rows with cached positions"""
+    rows = list(rows)
+    positions = get_positions(row[0] for row in rows)
+    return [
+        (row[0], positions[row[0]]['latitude'], positions[row[0]]['longitude']) if row[0] in positions else row
+        for row in rows
+    ]
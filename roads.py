@@ -0,0 +1,400 @@
+"""
+Local road routing from an OpenStreetMap extract.
+
+The road graph is read from ROAD_GRAPH_FILE, an OSM XML extract (.osm,
+.osm.bz2 or .osm.gz), and compiled to a .npz next to it so later processes
+load it in a fraction of the time. Routes are computed with A* on travel
+time, between the graph nodes nearest to the requested points. Routes are
+kept in an LRU cache keyed on those snapped nodes. No network calls are
+made.
+"""
+import bz2
+import gzip
+import heapq
+import logging
+import math
+import os
+import threading
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from scipy.spatial import cKDTree
+
+from .matching import EARTH_RADIUS_KM, distance_matrix, haversine_pairs, unit_vectors
+from .spatial import geohash_cell_size
+
+logger = logging.getLogger(__name__)
+
+# Typical urban speeds in km/h for the highway types that are routed over
+HIGHWAY_SPEEDS_KMH = {
+    'motorway': 80, 'motorway_link': 50,
+    'trunk': 60, 'trunk_link': 40,
+    'primary': 45, 'primary_link': 35,
+    'secondary': 35, 'secondary_link': 30,
+    'tertiary': 30, 'tertiary_link': 25,
+    'unclassified': 25, 'residential': 20,
+    'living_street': 10, 'service': 15, 'road': 25,
+}
+
+ONEWAY_FORWARD = {'yes', 'true', '1'}
+
+
+def _open_extract(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def parse_osm(path, speeds=HIGHWAY_SPEEDS_KMH):
+    """Read an OSM XML extract into (lat, lng, edges).
+
+    `edges` is a list of (from, to, speed_kmh) between positions in the
+    lat/lng arrays. Only nodes on routable ways are kept.
+    """
+    coords = {}
+    ways = []
+    with _open_extract(path) as source:
+        for _, element in ET.iterparse(source, events=('end',)):
+            if element.tag == 'node':
+                coords[int(element.get('id'))] = (float(element.get('lat')), float(element.get('lon')))
+                element.clear()
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                speed = speeds.get(tags.get('highway'))
+                if speed:
+                    refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+                    oneway = tags.get('oneway', '')
+                    if oneway == '-1':
+                        refs.reverse()
+                    forward_only = (
+                        oneway in ONEWAY_FORWARD or oneway == '-1'
+                        or tags.get('highway') == 'motorway' or tags.get('junction') == 'roundabout'
+                    )
+                    if tags.get('maxspeed', '').isdigit():
+                        speed = min(speed, int(tags['maxspeed']))
+                    ways.append((refs, speed, forward_only))
+                element.clear()
+            elif element.tag == 'relation':
+                element.clear()
+
+    positions = {}
+    lat, lng, edges = [], [], []
+    for refs, speed, forward_only in ways:
+        refs = [ref for ref in refs if ref in coords]
+        for ref in refs:
+            if ref not in positions:
+                positions[ref] = len(lat)
+                lat.append(coords[ref][0])
+                lng.append(coords[ref][1])
+        for a, b in zip(refs, refs[1:]):
+            edges.append((positions[a], positions[b], speed))
+            if not forward_only:
+                edges.append((positions[b], positions[a], speed))
+    return np.array(lat), np.array(lng), edges
+
+
+class RoadGraph:
+    """Directed road graph in compressed sparse row form, routed with A*.
+
+    Edge weights are travel times in seconds; edge lengths are kept
+    alongside for reporting distance.
+    """
+
+    def __init__(self, lat, lng, sources, targets, lengths_km, seconds, cache_size=None):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lng = np.asarray(lng, dtype=float)
+        order = np.argsort(sources, kind='stable')
+        self.targets = np.asarray(targets)[order]
+        self.lengths_km = np.asarray(lengths_km, dtype=float)[order]
+        self.seconds = np.asarray(seconds, dtype=float)[order]
+        self.offsets = np.searchsorted(np.asarray(sources)[order], np.arange(len(self.lat) + 1))
+        # Fastest possible speed, so the straight-line heuristic never overestimates
+        self.max_speed_kms = float(np.max(self.lengths_km / np.maximum(self.seconds, 1e-9))) if len(self.seconds) else 1.0
+
+        # Plain lists are much faster than numpy scalars inside the search loop
+        self._targets = self.targets.tolist()
+        self._seconds = self.seconds.tolist()
+        self._lengths = self.lengths_km.tolist()
+        self._offsets = self.offsets.tolist()
+        self._lat = self.lat.tolist()
+        self._lng = self.lng.tolist()
+
+        # k-d tree over unit vectors; chord length maps monotonically to distance
+        self._tree = cKDTree(unit_vectors(self.lat, self.lng)) if len(self._lat) else None
+
+        self._csr = None
+        self.route_between = lru_cache(maxsize=cache_size or settings.ROUTE_CACHE_SIZE)(self._route)
+
+    def __len__(self):
+        return len(self._lat)
+
+    @classmethod
+    def from_edges(cls, lat, lng, edges, **kwargs):
+        sources = np.array([edge[0] for edge in edges], dtype=np.int64)
+        targets = np.array([edge[1] for edge in edges], dtype=np.int64)
+        speeds = np.array([edge[2] for edge in edges], dtype=float)
+        lengths = haversine_pairs(lat[sources], lng[sources], lat[targets], lng[targets])
+        return cls(lat, lng, sources, targets, lengths, lengths / speeds * 3600, **kwargs)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Load a graph from an OSM extract, using the compiled .npz when it is current"""
+        compiled = os.path.splitext(path)[0] + '.npz'
+        if os.path.exists(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(path):
+            data = np.load(compiled)
+            return cls(data['lat'], data['lng'], data['sources'], data['targets'],
+                       data['lengths_km'], data['seconds'], **kwargs)
+
+        lat, lng, edges = parse_osm(path)
+        graph = cls.from_edges(lat, lng, edges, **kwargs)
+        try:
+            sources = np.repeat(np.arange(len(graph)), np.diff(graph.offsets))
+            np.savez(compiled, lat=graph.lat, lng=graph.lng, sources=sources, targets=graph.targets,
+                     lengths_km=graph.lengths_km, seconds=graph.seconds)
+        except OSError:
+            logger.warning("Could not write compiled road graph to %s", compiled)
+        return graph
+
+    def snap(self, lat, lng):
+        """Nearest graph node to a point as (node, distance_km), or None"""
+        if self._tree is None:
+            return None
+        chord, node = self._tree.query(unit_vectors(np.array([lat]), np.array([lng]))[0])
+        return int(node), 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+    def _heuristic(self, node, goal):
+        lat1, lng1 = math.radians(self._lat[node]), math.radians(self._lng[node])
+        lat2, lng2 = math.radians(self._lat[goal]), math.radians(self._lng[goal])
+        a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a)) / self.max_speed_kms
+
+    def _route(self, start, goal):
+        """A* on travel time; returns (coordinates, distance_km, seconds) or None if unreachable.
+
+        `coordinates` are the path's nodes as [lng, lat] pairs.
+        """
+        best = {start: 0.0}
+        came_from = {start: (None, 0.0)}
+        heap = [(self._heuristic(start, goal), 0.0, start)]
+        targets, seconds, lengths, offsets = self._targets, self._seconds, self._lengths, self._offsets
+        done = set()
+
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node == goal:
+                break
+            if node in done:
+                continue
+            done.add(node)
+            for edge in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[edge]
+                new_cost = cost + seconds[edge]
+                if new_cost < best.get(neighbour, math.inf):
+                    best[neighbour] = new_cost
+                    came_from[neighbour] = (node, lengths[edge])
+                    heapq.heappush(heap, (new_cost + self._heuristic(neighbour, goal), new_cost, neighbour))
+        else:
+            return None
+
+        path, distance = [], 0.0
+        node = goal
+        while node is not None:
+            path.append(node)
+            node, length = came_from[node]
+            distance += length
+        path.reverse()
+        return [[self._lng[node], self._lat[node]] for node in path], distance, best[goal]
+
+    def travel_times(self, sources, targets, max_cells=None):
+        """Seconds from each source node to each target node, inf if unreachable.
+
+        One-to-many Dijkstra from every distinct source, in batches so the
+        full source x node table stays under `max_cells` values.
+        """
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import dijkstra
+
+        if self._csr is None:
+            self._csr = csr_matrix((self.seconds, self.targets, self.offsets), shape=(len(self), len(self)))
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        unique, inverse = np.unique(sources, return_inverse=True)
+        max_cells = max_cells or settings.TRAVEL_MATRIX_MAX_CELLS
+        batch = max(1, max_cells // max(len(self), 1))
+
+        times = np.empty((len(unique), len(targets)))
+        for start in range(0, len(unique), batch):
+            found = dijkstra(self._csr, directed=True, indices=unique[start:start + batch])
+            times[start:start + batch] = found[:, targets]
+        return times[inverse]
+
+    def route(self, start_lat, start_lng, end_lat, end_lng):
+        """Road route between two points, or None if it cannot be routed.
+
+        Returns a dict with `coordinates` ([lng, lat] pairs, GeoJSON order),
+        `distance` in km and `duration` in seconds, including the straight
+        legs to and from the snapped nodes.
+        """
+        start = self.snap(start_lat, start_lng)
+        end = self.snap(end_lat, end_lng)
+        max_snap_km = settings.ROUTE_MAX_SNAP_KM
+        if start is None or end is None or start[1] > max_snap_km or end[1] > max_snap_km:
+            return None
+
+        found = self.route_between(start[0], end[0])
+        if found is None:
+            return None
+        path, distance, seconds = found
+
+        access_km = start[1] + end[1]
+        coordinates = [[start_lng, start_lat]] + path + [[end_lng, end_lat]]
+        return {
+            'coordinates': coordinates,
+            'distance': distance + access_km,
+            'duration': seconds + access_km / settings.ROUTE_ACCESS_SPEED_KMH * 3600,
+        }
+
+
+_graph = None
+_graph_loaded = False
+_graph_lock = threading.Lock()
+
+
+def road_graph():
+    """Process-wide road graph from ROAD_GRAPH_FILE, or None if none is configured"""
+    global _graph, _graph_loaded
+    if not _graph_loaded:
+        with _graph_lock:
+            if not _graph_loaded:
+                path = settings.ROAD_GRAPH_FILE
+                if path:
+                    try:
+                        _graph = RoadGraph.load(path)
+                    except (OSError, ET.ParseError):
+                        logger.exception("Could not load road graph from %s", path)
+                _graph_loaded = True
+    return _graph
+
+
+def straight_line_route(start_lat, start_lng, end_lat, end_lng):
+    """Fallback route: a straight line at ROUTE_FALLBACK_SPEED_KMH"""
+    distance = float(haversine_pairs(start_lat, start_lng, end_lat, end_lng)[0])
+    return {
+        'coordinates': [[start_lng, start_lat], [end_lng, end_lat]],
+        'distance': distance,
+        'duration': distance / settings.ROUTE_FALLBACK_SPEED_KMH * 3600,
+    }
+
+
+def route(start_lat, start_lng, end_lat, end_lng):
+    """Road route if the graph can provide one, otherwise a straight line.
+
+    The result's `source` is 'road' or 'straight_line'.
+    """
+    graph = road_graph()
+    found = graph.route(start_lat, start_lng, end_lat, end_lng) if graph is not None else None
+    if found is None:
+        return dict(straight_line_route(start_lat, start_lng, end_lat, end_lng), source='straight_line')
+    return dict(found, source='road')
+
+
+def _tiles(lat, lng, precision):
+    """Row/column of the geohash-sized tile holding each point, and the tile centres"""
+    lat_step, lng_step = geohash_cell_size(precision)
+    rows = np.floor((lat + 90) / lat_step).astype(np.int64)
+    columns = np.floor((lng + 180) / lng_step).astype(np.int64)
+    keys = np.array([f'{row}:{column}' for row, column in zip(rows.tolist(), columns.tolist())], dtype=object)
+    return keys, (rows + 0.5) * lat_step - 90, (columns + 0.5) * lng_step - 180
+
+
+def _tile_key(precision, tile):
+    return f'eta:{precision}:{tile}'
+
+
+def _tile_travel_times(graph, source_tiles, source_lat, source_lng, target_tiles, target_lat, target_lng):
+    """Seconds between tile centres (sources x targets), through the tile cache.
+
+    Each source tile's cache entry maps target tiles to seconds, so a
+    dispatch run only routes the pairs no earlier run has seen.
+    """
+    precision = settings.TRAVEL_MATRIX_TILE_PRECISION
+    keys = [_tile_key(precision, tile) for tile in source_tiles]
+    cached = cache.get_many(keys)
+    rows = [dict(cached.get(key, {})) for key in keys]
+
+    missing_sources = [i for i, row in enumerate(rows) if any(tile not in row for tile in target_tiles)]
+    if missing_sources:
+        missing_targets = sorted({
+            j for i in missing_sources for j, tile in enumerate(target_tiles) if tile not in rows[i]
+        })
+        source_nodes = graph._tree.query(unit_vectors(source_lat[missing_sources], source_lng[missing_sources]))[1]
+        target_nodes = graph._tree.query(unit_vectors(target_lat[missing_targets], target_lng[missing_targets]))[1]
+        found = graph.travel_times(source_nodes, target_nodes)
+        for i, times in zip(missing_sources, found.tolist()):
+            rows[i].update((target_tiles[j], seconds) for j, seconds in zip(missing_targets, times))
+        cache.set_many(
+            {keys[i]: rows[i] for i in missing_sources},
+            timeout=settings.TRAVEL_MATRIX_CACHE_TTL
+        )
+
+    return np.array([[row[tile] for tile in target_tiles] for row in rows], dtype=np.float64).reshape(
+        len(source_tiles), len(target_tiles)
+    )
+
+
+def fallback_travel_times(distances_km):
+    """Travel time estimate from straight-line distance and a detour factor"""
+    return (
+        np.asarray(distances_km, dtype=np.float64) * settings.ROUTE_DETOUR_FACTOR
+        / settings.ROUTE_FALLBACK_SPEED_KMH * 3600
+    )
+
+
+def travel_time_matrix(client_lat, client_lng, agent_lat, agent_lng):
+    """Client x agent travel times in seconds, from each agent to each client.
+
+    Same layout as `matching.distance_matrix`, and infinite where either side
+    has no coordinates or no road connects them. Road times are computed
+    between tile centres (TRAVEL_MATRIX_TILE_PRECISION) and cached per
+    tile, plus the legs from each point to its tile centre at
+    ROUTE_ACCESS_SPEED_KMH. Without a road graph this is the straight-line
+    distance times ROUTE_DETOUR_FACTOR at ROUTE_FALLBACK_SPEED_KMH.
+    """
+    distances = distance_matrix(client_lat, client_lng, agent_lat, agent_lng)
+    graph = road_graph()
+    if graph is None or not len(graph) or not distances.size:
+        return fallback_travel_times(distances)
+
+    client_ok = np.isfinite(distances).any(axis=1)
+    agent_ok = np.isfinite(distances).any(axis=0)
+    seconds = np.full(distances.shape, np.inf)
+    if not client_ok.any():
+        return seconds
+
+    precision = settings.TRAVEL_MATRIX_TILE_PRECISION
+    client_keys, client_tile_lat, client_tile_lng = _tiles(client_lat[client_ok], client_lng[client_ok], precision)
+    agent_keys, agent_tile_lat, agent_tile_lng = _tiles(agent_lat[agent_ok], agent_lng[agent_ok], precision)
+    target_tiles, target_first, target_of_client = np.unique(client_keys, return_index=True, return_inverse=True)
+    source_tiles, source_first, source_of_agent = np.unique(agent_keys, return_index=True, return_inverse=True)
+
+    tile_times = _tile_travel_times(
+        graph,
+        source_tiles.tolist(), agent_tile_lat[source_first], agent_tile_lng[source_first],
+        target_tiles.tolist(), client_tile_lat[target_first], client_tile_lng[target_first],
+    )
+
+    access_speed = settings.ROUTE_ACCESS_SPEED_KMH
+    client_access = haversine_pairs(client_lat[client_ok], client_lng[client_ok], client_tile_lat, client_tile_lng)
+    agent_access = haversine_pairs(agent_lat[agent_ok], agent_lng[agent_ok], agent_tile_lat, agent_tile_lng)
+    block = (
+        tile_times[source_of_agent][:, target_of_client].T
+        + client_access[:, None] / access_speed * 3600
+        + agent_access[None, :] / access_speed * 3600
+    )
+    seconds[np.ix_(client_ok, agent_ok)] = block
+    return seconds
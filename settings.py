@@ -120,6 +120,93 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Batched location ingestion (see operations/ingestion.py)
+LOCATION_FLUSH_INTERVAL = 1.0  # seconds between batch writes
+LOCATION_FLUSH_SIZE = 500  # queued fixes that trigger an early flush
+LOCATION_BUFFER_MAX = 10000  # queued fixes before producers flush inline
+LOCATION_BATCH_MAX_FIXES = 1000  # fixes accepted in one batched upload from a client
+LIVE_POSITION_PERSIST_INTERVAL = 60.0  # seconds between User location column writes
+LIVE_POSITION_TTL = 24 * 60 * 60  # seconds a cached position is kept
+STATUS_WRITE_BATCH = 500  # WebSocket status updates applied per database hop
+
+# Location history storage (see operations/partitions.py)
+LOCATION_PARTITION_DAYS = 1  # days covered by each location log partition
+LOCATION_PARTITIONS_AHEAD = 3  # future partitions kept created
+LOCATION_PARTITION_CHECK_INTERVAL = 3600  # seconds between partition checks by the flush thread
+LOCATION_RETENTION_DAYS = 90  # partitions older than this are dropped
+LOCATION_DOWNSAMPLE_AFTER_DAYS = 7  # trails older than this are thinned
+LOCATION_DOWNSAMPLE_SECONDS = 60  # one fix per agent per this many seconds once thinned
+
+# Agent track replay (see operations/tracks.py)
+TRACK_TOLERANCE_M = 10.0  # Douglas-Peucker tolerance in metres
+TRACK_MAX_WINDOW_DAYS = 7  # longest window a single track request may cover
+TRACK_CACHE_TTL = 60  # seconds a track whose window is still open is cached
+TRACK_HISTORY_CACHE_TTL = 24 * 60 * 60  # seconds a closed window's track is cached
+
+# Local routing (see operations/roads.py)
+ROAD_GRAPH_FILE = None  # path to an OSM XML extract; None routes in straight lines
+ROUTE_CACHE_SIZE = 10000  # routes kept per process, keyed on snapped nodes
+ROUTE_MAX_SNAP_KM = 1.0  # points further than this from a road get a straight line
+ROUTE_ACCESS_SPEED_KMH = 5.0  # speed for the legs to and from the snapped nodes
+ROUTE_FALLBACK_SPEED_KMH = 25.0  # speed used for straight-line ETAs
+ROUTE_DETOUR_FACTOR = 1.3  # road distance per straight-line km when no graph is loaded
+TRAVEL_MATRIX_TILE_PRECISION = 7  # geohash-sized tiles (~150 m) that travel times are cached between
+TRAVEL_MATRIX_CACHE_TTL = 24 * 60 * 60  # seconds a source tile's travel times are cached
+TRAVEL_MATRIX_MAX_CELLS = 50_000_000  # Dijkstra table size per batch of sources
+TRAVEL_MATRIX_MAX_PAIRS = 250_000  # largest matrix the travel-matrix endpoint will compute
+
+# Daily multi-stop planning (see operations/planning.py)
+PLAN_MAX_STOPS = 15  # visits per agent per day
+PLAN_SHIFT_MINUTES = 8 * 60  # working time a tour must fit in
+PLAN_SERVICE_MINUTES = 20  # time spent at each client
+PLAN_PRIORITY_DELAY_WEIGHT = 0.05  # cost per second an urgent client waits, per priority level above low
+PLAN_REGION_AGENTS = 20  # agents per independently solved region
+PLAN_WORKERS = None  # planning processes; None uses every CPU
+PLAN_POOL_MIN_STOPS = 500  # smaller plans are solved in-process
+
+# Event-driven dispatch (see operations/dispatch.py)
+DISPATCH_ENABLED = True  # assign as soon as agents free up, move or clients arrive
+DISPATCH_INTERVAL = 0.2  # seconds events are coalesced before matching
+DISPATCH_RADIUS_KM = 10.0  # furthest a client may be from an agent it is dispatched to
+DISPATCH_NEIGHBOURS = 10  # nearest agents considered for each new client
+DISPATCH_MOVE_INTERVAL = 30.0  # seconds between dispatch checks for a moving agent
+
+# Assignment requests (see operations/idempotency.py)
+IDEMPOTENCY_TTL = 24 * 60 * 60  # seconds a response is replayed for a repeated Idempotency-Key
+IDEMPOTENCY_LEASE = 60  # seconds a key stays claimed by a request that never finishes (about the request timeout)
+
+# Manager dashboard counts (see operations/stats.py)
+DASHBOARD_STATS_TTL = 30  # seconds the cached counts are reused
+
+# Dashboard change feed (see operations/changes.py)
+CHANGE_FEED_OVERLAP = 5  # seconds re-read before each sync's version, for late commits
+CHANGE_FEED_MAX_AGE = 60 * 60  # older versions get a reset instead of a delta
+CHANGE_FEED_LIMIT = 1000  # changed rows of one kind before a reset
+
+# Manager map snapshot (see operations/snapshot.py)
+MAP_SNAPSHOT_MIN_ZOOM = 3  # coarsest zoom level the snapshot serves clustered
+MAP_SNAPSHOT_MAX_ZOOM = 16  # deeper zooms get every client unclustered
+MAP_SNAPSHOT_TTL = 60 * 60  # seconds a built snapshot version stays cached
+
+# Manager map tiles (see operations/clustering.py)
+MAP_CLUSTER_SYNC_INTERVAL = 1.0  # seconds between re-reads of changed clients
+MAP_CLUSTER_REBUILD_SECONDS = 600  # full rebuild, which also drops deleted clients
+MAP_CLUSTER_AGENT_INTERVAL = 5.0  # seconds between refreshes of agent positions
+
+# Location fan-out to managers (see operations/broadcast.py)
+LOCATION_BROADCAST_TICK = 1.0  # seconds between location_batch frames
+LOCATION_BROADCAST_MIN_DISTANCE_M = 10.0  # smaller moves are not re-broadcast
+LOCATION_TILE_PRECISIONS = (3, 4, 5)  # geohash lengths managers can subscribe at
+MAX_VIEWPORT_TILES = 32  # tiles per manager viewport before falling back to coarser ones
+
+# Client import (see operations/importer.py)
+CLIENT_IMPORT_BATCH_SIZE = 5000  # rows per bulk insert / COPY
+CLIENT_IMPORT_USE_COPY = True  # use Postgres COPY instead of bulk_create
+CLIENT_IMPORT_STREAM_THRESHOLD = 5 * 1024 * 1024  # bytes; larger files are streamed
+CLIENT_IMPORT_CHUNK_ROWS = 50000  # rows per streamed chunk
+IMPORT_WORKERS = 2  # background import processes
+IMPORT_PROGRESS_INTERVAL = 1.0  # seconds between progress updates
+
 # Crispy Forms configuration
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap4"
 CRISPY_TEMPLATE_PACK = "bootstrap4"
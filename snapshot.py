@@ -0,0 +1,56 @@
+"""
+Columnar map snapshots for the manager map's first paint.
+
+One request returns every open client as parallel arrays (ids, coordinates,
+status and priority codes) instead of one object per row. From
+MAP_SNAPSHOT_MIN_ZOOM to MAP_SNAPSHOT_MAX_ZOOM the clients come
+clustered, read from the same grid cells clustering.py serves as tiles,
+so the map gets one row per occupied cell instead of 20k markers.
+Snapshots are cached under the version of that client index, which only
+depends on the clients it holds, and the version is the ETag. A request
+whose If-None-Match still matches is answered with a 304 without building
+anything. Agents move constantly and are left to the dashboard page and
+the live location feed.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Client
+
+CACHE_PREFIX = 'map_snapshot'
+
+STATUSES = [status for status, _ in Client.STATUS_CHOICES]
+
+
+def zoom_levels():
+    return range(settings.MAP_SNAPSHOT_MIN_ZOOM, settings.MAP_SNAPSHOT_MAX_ZOOM + 1)
+
+
+def client_layer(index, zoom):
+    """Cached client columns of `index` for `zoom` (None for unclustered)"""
+    key = f'{CACHE_PREFIX}:{index.version}:{zoom}'
+    layer = cache.get(key)
+    if layer is None:
+        if zoom is None:
+            layer = {'clients': index.points(), 'clusters': None}
+        else:
+            columns = index.layer(zoom)
+            layer = {'clients': columns['points'], 'clusters': columns['clusters']}
+        cache.set(key, layer, timeout=settings.MAP_SNAPSHOT_TTL)
+    return layer
+
+
+def snapshot_etag(version, zoom):
+    return f'"{version}-{zoom}"'
+
+
+def snapshot(index, zoom):
+    """The response body for one zoom level (None for unclustered)"""
+    layer = client_layer(index, zoom)
+    return {
+        'version': index.version,
+        'zoom': zoom,
+        'statuses': STATUSES,
+        'clients': layer['clients'],
+        'clusters': layer['clusters'],
+    }
@@ -0,0 +1,326 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+from .matching import EARTH_RADIUS_KM, haversine_matrix
+
+# Grid cell size in degrees (~1.1 km of latitude)
+CELL_DEGREES = 0.01
+
+# Process-wide indexes are rebuilt from the database after this many seconds,
+# which picks up moves written by other worker processes
+INDEX_TTL_SECONDS = 60
+
+KM_PER_DEGREE = math.radians(1) * EARTH_RADIUS_KM
+
+
+class SpatialIndex:
+    """Uniform latitude/longitude grid of points keyed by id.
+
+    Points can be inserted, moved and removed in O(1), so the index can be
+    kept up to date as agents report their location. Queries only look at
+    the grid cells around the query point instead of scanning every row.
+    Ties in distance are broken by insertion order.
+    """
+
+    def __init__(self, cell_degrees=CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self._points = {}
+        self._seq = 0
+        self._bounds = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def insert(self, key, lat, lng):
+        """Add a point, or move it if the key is already indexed"""
+        with self._lock:
+            cell = self._cell(lat, lng)
+            current = self._points.get(key)
+            if current is not None:
+                seq = current[3]
+                if current[2] != cell:
+                    self._discard_from_cell(key, current[2])
+            else:
+                seq = self._seq
+                self._seq += 1
+            self._points[key] = (lat, lng, cell, seq)
+            self._cells.setdefault(cell, {})[key] = seq
+
+            i, j = cell
+            if self._bounds is None:
+                self._bounds = [i, i, j, j]
+            else:
+                bounds = self._bounds
+                bounds[0], bounds[1] = min(bounds[0], i), max(bounds[1], i)
+                bounds[2], bounds[3] = min(bounds[2], j), max(bounds[3], j)
+
+    move = insert
+
+    def remove(self, key):
+        with self._lock:
+            current = self._points.pop(key, None)
+            if current is not None:
+                self._discard_from_cell(key, current[2])
+
+    def _discard_from_cell(self, key, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.pop(key, None)
+            if not members:
+                del self._cells[cell]
+
+    def bulk_load(self, rows):
+        """Insert (key, latitude, longitude) rows, skipping missing coordinates"""
+        with self._lock:
+            for key, lat, lng in rows:
+                if lat and lng:
+                    self.insert(key, lat, lng)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+            self._bounds = None
+
+    def position(self, key):
+        point = self._points.get(key)
+        return (point[0], point[1]) if point else None
+
+    def _distances(self, lat, lng, keys):
+        """Sorted (key, distance_km) pairs for the given keys"""
+        if not keys:
+            return []
+        points = [self._points[key] for key in keys]
+        distances = haversine_matrix(
+            np.array([lat]), np.array([lng]),
+            np.array([p[0] for p in points]), np.array([p[1] for p in points])
+        )[0]
+        order = np.lexsort((np.array([p[3] for p in points]), distances))
+        return [(keys[i], float(distances[i])) for i in order]
+
+    def _ring(self, center, ring):
+        """Keys in the square ring of cells at Chebyshev distance `ring`"""
+        ci, cj = center
+        if ring == 0:
+            return list(self._cells.get(center, ()))
+        keys = []
+        for i in range(ci - ring, ci + ring + 1):
+            if i in (ci - ring, ci + ring):
+                columns = range(cj - ring, cj + ring + 1)
+            else:
+                columns = (cj - ring, cj + ring)
+            for j in columns:
+                members = self._cells.get((i, j))
+                if members:
+                    keys.extend(members)
+        return keys
+
+    def _max_ring(self, center):
+        if self._bounds is None:
+            return -1
+        i_min, i_max, j_min, j_max = self._bounds
+        ci, cj = center
+        return max(ci - i_min, i_max - ci, cj - j_min, j_max - cj)
+
+    def _covered_km(self, lat, ring):
+        """Radius guaranteed to be fully searched after rings 0..ring"""
+        worst_lat = min(89.0, abs(lat) + (ring + 1) * self.cell_degrees)
+        return ring * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(worst_lat)) * 0.99
+
+    def nearest(self, lat, lng, k=1):
+        """The k closest points as (key, distance_km), nearest first"""
+        with self._lock:
+            if k >= len(self._points):
+                return self._distances(lat, lng, list(self._points))[:k]
+            center = self._cell(lat, lng)
+            max_ring = self._max_ring(center)
+            candidates = []
+            found = []
+            ring = 0
+            while ring <= max_ring:
+                # Once the rings span more cells than are occupied, one scan
+                # of every point is cheaper than walking further out
+                if (2 * ring + 1) ** 2 > len(self._cells):
+                    return self._distances(lat, lng, list(self._points))[:k]
+                keys = self._ring(center, ring)
+                if keys:
+                    candidates.extend(keys)
+                    if len(candidates) >= k:
+                        found = self._distances(lat, lng, candidates)
+                if found and found[k - 1][1] <= self._covered_km(lat, ring):
+                    return found[:k]
+                ring += 1
+            return self._distances(lat, lng, candidates)[:k]
+
+    def within(self, lat, lng, radius_km):
+        """All points within `radius_km` as (key, distance_km), nearest first"""
+        with self._lock:
+            if self._bounds is None:
+                return []
+            dlat = radius_km / KM_PER_DEGREE
+            dlng = dlat / max(math.cos(math.radians(min(89.0, abs(lat) + dlat))), 0.01)
+            i_min, j_min = self._cell(lat - dlat, lng - dlng)
+            i_max, j_max = self._cell(lat + dlat, lng + dlng)
+
+            if (i_max - i_min + 1) * (j_max - j_min + 1) > len(self._cells):
+                keys = list(self._points)
+            else:
+                keys = []
+                for i in range(i_min, i_max + 1):
+                    for j in range(j_min, j_max + 1):
+                        members = self._cells.get((i, j))
+                        if members:
+                            keys.extend(members)
+
+            return [(key, d) for key, d in self._distances(lat, lng, keys) if d <= radius_km]
+
+
+def greedy_match_indexed(client_lat, client_lng, agent_lat, agent_lng):
+    """Same result as `greedy_match(distance_matrix(...))` without the full matrix.
+
+    Each client in order takes its nearest remaining agent from a spatial
+    index, so memory stays O(agents) for very large pending lists.
+    """
+    index = SpatialIndex()
+    index.bulk_load(zip(range(len(agent_lat)), agent_lat, agent_lng))
+    matches = []
+
+    for row in range(len(client_lat)):
+        if not len(index):
+            break
+        if not (client_lat[row] and client_lng[row]):
+            continue
+        col, distance = index.nearest(client_lat[row], client_lng[row])[0]
+        matches.append((row, col, distance))
+        index.remove(col)
+
+    return matches
+
+
+# Process-wide indexes of agent and pending client positions
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _load_agents(index):
+    from .models import User
+    from .positions import apply_to_rows
+    index.bulk_load(apply_to_rows(
+        User.objects.filter(user_type='agent', is_active_agent=True)
+        .values_list('id', 'current_latitude', 'current_longitude')
+    ))
+
+
+def _load_pending_clients(index):
+    from .models import Client
+    index.bulk_load(
+        Client.objects.filter(status='pending').values_list('id', 'latitude', 'longitude')
+    )
+
+
+def _get_index(name, loader):
+    with _indexes_lock:
+        entry = _indexes.get(name)
+        if entry is None or time.monotonic() - entry[1] > INDEX_TTL_SECONDS:
+            # Readers keep using the old index until the new one is loaded
+            index = SpatialIndex()
+            loader(index)
+            entry = _indexes[name] = (index, time.monotonic())
+        return entry[0]
+
+
+def agent_index():
+    """Index of active agents' current positions, keyed by user id"""
+    return _get_index('agents', _load_agents)
+
+
+def client_index():
+    """Index of pending clients, keyed by client id"""
+    return _get_index('clients', _load_pending_clients)
+
+
+def move_agent(agent_id, latitude, longitude):
+    """Move an agent in the agent index if this process has already loaded it.
+
+    Never touches the database, so it is safe to call from async code.
+    """
+    entry = _indexes.get('agents')
+    if entry is not None:
+        entry[0].move(agent_id, latitude, longitude)
+
+
+def invalidate(name=None):
+    """Force a rebuild of one ('agents' / 'clients') or all indexes"""
+    with _indexes_lock:
+        if name is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(name, None)
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lat, lng, precision):
+    """Standard base32 geohash of a point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """(lat_degrees, lng_degrees) covered by one geohash cell"""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def geohash_tiles(south, west, north, east, precision, limit=None):
+    """Geohash cells covering a bounding box.
+
+    Returns None when more than `limit` cells would be needed.
+    """
+    lat_step, lng_step = geohash_cell_size(precision)
+    south, north = max(south, -90.0), min(north, 90.0 - 1e-9)
+    west, east = max(west, -180.0), min(east, 180.0 - 1e-9)
+    rows = math.floor((north + 90) / lat_step) - math.floor((south + 90) / lat_step) + 1
+    columns = math.floor((east + 180) / lng_step) - math.floor((west + 180) / lng_step) + 1
+    if limit is not None and rows * columns > limit:
+        return None
+
+    first_lat = (math.floor((south + 90) / lat_step) + 0.5) * lat_step - 90
+    first_lng = (math.floor((west + 180) / lng_step) + 0.5) * lng_step - 180
+    return {
+        geohash_encode(first_lat + row * lat_step, first_lng + column * lng_step, precision)
+        for row in range(rows)
+        for column in range(columns)
+    }
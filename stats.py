@@ -0,0 +1,41 @@
+"""
+Dashboard statistics, computed in one query per table and cached briefly.
+
+Anything that creates assignments, changes their status or adds clients
+should call `invalidate_dashboard_stats()` so managers see fresh counts.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Assignment, Client, User
+
+STATS_CACHE_KEY = 'dashboard_stats'
+
+ACTIVE_ASSIGNMENT_STATUSES = ['assigned', 'accepted', 'in_progress']
+
+
+def compute_dashboard_stats():
+    """Client, agent and assignment counts, one filtered aggregate per table"""
+    stats = User.objects.filter(user_type='agent', is_active_agent=True).aggregate(active_agents=Count('pk'))
+    stats.update(Client.objects.aggregate(
+        total_clients=Count('pk'),
+        pending_clients=Count('pk', filter=Q(status='pending')),
+    ))
+    stats.update(
+        Assignment.objects.filter(status__in=ACTIVE_ASSIGNMENT_STATUSES).aggregate(active_assignments=Count('pk'))
+    )
+    return stats
+
+
+def dashboard_stats():
+    """Cached dashboard counts, recomputed at most every DASHBOARD_STATS_TTL seconds"""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        stats = compute_dashboard_stats()
+        cache.set(STATS_CACHE_KEY, stats, timeout=settings.DASHBOARD_STATS_TTL)
+    return stats
+
+
+def invalidate_dashboard_stats():
+    cache.delete(STATS_CACHE_KEY)
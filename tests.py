@@ -0,0 +1,197 @@
+import re
+import threading
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+
+from .models import Assignment, Client, LocationLog, User
+from .stats import ACTIVE_ASSIGNMENT_STATUSES
+from .views import create_assignments
+
+
+def _random_points(rng, count, center=(12.9716, 77.5946), spread=0.3):
+    lat = center[0] + rng.uniform(-spread, spread, count)
+    lng = center[1] + rng.uniform(-spread, spread, count)
+    return lat, lng
+
+
+# A full table scan: Postgres "Seq Scan", or a SQLite "SCAN table" with no index
+FULL_SCAN = re.compile(r'Seq Scan on|\bSCAN \w+\s*$', re.MULTILINE)
+
+
+class QueryPlanTests(TestCase):
+    """The hot filters use an index on large, skewed tables.
+
+    Few active agents, pending clients and open assignments, as in
+    production. Only the seeded tables are analyzed.
+    """
+
+    n_agents = 200
+    n_users = 20_000
+    n_clients = 200_000
+    n_logs = 500_000
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(0)
+        users = User.objects.bulk_create([
+            User(
+                username=f'plan_user_{i}',
+                user_type='agent' if i < cls.n_agents * 4 else 'manager',
+                is_active_agent=i < cls.n_agents,
+            )
+            for i in range(cls.n_users)
+        ], batch_size=5000)
+        agents = users[:cls.n_agents]
+        cls.agent_id = agents[0].id
+
+        lat, lng = _random_points(rng, cls.n_clients)
+        clients = Client.objects.bulk_create([
+            Client(
+                name=f'Plan client {i}', phone='9000000000', address='MG Road',
+                latitude=lat[i], longitude=lng[i], priority=int(rng.integers(1, 5)),
+                status='pending' if i % 50 == 0 else 'completed',
+            )
+            for i in range(cls.n_clients)
+        ], batch_size=5000)
+
+        Assignment.objects.bulk_create([
+            Assignment(
+                agent=agents[i % cls.n_agents], client=client,
+                status='assigned' if i % 100 == 0 else 'completed',
+            )
+            for i, client in enumerate(clients)
+        ], batch_size=5000)
+
+        now = timezone.now()
+        LocationLog.objects.bulk_create([
+            LocationLog(
+                agent=agents[i % cls.n_agents], latitude=lat[i % cls.n_clients], longitude=lng[i % cls.n_clients],
+                timestamp=now - timedelta(seconds=i),
+            )
+            for i in range(cls.n_logs)
+        ], batch_size=5000)
+
+        with connection.cursor() as cursor:
+            for model in (User, Client, Assignment, LocationLog):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+    def assertIndexScan(self, queryset):
+        plan = queryset.explain()
+        self.assertIsNone(FULL_SCAN.search(plan), plan)
+
+    def test_pending_clients(self):
+        self.assertIndexScan(Client.objects.filter(status='pending').order_by('-priority', 'created_at'))
+
+    def test_agent_availability(self):
+        self.assertIndexScan(Assignment.objects.filter(agent_id=self.agent_id, status__in=ACTIVE_ASSIGNMENT_STATUSES))
+
+    def test_active_agents(self):
+        self.assertIndexScan(User.objects.filter(user_type='agent', is_active_agent=True))
+
+    def test_agent_track(self):
+        self.assertIndexScan(LocationLog.objects.filter(agent_id=self.agent_id)[:100])
+
+
+# SQLite has no row locks and aborts racing writers instead of queueing them
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+@override_settings(DISPATCH_ENABLED=False)
+class ConcurrentAssignmentTests(TransactionTestCase):
+    """Threads assigning, completing and re-assigning the same rows.
+
+    Every thread repeatedly matches all agents against a random sample of
+    pending clients, and completes a random sample of open assignments, so
+    dispatchers collide on the same rows. The dispatcher is off so nothing
+    assigns behind the workers' backs.
+    """
+
+    n_agents = 40
+    n_clients = 400
+    workers = 8
+    rounds = 15
+    seed = 0
+
+    def setUp(self):
+        rng = np.random.default_rng(self.seed)
+        lat, lng = _random_points(rng, self.n_clients)
+        self.agent_ids = [agent.id for agent in User.objects.bulk_create([
+            User(username=f'stress_agent_{i}', user_type='agent', is_active_agent=True)
+            for i in range(self.n_agents)
+        ])]
+        self.client_ids = [client.id for client in Client.objects.bulk_create([
+            Client(name=f'Stress client {i}', phone='9000000000', address='MG Road',
+                   latitude=lat[i], longitude=lng[i])
+            for i in range(self.n_clients)
+        ])]
+        self.completions = Counter()
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def _worker(self, index, barrier):
+        local = np.random.default_rng(self.seed + index + 1)
+        try:
+            barrier.wait()
+            for _ in range(self.rounds):
+                pending = list(
+                    Client.objects.filter(id__in=self.client_ids, status='pending').values_list('id', flat=True)
+                )
+                sample = local.permutation(pending)[:self.n_agents].tolist()
+                create_assignments(list(zip(local.permutation(self.agent_ids).tolist(), sample)))
+
+                open_ids = list(
+                    Assignment.objects.filter(agent_id__in=self.agent_ids, status__in=ACTIVE_ASSIGNMENT_STATUSES)
+                    .values_list('id', flat=True)
+                )
+                finished = []
+                chosen = local.permutation(open_ids)[:self.n_agents // 2].tolist()
+                for assignment in Assignment.objects.filter(id__in=chosen):
+                    if assignment.mark_completed():
+                        finished.append(assignment.id)
+                with self.lock:
+                    self.completions.update(finished)
+        except Exception as exc:
+            with self.lock:
+                self.errors.append(repr(exc))
+        finally:
+            connection.close()
+
+    def test_no_double_booking_under_concurrent_assignment(self):
+        barrier = threading.Barrier(self.workers)
+        threads = [threading.Thread(target=self._worker, args=(index, barrier)) for index in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.errors, [])
+
+        assignments = Assignment.objects.filter(agent_id__in=self.agent_ids)
+        self.assertTrue(assignments.exists())
+
+        # A client is only ever assigned once; it is completed, never released
+        double_booked = assignments.values('client_id').annotate(n=Count('id')).filter(n__gt=1)
+        self.assertEqual(list(double_booked), [])
+
+        # An agent's next assignment must start after the previous one was completed
+        previous = {}
+        for agent_id, assigned_at, completed_at in assignments.order_by('assigned_at').values_list(
+            'agent_id', 'assigned_at', 'completed_at'
+        ):
+            if agent_id in previous:
+                self.assertIsNotNone(previous[agent_id], f'agent {agent_id} had two open assignments')
+                self.assertLessEqual(previous[agent_id], assigned_at, f'agent {agent_id} had two open assignments')
+            previous[agent_id] = completed_at
+
+        # Every completion was won by exactly one thread
+        completed = set(assignments.filter(status='completed').values_list('id', flat=True))
+        self.assertEqual(set(self.completions), completed)
+        self.assertEqual([n for n in self.completions.values() if n != 1], [])
+
+        # A client marked assigned has an open assignment
+        open_clients = assignments.filter(status__in=ACTIVE_ASSIGNMENT_STATUSES).values_list('client_id', flat=True)
+        stale = Client.objects.filter(id__in=self.client_ids, status='assigned').exclude(id__in=open_clients)
+        self.assertEqual(stale.count(), 0)
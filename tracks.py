@@ -0,0 +1,146 @@
+"""
+Compressed agent trails for replaying routes on the manager map.
+
+A trail is simplified with Douglas-Peucker and returned as an encoded
+polyline (Google's format, 5 decimal places) plus delta-encoded timestamps,
+so a day of fixes fits in a few kilobytes.
+"""
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .matching import EARTH_RADIUS_KM
+
+
+def _project(lat, lng):
+    """Equirectangular projection to metres around the trail's mean latitude"""
+    scale = EARTH_RADIUS_KM * 1000 * np.pi / 180
+    x = lng * scale * np.cos(np.radians(lat.mean()))
+    y = lat * scale
+    return x, y
+
+
+def douglas_peucker(lat, lng, tolerance_m):
+    """Indices of the points kept when simplifying a trail to `tolerance_m` metres.
+
+    Iterative, with each segment's interior distances computed in one
+    vectorized pass. The first and last points are always kept.
+    """
+    n = len(lat)
+    if n < 3:
+        return np.arange(n)
+
+    x, y = _project(np.asarray(lat, dtype=float), np.asarray(lng, dtype=float))
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(px * dy - py * dx) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.flatnonzero(keep)
+
+
+def _encode_values(values):
+    chunks = []
+    for value in values.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return chunks
+
+
+def encode_polyline(lat, lng, precision=5):
+    """Encode coordinates with Google's polyline algorithm"""
+    factor = 10 ** precision
+    points = np.column_stack([
+        np.round(np.asarray(lat, dtype=float) * factor),
+        np.round(np.asarray(lng, dtype=float) * factor),
+    ]).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return ''.join(_encode_values(deltas.ravel()))
+
+
+def decode_polyline(polyline, precision=5):
+    """Inverse of encode_polyline; returns a list of (lat, lng)"""
+    values, value, shift = [], 0, 0
+    for char in polyline:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    coords = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return [tuple(point) for point in coords.tolist()]
+
+
+def build_track(agent_id, start, end, tolerance_m):
+    """Simplified, encoded trail of an agent between `start` and `end`"""
+    from .models import LocationLog
+
+    rows = list(
+        LocationLog.objects.filter(agent_id=agent_id, timestamp__gte=start, timestamp__lt=end)
+        .order_by('timestamp')
+        .values_list('latitude', 'longitude', 'timestamp')
+    )
+    track = {
+        'agent_id': agent_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'tolerance_m': tolerance_m,
+        'points': len(rows),
+        'simplified_points': 0,
+        'polyline': '',
+        'timestamps': [],
+    }
+    if not rows:
+        return track
+
+    lat = np.array([row[0] for row in rows])
+    lng = np.array([row[1] for row in rows])
+    seconds = np.array([int(row[2].timestamp()) for row in rows], dtype=np.int64)
+    kept = douglas_peucker(lat, lng, tolerance_m)
+
+    track['simplified_points'] = len(kept)
+    track['polyline'] = encode_polyline(lat[kept], lng[kept])
+    # First entry is a Unix time, the rest are seconds since the previous point
+    track['timestamps'] = np.diff(seconds[kept], prepend=0).tolist()
+    return track
+
+
+def get_track(agent_id, start, end, tolerance_m=None):
+    """Cached build_track, keyed on (agent, window, tolerance).
+
+    Windows that are still open are cached for TRACK_CACHE_TTL seconds,
+    closed ones for TRACK_HISTORY_CACHE_TTL.
+    """
+    tolerance_m = tolerance_m if tolerance_m is not None else settings.TRACK_TOLERANCE_M
+    key = f'track:{agent_id}:{int(start.timestamp())}:{int(end.timestamp())}:{tolerance_m:g}'
+    track = cache.get(key)
+    if track is None:
+        track = build_track(agent_id, start, end, tolerance_m)
+        if end > timezone.now():
+            timeout = settings.TRACK_CACHE_TTL
+        else:
+            timeout = settings.TRACK_HISTORY_CACHE_TTL
+        cache.set(key, track, timeout=timeout)
+    return track
@@ -12,10 +12,19 @@ urlpatterns = [
     # Assignment URLs
     path('auto-assign/', views.auto_assign_clients, name='auto_assign_clients'),
     path('manual-assign/', views.manual_assign, name='manual_assign'),
+    path('plan-routes/', views.plan_routes, name='plan_routes'),
     path('upload-clients/', views.upload_clients, name='upload_clients'),
     
     # AJAX URLs
     path('update-location/', views.update_location, name='update_location'),
     path('update-assignment-status/', views.update_assignment_status, name='update_assignment_status'),
     path('get-route/', views.get_route, name='get_route'),
+    path('travel-matrix/', views.travel_matrix, name='travel_matrix'),
+    path('nearby-clients/', views.nearby_clients, name='nearby_clients'),
+    path('nearest-agents/', views.nearest_agents, name='nearest_agents'),
+    path('dashboard-changes/', views.dashboard_changes, name='dashboard_changes'),
+    path('map-snapshot/', views.map_snapshot, name='map_snapshot'),
+    path('map-tiles/<int:z>/<int:x>/<int:y>/', views.map_tile, name='map_tile'),
+    path('ingestion-metrics/', views.ingestion_metrics, name='ingestion_metrics'),
+    path('agent-track/<int:agent_id>/', views.agent_track, name='agent_track'),
 ]
\ No newline at end of file
@@ -4,16 +4,34 @@ from django.contrib.auth import login, authenticate
 from django.contrib import messages
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Q
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch, Q
 from django.core.paginator import Paginator
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 import json
-import pandas as pd
+import numpy as np
 import math
-from .models import User, Client, Assignment, LocationLog, ImportLog
+from datetime import timedelta
+from .models import User, Client, Assignment
 from .forms import ClientUploadForm, AssignmentForm
+from .idempotency import idempotent
+from .matching import PRIORITY_WEIGHT_KM, coords_array, distance_matrix, greedy_match, optimal_match
+from . import changes, clustering, planning, positions, roads, snapshot, spatial, tracks
+from .ingestion import location_buffer, parse_fixes, status_writer
+from .jobs import enqueue_import
+from .stats import ACTIVE_ASSIGNMENT_STATUSES, dashboard_stats, invalidate_dashboard_stats
+
+# Above this many client x agent pairs greedy mode matches through a spatial
+# index instead of materializing the full distance matrix
+MATRIX_CELL_LIMIT = 20_000_000
+
+# Deepest map tile served; Leaflet's default maximum zoom is 18
+MAX_TILE_ZOOM = 22
 
 # Home page - redirects based on user type
 @login_required
@@ -30,35 +48,43 @@ def manager_dashboard(request):
         messages.error(request, "Access denied. Managers only.")
         return redirect('agent_dashboard')
     
+    # Taken before any query, so the first change-feed sync cannot miss a write
+    sync_version = changes.current_version()
+    
     # Get statistics
-    total_clients = Client.objects.count()
-    pending_clients = Client.objects.filter(status='pending').count()
-    active_agents = User.objects.filter(user_type='agent', is_active_agent=True).count()
-    active_assignments = Assignment.objects.filter(status__in=['assigned', 'accepted', 'in_progress']).count()
+    stats = dashboard_stats()
     
     # Get recent assignments
     recent_assignments = Assignment.objects.select_related('agent', 'client').order_by('-assigned_at')[:10]
     
     # Get all agents with their current assignments
-    agents = User.objects.filter(user_type='agent').prefetch_related('assignments')
+    agents = positions.apply_to_users(
+        User.objects.filter(user_type='agent').prefetch_related(
+            Prefetch(
+                'assignments',
+                queryset=Assignment.objects.filter(
+                    status__in=ACTIVE_ASSIGNMENT_STATUSES
+                ).select_related('client').order_by(F('sequence').asc(nulls_first=True), '-assigned_at'),
+                to_attr='active_assignments'
+            )
+        )
+    )
     agents_data = []
     for agent in agents:
-        current_assignment = agent.assignments.filter(
-            status__in=['assigned', 'accepted', 'in_progress']
-        ).first()
         agents_data.append({
             'agent': agent,
-            'current_assignment': current_assignment,
+            'current_assignment': agent.active_assignments[0] if agent.active_assignments else None,
             'last_update': agent.last_location_update
         })
     
     context = {
-        'total_clients': total_clients,
-        'pending_clients': pending_clients,
-        'active_agents': active_agents,
-        'active_assignments': active_assignments,
+        'total_clients': stats['total_clients'],
+        'pending_clients': stats['pending_clients'],
+        'active_agents': stats['active_agents'],
+        'active_assignments': stats['active_assignments'],
         'recent_assignments': recent_assignments,
         'agents_data': agents_data,
+        'sync_version': sync_version,
     }
     
     return render(request, 'operations/manager_dashboard.html', context)
@@ -74,7 +100,7 @@ def agent_dashboard(request):
     current_assignment = Assignment.objects.filter(
         agent=request.user,
         status__in=['assigned', 'accepted', 'in_progress']
-    ).select_related('client').first()
+    ).select_related('client').order_by(F('sequence').asc(nulls_first=True), '-assigned_at').first()
     
     # Get assignment history
     assignment_history = Assignment.objects.filter(
@@ -90,6 +116,7 @@ def agent_dashboard(request):
 
 # Auto-assign clients to agents
 @login_required
+@idempotent
 def auto_assign_clients(request):
     if request.user.user_type != 'manager':
         return JsonResponse({'error': 'Access denied'}, status=403)
@@ -105,48 +132,141 @@ def auto_assign_clients(request):
     # Get pending clients
     pending_clients = Client.objects.filter(status='pending').order_by('-priority')
     
-    assignments_created = 0
+    # Greedy by priority, or priority-weighted min-cost matching
+    mode = request.POST.get('mode') or request.GET.get('mode', 'greedy')
+    if mode not in ('greedy', 'optimal'):
+        return JsonResponse({'error': 'Invalid mode'}, status=400)
     
-    for client in pending_clients:
-        if not available_agents.exists():
-            break
-        
-        # Find closest agent
-        best_agent = None
-        min_distance = float('inf')
-        
-        for agent in available_agents:
-            if agent.current_latitude and agent.current_longitude:
-                distance = client.distance_from(agent.current_latitude, agent.current_longitude)
-                if distance < min_distance:
-                    min_distance = distance
-                    best_agent = agent
-        
-        # Assign client to best agent
-        if best_agent:
-            assignment = Assignment.objects.create(
-                agent=best_agent,
-                client=client,
-                status='assigned'
-            )
-            client.status = 'assigned'
-            client.save()
-            
-            # Remove agent from available list
-            available_agents = available_agents.exclude(id=best_agent.id)
-            assignments_created += 1
-            
-            # Send real-time notification
-            send_assignment_notification(assignment)
+    # Match on straight-line distance, or on road travel time
+    metric = request.POST.get('metric') or request.GET.get('metric', 'distance')
+    if metric not in ('distance', 'time'):
+        return JsonResponse({'error': 'Invalid metric'}, status=400)
     
-    return JsonResponse({
+    # Load coordinates once and match in a single vectorized pass
+    agent_ids, agent_lat, agent_lng = coords_array(positions.apply_to_rows(
+        available_agents.values_list('id', 'current_latitude', 'current_longitude')
+    ))
+    client_rows = list(pending_clients.values_list('id', 'latitude', 'longitude', 'priority'))
+    client_ids, client_lat, client_lng = coords_array(client_rows)
+    
+    matches = greedy_matches = []
+    if mode == 'greedy' and metric == 'distance' and len(agent_ids) * len(client_ids) > MATRIX_CELL_LIMIT:
+        matches = greedy_matches = spatial.greedy_match_indexed(client_lat, client_lng, agent_lat, agent_lng)
+    elif len(agent_ids) and len(client_ids):
+        if metric == 'time':
+            costs = roads.travel_time_matrix(client_lat, client_lng, agent_lat, agent_lng)
+            # One priority level is worth as long as PRIORITY_WEIGHT_KM takes to drive
+            priority_weight = float(roads.fallback_travel_times(PRIORITY_WEIGHT_KM))
+        else:
+            costs = distance_matrix(client_lat, client_lng, agent_lat, agent_lng)
+            priority_weight = PRIORITY_WEIGHT_KM
+        matches = greedy_matches = greedy_match(costs)
+        if mode == 'optimal':
+            priorities = np.array([row[3] for row in client_rows])
+            matches = optimal_match(costs, priorities, client_lat, client_lng, agent_lat, agent_lng,
+                                    priority_weight=priority_weight)
+    
+    assignments = create_assignments(
+        [(int(agent_ids[col]), int(client_ids[row])) for row, col, _ in matches]
+    )
+    assignments_created = len(assignments)
+    
+    result = {
         'success': True,
+        'mode': mode,
+        'metric': metric,
         'assignments_created': assignments_created,
         'message': f'{assignments_created} assignments created successfully.'
+    }
+    if metric == 'time':
+        result['total_duration_min'] = round(sum(cost for _, _, cost in matches) / 60, 1)
+        result['greedy_duration_min'] = round(sum(cost for _, _, cost in greedy_matches) / 60, 1)
+    else:
+        result['total_distance_km'] = round(sum(cost for _, _, cost in matches), 3)
+        result['greedy_distance_km'] = round(sum(cost for _, _, cost in greedy_matches), 3)
+    return JsonResponse(result)
+
+# Plan multi-stop tours for the day
+@login_required
+@idempotent
+def plan_routes(request):
+    if request.user.user_type != 'manager':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    
+    # Agents without open work, and every pending client, most urgent first
+    available_agents = User.objects.filter(
+        user_type='agent',
+        is_active_agent=True
+    ).exclude(
+        assignments__status__in=ACTIVE_ASSIGNMENT_STATUSES
+    )
+    agent_ids, agent_lat, agent_lng = coords_array(positions.apply_to_rows(
+        available_agents.values_list('id', 'current_latitude', 'current_longitude')
+    ))
+    client_rows = list(
+        Client.objects.filter(status='pending').order_by('-priority', 'created_at')
+        .values_list('id', 'latitude', 'longitude', 'priority')
+    )
+    client_ids, client_lat, client_lng = coords_array(client_rows)
+    priorities = np.array([row[3] for row in client_rows], dtype=float)
+    
+    # Only plan what has coordinates on both sides
+    located_agents = np.flatnonzero((agent_lat != 0) & (agent_lng != 0))
+    located_clients = np.flatnonzero((client_lat != 0) & (client_lng != 0))
+    tours = {}
+    if len(located_agents) and len(located_clients):
+        tours, _ = planning.plan_tours(
+            client_lat[located_clients], client_lng[located_clients], priorities[located_clients],
+            agent_lat[located_agents], agent_lng[located_agents], roads.travel_time_matrix
+        )
+    
+    start = timezone.now()
+    service_minutes = planning.plan_options()['service_seconds'] // 60
+    planned = [
+        (
+            int(agent_ids[located_agents[agent]]),
+            int(client_ids[located_clients[client]]),
+            {
+                'sequence': position,
+                'planned_arrival': start + timedelta(seconds=arrival),
+                'estimated_duration': service_minutes,
+            }
+        )
+        for agent, tour in tours.items()
+        for position, (client, arrival) in enumerate(tour, start=1)
+    ]
+    
+    # Preview unless asked to commit the plan
+    commit = (request.POST.get('commit') or request.GET.get('commit')) in ('1', 'true')
+    if commit:
+        created = create_assignments([(agent_id, client_id) for agent_id, client_id, _ in planned],
+                                     details=[extra for _, _, extra in planned])
+        # Stops skipped under lock or lost to another writer count as unplanned
+        created = {(assignment.agent_id, assignment.client_id) for assignment in created}
+        planned = [stop for stop in planned if (stop[0], stop[1]) in created]
+    
+    tours_data = {}
+    for agent_id, client_id, extra in planned:
+        tours_data.setdefault(agent_id, []).append({
+            'client_id': client_id,
+            'sequence': extra['sequence'],
+            'planned_arrival': extra['planned_arrival'].isoformat(),
+        })
+    
+    return JsonResponse({
+        'success': True,
+        'committed': commit,
+        'tours': [{'agent_id': agent_id, 'stops': stops} for agent_id, stops in tours_data.items()],
+        'planned_stops': len(planned),
+        'unplanned_clients': len(client_rows) - len(planned),
     })
 
 # Manual assignment
 @login_required
+@idempotent
 def manual_assign(request):
     if request.user.user_type != 'manager':
         return JsonResponse({'error': 'Access denied'}, status=403)
@@ -162,29 +282,22 @@ def manual_assign(request):
             # Check if agent is available
             existing_assignment = Assignment.objects.filter(
                 agent=agent,
-                status__in=['assigned', 'accepted', 'in_progress']
+                status__in=ACTIVE_ASSIGNMENT_STATUSES
             ).exists()
             
             if existing_assignment:
                 return JsonResponse({'error': 'Agent is already assigned to another client'}, status=400)
             
-            assignment = Assignment.objects.create(
-                agent=agent,
-                client=client,
-                status='assigned'
-            )
-            client.status = 'assigned'
-            client.save()
-            
-            # Send real-time notification
-            send_assignment_notification(assignment)
+            # The check above is advisory; create_assignments re-checks under lock
+            if not create_assignments([(agent.id, client.id)]):
+                return JsonResponse({'error': 'Agent or client was just assigned by another request'}, status=409)
             
             return JsonResponse({
                 'success': True,
                 'message': f'Client {client.name} assigned to {agent.username}'
             })
             
-        except (User.DoesNotExist, Client.DoesNotExist) as e:
+        except (User.DoesNotExist, Client.DoesNotExist, ValueError) as e:
             return JsonResponse({'error': 'Invalid agent or client'}, status=400)
     
     return JsonResponse({'error': 'Invalid request method'}, status=405)
@@ -201,74 +314,11 @@ def upload_clients(request):
         if form.is_valid():
             excel_file = request.FILES['file']
             
-            try:
-                # Read Excel file
-                df = pd.read_excel(excel_file)
-                
-                # Expected columns: name, phone, email, address, latitude, longitude, priority
-                required_columns = ['name', 'phone', 'address', 'latitude', 'longitude']
-                
-                if not all(col in df.columns for col in required_columns):
-                    messages.error(request, f"Excel file must contain columns: {', '.join(required_columns)}")
-                    return redirect('upload_clients')
-                
-                successful_imports = 0
-                failed_imports = 0
-                error_details = []
-                
-                for index, row in df.iterrows():
-                    try:
-                        # Clean and validate data
-                        name = str(row['name']).strip()
-                        phone = str(row['phone']).strip()
-                        address = str(row['address']).strip()
-                        latitude = float(row['latitude'])
-                        longitude = float(row['longitude'])
-                        
-                        # Optional fields
-                        email = str(row.get('email', '')).strip() if pd.notna(row.get('email')) else ''
-                        priority = int(row.get('priority', 2)) if pd.notna(row.get('priority')) else 2
-                        
-                        # Validate priority
-                        if priority not in [1, 2, 3, 4]:
-                            priority = 2
-                        
-                        # Create client
-                        Client.objects.create(
-                            name=name,
-                            phone=phone,
-                            email=email if email else None,
-                            address=address,
-                            latitude=latitude,
-                            longitude=longitude,
-                            priority=priority
-                        )
-                        successful_imports += 1
-                        
-                    except Exception as e:
-                        failed_imports += 1
-                        error_details.append(f"Row {index + 2}: {str(e)}")
-                
-                # Log the import
-                ImportLog.objects.create(
-                    uploaded_by=request.user,
-                    file_name=excel_file.name,
-                    total_rows=len(df),
-                    successful_imports=successful_imports,
-                    failed_imports=failed_imports,
-                    error_details='\n'.join(error_details) if error_details else None
-                )
-                
-                if successful_imports > 0:
-                    messages.success(request, f"Successfully imported {successful_imports} clients.")
-                if failed_imports > 0:
-                    messages.warning(request, f"{failed_imports} rows failed to import. Check import logs for details.")
-                
-                return redirect('manager_dashboard')
-                
-            except Exception as e:
-                messages.error(request, f"Error processing file: {str(e)}")
-                return redirect('upload_clients')
+            # Processed by a background worker; progress arrives over the WebSocket
+            import_log = enqueue_import(excel_file, request.user)
+            messages.info(request, f"Import of {import_log.file_name} has started. Progress is shown on the dashboard.")
+            
+            return redirect('manager_dashboard')
     else:
         form = ClientUploadForm()
     
@@ -281,27 +331,18 @@ def update_location(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            latitude = float(data.get('latitude'))
-            longitude = float(data.get('longitude'))
-            accuracy = data.get('accuracy')
+            # One fix, or {"fixes": [...]} queued by the client while offline
+            fixes = parse_fixes(data['fixes'] if 'fixes' in data else [data])
             
-            # Update user location
-            request.user.current_latitude = latitude
-            request.user.current_longitude = longitude
-            request.user.last_location_update = timezone.now()
-            request.user.save()
+            # Queue the fixes; positions and log are written in the next batch
+            location_buffer.add_many(request.user.id, fixes)
+            if request.user.user_type == 'agent' and request.user.is_active_agent:
+                latitude, longitude, _, _ = fixes[-1]
+                spatial.move_agent(request.user.id, latitude, longitude)
             
-            # Log location
-            LocationLog.objects.create(
-                agent=request.user,
-                latitude=latitude,
-                longitude=longitude,
-                accuracy=accuracy
-            )
-            
-            return JsonResponse({'success': True})
+            return JsonResponse({'success': True, 'accepted': len(fixes)})
             
-        except (ValueError, KeyError) as e:
+        except (ValueError, KeyError, TypeError) as e:
             return JsonResponse({'error': 'Invalid location data'}, status=400)
     
     return JsonResponse({'error': 'Invalid request method'}, status=405)
@@ -320,13 +361,16 @@ def update_assignment_status(request):
             assignment = get_object_or_404(Assignment, id=assignment_id, agent=request.user)
             
             if new_status == 'accepted':
-                assignment.mark_accepted()
+                changed = assignment.mark_accepted()
             elif new_status == 'in_progress':
-                assignment.mark_started()
+                changed = assignment.mark_started()
             elif new_status == 'completed':
-                assignment.mark_completed()
-                assignment.notes = notes
-                assignment.save()
+                changed = assignment.mark_completed(notes=notes)
+            else:
+                return JsonResponse({'error': 'Invalid status'}, status=400)
+            if not changed:
+                return JsonResponse({'error': f'Assignment can no longer move to {new_status}'}, status=409)
+            invalidate_dashboard_stats()
             
             # Send real-time update
             send_status_update(assignment)
@@ -340,31 +384,306 @@ def update_assignment_status(request):
     
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+# Pending clients near a point (AJAX)
+@login_required
+def nearby_clients(request):
+    current = positions.get_position(request.user.id) or {
+        'latitude': request.user.current_latitude,
+        'longitude': request.user.current_longitude,
+    }
+    try:
+        latitude = float(request.GET.get('lat', current['latitude']))
+        longitude = float(request.GET.get('lng', current['longitude']))
+        radius_km = float(request.GET.get('radius_km', 5))
+        limit = int(request.GET.get('limit', 20))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid location data'}, status=400)
+    
+    if not (math.isfinite(latitude) and math.isfinite(longitude)):
+        return JsonResponse({'error': 'Invalid location data'}, status=400)
+    if not math.isfinite(radius_km) or radius_km < 0:
+        return JsonResponse({'error': 'radius_km must be a non-negative number'}, status=400)
+    if limit <= 0:
+        return JsonResponse({'error': 'limit must be positive'}, status=400)
+    
+    found = spatial.client_index().within(latitude, longitude, radius_km)[:limit]
+    clients = Client.objects.in_bulk([client_id for client_id, _ in found])
+    
+    return JsonResponse({
+        'clients': [
+            {
+                'id': client_id,
+                'name': clients[client_id].name,
+                'address': clients[client_id].address,
+                'latitude': clients[client_id].latitude,
+                'longitude': clients[client_id].longitude,
+                'priority': clients[client_id].priority,
+                'distance_km': round(distance, 3),
+            }
+            for client_id, distance in found if client_id in clients
+        ]
+    })
+
+# Closest agents to a client or point (AJAX)
+@login_required
+def nearest_agents(request):
+    if request.user.user_type != 'manager':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    try:
+        if request.GET.get('client_id'):
+            client = get_object_or_404(Client, id=request.GET['client_id'])
+            latitude, longitude = client.latitude, client.longitude
+        else:
+            latitude = float(request.GET['lat'])
+            longitude = float(request.GET['lng'])
+        limit = int(request.GET.get('limit', 5))
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Invalid location data'}, status=400)
+    
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return JsonResponse({'error': 'Invalid location data'}, status=400)
+    if limit <= 0:
+        return JsonResponse({'error': 'limit must be positive'}, status=400)
+    
+    index = spatial.agent_index()
+    found = index.nearest(latitude, longitude, k=limit)
+    agents = User.objects.in_bulk([agent_id for agent_id, _ in found])
+    
+    return JsonResponse({
+        'agents': [
+            {
+                'id': agent_id,
+                'username': agents[agent_id].username,
+                'latitude': index.position(agent_id)[0],
+                'longitude': index.position(agent_id)[1],
+                'distance_km': round(distance, 3),
+            }
+            for agent_id, distance in found if agent_id in agents
+        ]
+    })
+
+# Location ingestion metrics (AJAX)
+@login_required
+def ingestion_metrics(request):
+    if request.user.user_type != 'manager':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    return JsonResponse(dict(location_buffer.metrics(), status_writes=status_writer.metrics()))
+
+# Clients, assignments and agents changed since a version (AJAX)
+@login_required
+def dashboard_changes(request):
+    if request.user.user_type != 'manager':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    try:
+        since = int(request.GET['since']) if request.GET.get('since') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid version'}, status=400)
+    
+    return JsonResponse(changes.changes_since(since))
+
+# Columnar clients for the manager map's first paint (AJAX)
+@login_required
+def map_snapshot(request):
+    if request.user.user_type != 'manager':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    try:
+        zoom = int(request.GET['zoom']) if request.GET.get('zoom') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid zoom level'}, status=400)
+    levels = snapshot.zoom_levels()
+    if zoom is not None:
+        # Past the deepest clustered level every client is drawn individually
+        zoom = None if zoom > levels[-1] else max(zoom, levels[0])
+    
+    clients = clustering.client_clusters()
+    etag = snapshot.snapshot_etag(clients.version, zoom)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(snapshot.snapshot(clients, zoom))
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+# Client and agent clusters in one map tile (AJAX)
+@login_required
+def map_tile(request, z, x, y):
+    if request.user.user_type != 'manager':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    if z > MAX_TILE_ZOOM or x >= 2 ** z or y >= 2 ** z:
+        return JsonResponse({'error': 'Invalid tile'}, status=400)
+    
+    clients = clustering.client_clusters()
+    agents = clustering.agent_clusters()
+    etag = f'"{clients.tile_version(z, x, y)}-{agents.tile_version(z, x, y)}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        client_tile = clients.tile(z, x, y)
+        agent_tile = agents.tile(z, x, y)
+        response = JsonResponse({
+            'z': z,
+            'x': x,
+            'y': y,
+            'statuses': snapshot.STATUSES,
+            'clients': client_tile['points'],
+            'clusters': client_tile['clusters'],
+            'agents': {key: agent_tile['points'][key] for key in ('id', 'lat', 'lng')},
+            'agent_clusters': {key: agent_tile['clusters'][key] for key in ('lat', 'lng', 'count')},
+        })
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+# Simplified agent trail for route replay (AJAX)
+@login_required
+def agent_track(request, agent_id):
+    if request.user.user_type != 'manager' and request.user.id != agent_id:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    agent = get_object_or_404(User, id=agent_id, user_type='agent')
+    max_window = timedelta(days=settings.TRACK_MAX_WINDOW_DAYS)
+    
+    try:
+        if request.GET.get('end'):
+            end = parse_datetime(request.GET['end'])
+        else:
+            # Round up to the minute so repeated replays share a cache entry
+            end = timezone.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+        if request.GET.get('start'):
+            start = parse_datetime(request.GET['start'])
+        else:
+            hours = float(request.GET.get('hours', 24))
+            # Checked before timedelta(), which overflows on huge values
+            if not 0 < hours <= max_window.total_seconds() / 3600:
+                return JsonResponse({'error': 'Invalid time window'}, status=400)
+            start = end - timedelta(hours=hours)
+        tolerance_m = float(request.GET.get('tolerance_m', settings.TRACK_TOLERANCE_M))
+    except (OverflowError, TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid time window'}, status=400)
+    
+    if start is None or end is None or start >= end or tolerance_m < 0:
+        return JsonResponse({'error': 'Invalid time window'}, status=400)
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    if end - start > max_window:
+        return JsonResponse({'error': 'Time window is too long'}, status=400)
+    
+    return JsonResponse(tracks.get_track(agent.id, start, end, tolerance_m))
+
 # Get route data (AJAX)
 @login_required
 def get_route(request):
     if request.method == 'GET':
-        start_lat = request.GET.get('start_lat')
-        start_lng = request.GET.get('start_lng')
-        end_lat = request.GET.get('end_lat')
-        end_lng = request.GET.get('end_lng')
+        try:
+            start_lat = float(request.GET['start_lat'])
+            start_lng = float(request.GET['start_lng'])
+            end_lat = float(request.GET['end_lat'])
+            end_lng = float(request.GET['end_lng'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Invalid location data'}, status=400)
         
-        # For now, return a simple direct route
-        # In production, you would use OpenRouteService API here
-        route_data = {
-            'coordinates': [
-                [float(start_lng), float(start_lat)],
-                [float(end_lng), float(end_lat)]
-            ],
-            'distance': calculate_distance(float(start_lat), float(start_lng), float(end_lat), float(end_lng)),
-            'duration': 0  # Calculate based on distance and speed
-        }
+        # Road route from the local OSM graph, or a straight line without one
+        route_data = roads.route(start_lat, start_lng, end_lat, end_lng)
         
         return JsonResponse(route_data)
     
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
+# Many-to-many travel time matrix (AJAX)
+@csrf_exempt
+@login_required
+def travel_matrix(request):
+    if request.user.user_type != 'manager':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            sources = np.array(data['sources'], dtype=float).reshape(-1, 2)
+            targets = np.array(data['targets'], dtype=float).reshape(-1, 2)
+        except (KeyError, TypeError, ValueError):
+            return JsonResponse({'error': 'Invalid location data'}, status=400)
+        
+        if len(sources) * len(targets) > settings.TRAVEL_MATRIX_MAX_PAIRS:
+            return JsonResponse({'error': 'Too many source/target pairs'}, status=400)
+        
+        # Rows are targets and columns sources in the engine's layout
+        seconds = roads.travel_time_matrix(targets[:, 0], targets[:, 1], sources[:, 0], sources[:, 1])
+        return JsonResponse({
+            'durations': [
+                [round(value, 1) if np.isfinite(value) else None for value in row]
+                for row in seconds.T.tolist()
+            ],
+            'source': 'road' if roads.road_graph() is not None else 'straight_line',
+        })
+    
+    return JsonResponse({'error': 'Invalid request method'}, status=405)
+
 # Helper functions
+def create_assignments(pairs, details=None):
+    """Create assignments for (agent_id, client_id) pairs and notify everyone.
+    
+    `details`, if given, holds a dict of extra Assignment fields per pair.
+    
+    Safe to call from many workers at once. The agents and clients are
+    locked with SKIP LOCKED, so rows another dispatcher is busy with are
+    skipped rather than waited on. Pairs whose client is no longer pending,
+    or whose agent already had open work, are dropped; one call may still
+    give an agent several stops. Returns the assignments actually created.
+    """
+    if not pairs:
+        return []
+    details = details or [{}] * len(pairs)
+    
+    try:
+        with transaction.atomic():
+            agents = User.objects.select_for_update(skip_locked=True).filter(
+                user_type='agent', is_active_agent=True
+            ).in_bulk([agent_id for agent_id, _ in pairs])
+            clients = Client.objects.select_for_update(skip_locked=True).filter(
+                status='pending'
+            ).in_bulk([client_id for _, client_id in pairs])
+            busy = set(
+                Assignment.objects.filter(agent_id__in=agents, status__in=ACTIVE_ASSIGNMENT_STATUSES)
+                .values_list('agent_id', flat=True)
+            )
+            
+            claimed = set()
+            assignments = []
+            for (agent_id, client_id), extra in zip(pairs, details):
+                if agent_id not in agents or agent_id in busy or client_id not in clients or client_id in claimed:
+                    continue
+                claimed.add(client_id)
+                assignments.append(
+                    Assignment(agent=agents[agent_id], client=clients[client_id], status='assigned', **extra)
+                )
+            if not assignments:
+                return []
+            
+            Assignment.objects.bulk_create(assignments)
+            Client.objects.filter(id__in=claimed).update(status='assigned', updated_at=timezone.now())
+            transaction.on_commit(lambda: _assignments_committed(assignments))
+    except IntegrityError:
+        # A writer outside this path booked one of the clients first
+        return []
+    
+    return assignments
+
+def _assignments_committed(assignments):
+    invalidate_dashboard_stats()
+    pending_index = spatial.client_index()
+    for assignment in assignments:
+        assignment.client.status = 'assigned'
+        pending_index.remove(assignment.client.id)
+        # Send real-time notification
+        send_assignment_notification(assignment)
+
 def send_assignment_notification(assignment):
     """Send real-time notification about new assignment"""
     channel_layer = get_channel_layer()
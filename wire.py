@@ -0,0 +1,114 @@
+"""
+Compact binary frames for the operations WebSocket.
+
+Clients opt in by offering the SUBPROTOCOL WebSocket subprotocol; JSON
+text stays the default. Only the high-volume frames are binary: location
+batches to managers and location updates from agents. Everything else is
+JSON text in both encodings. Agent names are not repeated in binary
+batches. The consumer sends each name once per socket in a JSON
+`agent_names` frame.
+
+All fields are little-endian. Coordinates are int32 micro-degrees and
+timestamps are uint32 seconds since the epoch, with 0 meaning unknown.
+
+    location batch (server -> manager)
+        uint8 type = 1, uint8 reserved, uint16 count,
+        count x (uint32 agent_id, int32 lat, int32 lng, uint32 timestamp)
+    location update (agent -> server)
+        uint8 type = 2, uint8 reserved, uint16 accuracy in metres (0xFFFF unknown),
+        int32 lat, int32 lng, uint32 timestamp
+
+Compression (permessage-deflate) is negotiated by the ASGI server, not the
+consumer. uvicorn with the websockets implementation enables it by default.
+"""
+import functools
+import struct
+from datetime import datetime, timezone as dt_timezone
+
+SUBPROTOCOL = 'ops.bin.v1'
+
+LOCATION_BATCH = 1
+LOCATION_UPDATE = 2
+
+HEADER = struct.Struct('<BBH')
+LOCATION_ROW = struct.Struct('<IiiI')
+LOCATION_UPDATE_FRAME = struct.Struct('<BBHiiI')
+MAX_BATCH = 0xFFFF
+UNKNOWN_ACCURACY = 0xFFFF
+
+
+@functools.lru_cache(maxsize=65536)
+def _parse_iso(timestamp):
+    # The same fix is packed once per tile group, so parses repeat
+    try:
+        parsed = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except ValueError:
+        return 0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return max(int(parsed.timestamp()), 0)
+
+
+def _epoch_seconds(timestamp):
+    """Seconds since the epoch for an ISO string or epoch number; 0 if unknown"""
+    if timestamp is None or timestamp == '':
+        return 0
+    if isinstance(timestamp, (int, float)):
+        # Browsers send milliseconds
+        return int(timestamp / 1000 if timestamp > 1e11 else timestamp)
+    return _parse_iso(str(timestamp))
+
+
+def pack_location_batch(agents):
+    """Binary frames for a list of location_batch entries, at most MAX_BATCH agents each"""
+    frames = []
+    for start in range(0, len(agents), MAX_BATCH):
+        chunk = agents[start:start + MAX_BATCH]
+        frames.append(HEADER.pack(LOCATION_BATCH, 0, len(chunk)) + b''.join(
+            LOCATION_ROW.pack(
+                update['agent_id'],
+                round(float(update['latitude']) * 1e6),
+                round(float(update['longitude']) * 1e6),
+                _epoch_seconds(update.get('timestamp')),
+            )
+            for update in chunk
+        ))
+    return frames
+
+
+def unpack_location_batch(frame):
+    """Inverse of pack_location_batch for one frame; names are not included"""
+    kind, _, count = HEADER.unpack_from(frame)
+    if kind != LOCATION_BATCH:
+        raise ValueError(f'Not a location batch frame: {kind}')
+    rows = struct.iter_unpack(LOCATION_ROW.format, frame[HEADER.size:HEADER.size + count * LOCATION_ROW.size])
+    return [
+        {'agent_id': agent_id, 'latitude': lat / 1e6, 'longitude': lng / 1e6, 'timestamp': timestamp or None}
+        for agent_id, lat, lng, timestamp in rows
+    ]
+
+
+def pack_location_update(latitude, longitude, accuracy=None, timestamp=None):
+    """Binary location update, as an agent client sends it"""
+    accuracy = UNKNOWN_ACCURACY if accuracy is None else min(int(round(accuracy)), UNKNOWN_ACCURACY - 1)
+    return LOCATION_UPDATE_FRAME.pack(
+        LOCATION_UPDATE, 0, accuracy,
+        int(round(latitude * 1e6)), int(round(longitude * 1e6)), _epoch_seconds(timestamp),
+    )
+
+
+def unpack_client_frame(frame):
+    """Decode a binary frame from a client into the equivalent JSON message"""
+    if len(frame) < HEADER.size:
+        raise ValueError('Frame too short')
+    kind = frame[0]
+    if kind != LOCATION_UPDATE or len(frame) != LOCATION_UPDATE_FRAME.size:
+        raise ValueError(f'Unsupported frame type {kind}')
+    _, _, accuracy, lat, lng, timestamp = LOCATION_UPDATE_FRAME.unpack(frame)
+    return {
+        'type': 'location_update',
+        'latitude': lat / 1e6,
+        'longitude': lng / 1e6,
+        'accuracy': None if accuracy == UNKNOWN_ACCURACY else accuracy,
+        'timestamp': datetime.fromtimestamp(timestamp, dt_timezone.utc).isoformat() if timestamp else None,
+    }